@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+# Ce fichier maintient des agrégats cumulés (sommes préfixes) sur tout l'historique de la copie locale.
+# - Par numéro : prefixe[k] = nombre d'apparitions de chaque numéro dans les tirages [0, k).
+#   La fréquence sur une plage [a, b) est prefixe[b] - prefixe[a] : O(90), quelle que soit la plage.
+# - Par paire (compagnons, précurseurs) : un point de reprise 90x90 tous les TAILLE_BLOC tirages.
+#   Une plage coûte deux points de reprise et au plus deux blocs partiels (<= TAILLE_BLOC tirages).
+# - Dernière apparition de chaque numéro : l'écart est une soustraction, la forme sur n'importe quelle
+#   fenêtre une différence de sommes préfixes (les masques de la copie locale sont l'historique en bits).
+# - Index calendaire : nombre d'apparitions de chaque numéro par jour du mois, mois, jour de la semaine
+#   et heure de tirage (74 lignes x 90), avec un point de reprise tous les TAILLE_BLOC tirages :
+#   les affinités d'une date quelconque (arrêtées à cette date) se lisent sans parcourir les tirages.
+# Les agrégats sont enregistrés à côté de la copie locale et prolongés quand des tirages arrivent ;
+# une insertion au milieu de l'historique (empreinte différente) impose une reconstruction.
+
+import os
+import hashlib
+import numpy as np
+
+import calcul_matriciel
+import stockage_local
+
+# --- CONFIGURATIONS ---
+FENETRE_RGNTC = 3
+TAILLE_BLOC = 256
+NOM_FICHIER = "agregats.npz"
+# Dimensions de l'index calendaire (dates UTC, comme les horodatages de la copie locale)
+DIMENSIONS_CALENDRIER = {"jour": 31, "mois": 12, "jour_semaine": 7, "heure": 24}
+DECALAGES_CALENDRIER = np.cumsum([0] + list(DIMENSIONS_CALENDRIER.values())[:-1])
+LIGNES_CALENDRIER = sum(DIMENSIONS_CALENDRIER.values())
+
+# Agrégats déjà chargés par ce processus : (version de la copie locale, agregats)
+_agregats_memoire = None
+
+def empreinte(colonnes, nombre):
+    empreinte = hashlib.sha1()
+    empreinte.update(np.ascontiguousarray(colonnes["horodatages"][:nombre]).tobytes())
+    empreinte.update(np.ascontiguousarray(colonnes["masques"][:nombre]).tobytes())
+    return empreinte.hexdigest()
+
+def _sommes_precedentes(prefixe, debut, fin, fenetre):
+    """Lignes [debut, fin) : somme des `fenetre` tirages précédents (sur tout l'historique)."""
+    indices = np.arange(debut, fin)
+    return prefixe[indices] - prefixe[np.maximum(0, indices - fenetre)]
+
+def categories_calendrier(horodatages):
+    """Lignes de l'index calendaire de chaque tirage : tableau (N, 4) jour du mois, mois, jour de la semaine, heure."""
+    secondes = np.asarray(horodatages, dtype=np.int64)
+    jours = secondes // 86400
+    dates = jours.astype("datetime64[D]")
+    mois = dates.astype("datetime64[M]")
+    categories = np.stack([(dates - mois).astype(np.int64), mois.astype(np.int64) % 12,
+                           (jours + 3) % 7, (secondes % 86400) // 3600], axis=1)  # le 1er janvier 1970 est un jeudi
+    return categories + DECALAGES_CALENDRIER
+
+def _comptes_calendrier(X, horodatages):
+    """Index calendaire (LIGNES_CALENDRIER x 90) des tirages X."""
+    categories = categories_calendrier(horodatages)
+    appartenance = np.zeros((len(categories), LIGNES_CALENDRIER), dtype=np.int32)
+    appartenance[np.arange(len(categories))[:, None], categories] = 1
+    return appartenance.T @ X.astype(np.int32)
+
+def _prolonger(agregats, X, horodatages):
+    """Étend les sommes préfixes et les points de reprise aux tirages X[nombre:]."""
+    ancien, nouveau, f, b = agregats["nombre"], X.shape[0], agregats["fenetre"], agregats["taille_bloc"]
+    cumul = np.cumsum(X[ancien:], axis=0, dtype=np.int32) + agregats["prefixe"][ancien]
+    agregats["prefixe"] = np.vstack([agregats["prefixe"][:ancien + 1], cumul])
+    compagnons, precurseurs = [agregats["points_compagnons"]], [agregats["points_precurseurs"]]
+    calendrier = [agregats["points_calendrier"]]
+    for k in range(ancien // b + 1, nouveau // b + 1):
+        bloc = X[(k - 1) * b:k * b].astype(np.int32)
+        S = _sommes_precedentes(agregats["prefixe"], (k - 1) * b, k * b, f)
+        compagnons.append((compagnons[-1][-1] + bloc.T @ bloc)[None])
+        precurseurs.append((precurseurs[-1][-1] + bloc.T @ S)[None])
+        calendrier.append((calendrier[-1][-1] + _comptes_calendrier(bloc, horodatages[(k - 1) * b:k * b]))[None])
+    agregats["points_compagnons"] = np.concatenate(compagnons)
+    agregats["points_precurseurs"] = np.concatenate(precurseurs)
+    agregats["points_calendrier"] = np.concatenate(calendrier)
+    derniere = calcul_matriciel.derniere_apparition(X[ancien:], ancien)
+    agregats["derniere_apparition"] = np.where(derniere >= 0, derniere, agregats["derniere_apparition"])
+    agregats["nombre"] = nouveau
+
+def construire(X, horodatages, fenetre=FENETRE_RGNTC, taille_bloc=TAILLE_BLOC):
+    """Agrégats complets d'une matrice d'incidence (tirages x 90, triés par date) et de ses horodatages."""
+    agregats = {
+        "fenetre": fenetre, "taille_bloc": taille_bloc, "nombre": 0,
+        "prefixe": np.zeros((1, calcul_matriciel.NUMERO_MAX), dtype=np.int32),
+        "points_compagnons": np.zeros((1, calcul_matriciel.NUMERO_MAX, calcul_matriciel.NUMERO_MAX), dtype=np.int32),
+        "points_precurseurs": np.zeros((1, calcul_matriciel.NUMERO_MAX, calcul_matriciel.NUMERO_MAX), dtype=np.int32),
+        "points_calendrier": np.zeros((1, LIGNES_CALENDRIER, calcul_matriciel.NUMERO_MAX), dtype=np.int32),
+        "derniere_apparition": np.full(calcul_matriciel.NUMERO_MAX, -1, dtype=np.int64),
+    }
+    _prolonger(agregats, X, horodatages)
+    return agregats
+
+def _cumul_paires(agregats, X, k):
+    """(compagnons, précurseurs) cumulés sur les tirages [0, k), précurseurs comptés sur tout l'historique."""
+    b = agregats["taille_bloc"]
+    point = k // b
+    compagnons = agregats["points_compagnons"][point].astype(np.int64)
+    precurseurs = agregats["points_precurseurs"][point].astype(np.int64)
+    if k > point * b:
+        bloc = X[point * b:k].astype(np.int64)
+        compagnons = compagnons + bloc.T @ bloc
+        precurseurs = precurseurs + bloc.T @ _sommes_precedentes(agregats["prefixe"], point * b, k, agregats["fenetre"]).astype(np.int64)
+    return compagnons, precurseurs
+
+def frequences(agregats, debut, fin):
+    """Nombre d'apparitions de chaque numéro dans les tirages [debut, fin)."""
+    return (agregats["prefixe"][fin] - agregats["prefixe"][debut]).astype(np.int64)
+
+def matrices_plage(agregats, X, debut, fin):
+    """Matrices RGNTC de la plage [debut, fin), identiques à calcul_matriciel.matrices_rgntc(X[debut:fin])."""
+    compagnons_fin, precurseurs_fin = _cumul_paires(agregats, X, fin)
+    compagnons_debut, precurseurs_debut = _cumul_paires(agregats, X, debut)
+    compagnons, precurseurs = compagnons_fin - compagnons_debut, precurseurs_fin - precurseurs_debut
+    np.fill_diagonal(compagnons, 0)
+    # Les premiers tirages de la plage ne doivent pas compter de précurseurs antérieurs à `debut`
+    prefixe, f = agregats["prefixe"], agregats["fenetre"]
+    for i in range(debut, min(debut + f, fin)):
+        exterieurs = (prefixe[debut] - prefixe[max(0, i - f)]).astype(np.int64)
+        precurseurs -= np.outer(X[i].astype(np.int64), exterieurs)
+    return {"precurseurs": precurseurs, "compagnons": compagnons, "suiveurs": precurseurs.T}
+
+def calendrier_plage(agregats, X, horodatages, debut, fin):
+    """Index calendaire (LIGNES_CALENDRIER x 90) des tirages [debut, fin)."""
+    def cumul(k):
+        point = k // agregats["taille_bloc"]
+        comptes = agregats["points_calendrier"][point].astype(np.int64)
+        debut_bloc = point * agregats["taille_bloc"]
+        if k > debut_bloc: comptes = comptes + _comptes_calendrier(X[debut_bloc:k], horodatages[debut_bloc:k])
+        return comptes
+    return cumul(fin) - cumul(debut)
+
+def formes_et_ecarts(agregats, fenetres):
+    """Forme et écart de chaque numéro après le dernier tirage, pour toutes les `fenetres` (None = tout) en O(90) chacune."""
+    prefixe, nombre = agregats["prefixe"], agregats["nombre"]
+    formes = {f: (prefixe[nombre] - prefixe[max(0, nombre - f) if f else 0]).astype(np.int64) for f in fenetres}
+    return calcul_matriciel.formes_et_ecarts(formes, agregats["derniere_apparition"], nombre)
+
+def _favoris(ligne, top):
+    ordre = np.argsort(-ligne, kind="stable")[:top]  # à égalité, le plus petit numéro d'abord
+    return [(int(i) + 1, int(ligne[i])) for i in ordre if ligne[i] > 0]
+
+def affinites_calendrier(comptes, date_cible, heures=(), top=5):
+    """Numéros favoris du jour du mois, du mois et du jour de la semaine de `date_cible`, et de chaque
+    heure de `heures` ("HH:MM") : {"jour", "mois", "jour_semaine", "creneaux": {heure: favoris}}."""
+    jour, mois, jour_semaine, heure = DECALAGES_CALENDRIER
+    return {
+        "jour": _favoris(comptes[jour + date_cible.day - 1], top),
+        "mois": _favoris(comptes[mois + date_cible.month - 1], top),
+        "jour_semaine": _favoris(comptes[jour_semaine + date_cible.weekday()], top),
+        "creneaux": {h: _favoris(comptes[heure + int(h[:2])], top) for h in heures},
+    }
+
+def sauvegarder(agregats, empreinte, chemin):
+    temporaire = f"{chemin}.{os.getpid()}.tmp.npz"  # un fichier temporaire par worker
+    np.savez_compressed(temporaire, empreinte=np.array(empreinte), **{k: np.asarray(v) for k, v in agregats.items()})
+    os.replace(temporaire, chemin)
+
+def charger(chemin):
+    try:
+        with np.load(chemin) as donnees:
+            agregats = {k: donnees[k] for k in donnees.files}
+    except (OSError, ValueError):
+        return None, None
+    for cle in ("fenetre", "taille_bloc", "nombre"):
+        agregats[cle] = int(agregats[cle])
+    return agregats, str(agregats.pop("empreinte"))
+
+def agregats_copie_locale(fenetre=FENETRE_RGNTC):
+    """Retourne (agregats, X) à jour avec la copie locale des tirages, ou (None, None) si elle est vide.
+    Le fichier est prolongé (nouveaux tirages) ou reconstruit (historique modifié) si nécessaire."""
+    global _agregats_memoire
+    colonnes, _ = stockage_local.charger_colonnes()
+    meta = stockage_local.lire_meta()
+    if colonnes is None or not meta: return None, None
+    if _agregats_memoire and _agregats_memoire[0] == (meta["version"], fenetre):
+        return _agregats_memoire[1]
+    X = calcul_matriciel.matrice_depuis_masques(colonnes["masques"])
+    chemin = os.path.join(stockage_local.DOSSIER_STOCKAGE, NOM_FICHIER)
+    agregats, empreinte_fichier = charger(chemin)
+    nombre = len(X)
+    if (agregats is None or agregats["fenetre"] != fenetre or agregats["taille_bloc"] != TAILLE_BLOC
+            or any(cle not in agregats for cle in ("points_calendrier", "derniere_apparition")) or agregats["nombre"] > nombre
+            or empreinte_fichier != empreinte(colonnes, agregats["nombre"])):
+        print("-> Agrégats cumulés absents ou périmés : reconstruction sur tout l'historique.")
+        agregats = construire(X, colonnes["horodatages"], fenetre)
+        sauvegarder(agregats, empreinte(colonnes, nombre), chemin)
+    elif agregats["nombre"] < nombre:
+        print(f"-> Agrégats cumulés prolongés de {nombre - agregats['nombre']} tirage(s).")
+        _prolonger(agregats, X, colonnes["horodatages"])
+        sauvegarder(agregats, empreinte(colonnes, nombre), chemin)
+    _agregats_memoire = ((meta["version"], fenetre), (agregats, X))
+    return agregats, X
+
+def indices_plage(horodatages, date_debut=None, date_fin=None):
+    """Indices [debut, fin) des tirages dont la date est dans [date_debut, date_fin] (bornes optionnelles)."""
+    debut = 0 if date_debut is None else int(np.searchsorted(horodatages, calcul_matriciel.horodatage(date_debut), side="left"))
+    fin = len(horodatages) if date_fin is None else int(np.searchsorted(horodatages, calcul_matriciel.horodatage(date_fin), side="right"))
+    return debut, max(debut, fin)
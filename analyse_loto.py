@@ -1,41 +1,79 @@
 # -*- coding: utf-8 -*-
 # Ce fichier est une bibliothèque de fonctions qui lit depuis Firestore.
 
-import firebase_admin
-from firebase_admin import credentials, firestore
 from collections import defaultdict, Counter
 import time
 import json
 import os
+import importlib
+import importlib.util
 from datetime import datetime, timedelta
 import re
-import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 
 # --- Imports pour la visualisation et l'IA ---
-try:
-    import matplotlib
-    matplotlib.use('Agg') 
-    import matplotlib.pyplot as plt
-    import seaborn as sns
-    VISUALISATION_DISPONIBLE = True
-    ERREUR_VISUALISATION = None
-except Exception as e:
-    VISUALISATION_DISPONIBLE = False
-    ERREUR_VISUALISATION = str(e)
+# Ces bibliothèques sont lourdes : on vérifie seulement ici qu'elles sont installées, elles ne sont
+# importées qu'à la première utilisation (ou par precharger_dependances, ex. maître gunicorn).
+def module_disponible(nom):
+    try:
+        return importlib.util.find_spec(nom) is not None
+    except (ImportError, ValueError):
+        return False
+
+MODULES_VISUALISATION = ("matplotlib", "seaborn", "pandas")
+VISUALISATION_DISPONIBLE = all(module_disponible(m) for m in MODULES_VISUALISATION)
+ERREUR_VISUALISATION = None if VISUALISATION_DISPONIBLE else "Modules manquants : " + ", ".join(m for m in MODULES_VISUALISATION if not module_disponible(m))
+IA_DISPONIBLE = module_disponible("google.generativeai")
+_genai = None
+
+def charger_genai():
+    global _genai
+    if _genai is None:
+        import google.generativeai as genai
+        _genai = genai
+    return _genai
+
+def precharger_dependances():
+    """Importe à l'avance les bibliothèques lourdes (visualisation, pandas, IA, Firestore)."""
+    debut = time.perf_counter()
+    for nom in ("pandas", "matplotlib", "seaborn", "google.generativeai", "firebase_admin.firestore", "requests"):
+        try:
+            module = importlib.import_module(nom)
+            if nom == "matplotlib": module.use('Agg')
+        except Exception as e:
+            print(f"-> Préchargement de {nom} impossible : {e}")
+    print(f"-> Dépendances préchargées en {time.perf_counter() - debut:.2f} s.")
 
+# Moteur vectorisé pour les relations RGNTC (NumPy)
 try:
-    import google.generativeai as genai
-    IA_DISPONIBLE = True
+    import calcul_matriciel
+    import rgntc_incremental
+    import stockage_local
+    import rendu_heatmaps
+    import agregats_cumules
+    import cooccurrences
+    import resume_firestore
+    import numpy as np
+    NUMPY_DISPONIBLE = True
 except ImportError:
-    IA_DISPONIBLE = False
+    NUMPY_DISPONIBLE = False
 
 # On importe les fonctions du collecteur
 try:
-    from cron_update_firestore import get_latest_data_from_api, parse_and_transform
+    from cron_update_firestore import get_latest_data_from_api, parse_and_transform, memoriser_dernier_tirage, lire_dernier_tirage_memorise
     MODULES_COLLECTE_DISPONIBLES = True
 except ImportError:
     MODULES_COLLECTE_DISPONIBLES = False
 
+# Représentation compacte des tirages (masques 90 bits)
+from tirage_compact import Tirage
+# Cache en mémoire des données Firestore (tirages, connaissance)
+import cache_donnees
+# Durées des étapes, compteurs Firestore et Gemini (route /metrics)
+import metriques
+# Cache des réponses de Gemini adressé par l'empreinte du prompt (mémoire + Firestore)
+import cache_reponses_ia
+
 # --- On importe les secrets ---
 try:
     import settings
@@ -48,144 +86,377 @@ db = None
 
 # --- CONFIGURATIONS ---
 FENETRE_RGNTC = 3
+MODELE_GEMINI = os.environ.get("MODELE_GEMINI", "gemini-2.5-flash")
+MOTEUR_RGNTC = os.environ.get("MOTEUR_RGNTC", "numpy")  # "numpy" (vectorisé) ou "python" (référence)
+LIMITE_TIRAGES = 1000
+TTL_CACHE_TIRAGES = int(os.environ.get("TTL_CACHE_TIRAGES", "900"))  # invalidé aussi à chaque collecte
+TTL_CACHE_CONNAISSANCE = int(os.environ.get("TTL_CACHE_CONNAISSANCE", "86400"))
+UTILISER_STOCKAGE_LOCAL = os.environ.get("UTILISER_STOCKAGE_LOCAL", "1") == "1"  # copie locale mmap des tirages
 FENETRE_FORME_ECART = 50
+FENETRES_FORME_ECART = [10, FENETRE_FORME_ECART, 200, None]  # None : tout l'historique chargé
 NOMBRE_CANDIDATS_A_ANALYSER = 15
 TOP_N_HEATMAP = 25
+MAX_APPELS_IA_PARALLELES = int(os.environ.get("MAX_APPELS_IA_PARALLELES", "3"))  # analyses groupées de la journée
+K_MAX_COOCCURRENCES = 100  # taille maximale d'une réponse de la route admin des co-occurrences
+TTL_CONTEXTE = int(os.environ.get("TTL_CONTEXTE", "120"))  # secondes pendant lesquelles le dernier tirage connu est réutilisé
+# Période des relations RGNTC : "recent" (LIMITE_TIRAGES derniers tirages), "annee", "complet" ou
+# "plage:AAAA-MM-JJ:AAAA-MM-JJ" (bornes optionnelles). Hors "recent", calcul par les agrégats cumulés.
+MODE_ANALYSE = os.environ.get("MODE_ANALYSE", "recent")
+MODES_ANALYSE = {"recent": f"{LIMITE_TIRAGES} derniers tirages", "annee": "12 derniers mois", "complet": "Historique complet"}
+HEURES_TIRAGES = ["07:00", "08:00", "10:00", "13:00", "16:00", "19:00", "21:00", "22:00", "23:00"]
 
 # --- FONCTIONS ---
+def calculer_cible(heure_dernier_tirage_str):
+    """Cible de la prédiction (prochain créneau de HEURES_TIRAGES) après un tirage à cette heure."""
+    try:
+        index_actuel = HEURES_TIRAGES.index(heure_dernier_tirage_str)
+        if index_actuel + 1 < len(HEURES_TIRAGES):
+            return f"Aujourd'hui ({HEURES_TIRAGES[index_actuel + 1]})"
+    except ValueError: pass
+    return f"Demain ({HEURES_TIRAGES[0]})"
+
+def calculer_id_cache(date_dernier_tirage, cible_tirage, mode="recent"):
+    """ID du document predictions_cache : jour du dernier tirage + cible (+ mode s'il n'est pas "recent").
+    Basé sur le dernier tirage (et non sur l'heure courante) pour que la cible « Demain » calculée le soir
+    reste valable après minuit."""
+    id_cache = f"{date_dernier_tirage.strftime('%Y-%m-%d')}_{cible_tirage.replace(' ', '').replace(':', 'h').replace('(', '').replace(')', '')}"
+    if mode != "recent": id_cache += "_" + re.sub(r'[^a-zA-Z0-9-]', '', mode.replace(':', '_'))
+    return id_cache
+
+def bornes_mode_analyse(mode):
+    """(date_debut, date_fin) d'un mode d'analyse, None pour une borne ouverte. Lève ValueError si le mode est invalide."""
+    if mode == "complet": return None, None
+    if mode == "annee": return datetime.now() - timedelta(days=365), None
+    if mode.startswith("plage:"):
+        _, debut, fin = mode.split(":")
+        date_debut = datetime.strptime(debut, '%Y-%m-%d') if debut else None
+        date_fin = datetime.strptime(fin, '%Y-%m-%d') + timedelta(days=1, seconds=-1) if fin else None
+        if date_debut and date_fin and date_debut > date_fin: raise ValueError("La date de début est postérieure à la date de fin.")
+        return date_debut, date_fin
+    raise ValueError(f"Mode d'analyse inconnu : {mode}")
+
+def mode_analyse_valide(mode):
+    if mode == "recent": return True
+    try:
+        bornes_mode_analyse(mode); return True
+    except ValueError:
+        return False
+
+def libelle_mode_analyse(mode):
+    if mode in MODES_ANALYSE: return MODES_ANALYSE[mode]
+    _, debut, fin = mode.split(":")
+    return f"Tirages du {debut or 'début'} au {fin or 'dernier tirage'}"
+
 def detecter_prochain_tirage_et_contexte():
+    """Dernier tirage et cible. Le dernier tirage vient du contexte mémorisé (par le collecteur ou un
+    appel récent) tant qu'il a moins de TTL_CONTEXTE secondes ; sinon de l'API (requête conditionnelle),
+    et en dernier recours de la copie locale des tirages."""
     if not MODULES_COLLECTE_DISPONIBLES: return None, "Module de collecte manquant"
-    api_data = get_latest_data_from_api()
-    tirages_recents = parse_and_transform(api_data) 
-    if not tirages_recents: return None, "Impossible de déterminer le contexte (API inaccessible)"
-    tirages_recents.sort(key=lambda x: x['data']['date_obj'], reverse=True)
-    dernier_tirage_api = tirages_recents[0]
-    heure_dernier_tirage_str = dernier_tirage_api['data']['date_obj'].strftime('%H:%M')
-    heures_ordonnees = ["07:00", "08:00", "10:00", "13:00", "16:00", "19:00", "21:00", "22:00", "23:00"]
-    cible = "Demain (07:00)"
+    dernier_tirage_api = lire_dernier_tirage_memorise(TTL_CONTEXTE)
+    if dernier_tirage_api is None:
+        api_data = get_latest_data_from_api()
+        tirages_recents = parse_and_transform(api_data) 
+        if tirages_recents:
+            memoriser_dernier_tirage(tirages_recents)
+            dernier_tirage_api = max(tirages_recents, key=lambda x: x['data']['date_obj'])
+        else:
+            dernier_tirage_api = lire_dernier_tirage_stockage_local()
+    if not dernier_tirage_api: return None, "Impossible de déterminer le contexte (API inaccessible)"
+    return dernier_tirage_api, calculer_cible(dernier_tirage_api['data']['date_obj'].strftime('%H:%M'))
+
+def lire_dernier_tirage_stockage_local():
+    """Dernier tirage de la copie locale, au format du collecteur ({"doc_id", "data"})."""
+    if not (NUMPY_DISPONIBLE and UTILISER_STOCKAGE_LOCAL): return None
     try:
-        index_actuel = heures_ordonnees.index(heure_dernier_tirage_str)
-        if index_actuel + 1 < len(heures_ordonnees):
-            cible = f"Aujourd'hui ({heures_ordonnees[index_actuel + 1]})"
-    except ValueError: pass
-    return dernier_tirage_api, cible
+        tirages = stockage_local.lire_tirages(1)
+    except Exception:
+        return None
+    if not tirages: return None
+    t = tirages[-1]
+    print("-> API inaccessible : contexte tiré de la copie locale des tirages.")
+    return {"doc_id": rgntc_incremental.cle_tirage(t.date_obj, t.nom_du_tirage), "data": t.vers_dict()}
+
+def lire_resume(db):
+    """Document de résumé maintenu par le collecteur (1 lecture, mis en cache), None s'il est absent."""
+    if not (db and NUMPY_DISPONIBLE): return None
+    def charger():
+        try:
+            resume = resume_firestore.lire(db)
+        except Exception as e:
+            print(f"❌ Résumé d'analyse illisible : {e}"); return None
+        if resume: print(f"-> Résumé d'analyse chargé ({len(resume['tirages'])} tirages récents, {resume['nombre_total']} au total).")
+        return resume
+    return cache_donnees.obtenir("resume", charger, TTL_CACHE_TIRAGES)
 
 def lire_tirages_depuis_firestore(db):
-    """Lit les 1000 derniers tirages depuis Firestore pour l'analyse."""
+    """Lit les LIMITE_TIRAGES derniers tirages pour l'analyse (copie locale synchronisée, sinon résumé, sinon Firestore)."""
     if not db: return None
+    if NUMPY_DISPONIBLE and UTILISER_STOCKAGE_LOCAL:
+        try:
+            stockage_local.synchroniser(db)
+            tirages = stockage_local.lire_tirages(LIMITE_TIRAGES)
+            if tirages:
+                print(f"-> {len(tirages)} tirages récents chargés depuis la copie locale.")
+                return tirages
+        except Exception as e:
+            print(f"❌ Copie locale des tirages indisponible, lecture directe : {e}")
+    resume = lire_resume(db)
+    if resume and len(resume["tirages"]) >= min(LIMITE_TIRAGES, resume["nombre_total"]):
+        return resume["tirages"][-LIMITE_TIRAGES:]
     print("-> Lecture des tirages depuis Firestore (Optimisée)...")
     try:
         # --- OPTIMISATION ICI : On ne lit que les 1000 derniers tirages ---
-        tirages_ref = db.collection('tirages').order_by('date_obj', direction='DESCENDING').limit(1000)
-        docs = tirages_ref.stream()
-        tirages = []
-        for doc in docs:
-            data = doc.to_dict()
-            gagnants, machine = data.get('gagnants', []), data.get('machine', [])
-            numeros_sortis = set(gagnants + machine)
-            date_obj = data.get('date_obj')
-            if isinstance(date_obj, str): date_obj = datetime.fromisoformat(date_obj)
-            tirages.append({"date_obj": date_obj, "nom_du_tirage": data.get("nom_du_tirage"), "gagnants": gagnants, "machine": machine, "numeros_sortis": list(numeros_sortis)})
+        tirages_ref = db.collection('tirages').order_by('date_obj', direction='DESCENDING').limit(LIMITE_TIRAGES)
+        docs = list(tirages_ref.stream())
+        metriques.compter_lectures('tirages', len(docs))
+        tirages = [Tirage.depuis_dict(doc.to_dict()) for doc in docs]
         print(f"-> {len(tirages)} tirages récents chargés depuis Firestore.")
-        return sorted(tirages, key=lambda x: x['date_obj'])
+        return sorted(tirages, key=lambda x: x.date_obj)
     except Exception as e:
         print(f"❌ Erreur lecture tirages Firestore : {e}"); return None
 
 def lire_base_connaissance_depuis_firestore(db):
     if not db: return None
+    resume = lire_resume(db)
+    if resume and resume["connaissance"]:
+        return resume["connaissance"]
     print("-> Lecture de la base de connaissance depuis Firestore...")
     try:
-        docs = db.collection('connaissance').stream()
+        docs = list(db.collection('connaissance').stream())
+        metriques.compter_lectures('connaissance', len(docs))
         base_connaissance = {int(doc.id): set(doc.to_dict().get('accompagnateurs', [])) for doc in docs}
         print(f"-> {len(base_connaissance)} règles de connaissance chargées.")
         return base_connaissance
     except Exception as e:
         print(f"❌ Erreur lecture connaissance Firestore : {e}"); return None
 
-def analyser_affinites_temporelles(tous_les_tirages, date_cible):
-    jour_cible, mois_cible = date_cible.day, date_cible.month
-    frequence_jour, frequence_mois = Counter(), Counter()
+def analyser_affinites_temporelles(tous_les_tirages, date_cible, heures=()):
+    """Moteur de référence (parcours des tirages) : mêmes résultats que l'index calendaire."""
+    frequences = {"jour": Counter(), "mois": Counter(), "jour_semaine": Counter()}
+    frequences_creneaux = {h: Counter() for h in heures}
     for tirage in tous_les_tirages:
-        if tirage['date_obj'].date() < date_cible:
-            if tirage['date_obj'].day == jour_cible: frequence_jour.update(tirage['numeros_sortis'])
-            if tirage['date_obj'].month == mois_cible: frequence_mois.update(tirage['numeros_sortis'])
-    return frequence_jour.most_common(5), frequence_mois.most_common(5)
+        date_tirage = tirage.date_obj
+        if date_tirage.date() < date_cible:
+            numeros = tirage.numeros_sortis
+            if date_tirage.day == date_cible.day: frequences["jour"].update(numeros)
+            if date_tirage.month == date_cible.month: frequences["mois"].update(numeros)
+            if date_tirage.weekday() == date_cible.weekday(): frequences["jour_semaine"].update(numeros)
+            for h in heures:
+                if date_tirage.hour == int(h[:2]): frequences_creneaux[h].update(numeros)
+    favoris = lambda c: sorted(c.items(), key=lambda x: (-x[1], x[0]))[:5]
+    affinites = {k: favoris(c) for k, c in frequences.items()}
+    affinites["creneaux"] = {h: favoris(c) for h, c in frequences_creneaux.items()}
+    return affinites
+
+def date_et_heures_cible(date_dernier_tirage, cible_tirage):
+    """Date du tirage cible et créneaux restants ce jour-là, à partir de la cible (« Aujourd'hui (10:00) »)."""
+    heure_cible = cible_tirage[-6:-1]
+    date_cible = date_dernier_tirage.date() + timedelta(days=1 if cible_tirage.startswith("Demain") else 0)
+    return date_cible, HEURES_TIRAGES[HEURES_TIRAGES.index(heure_cible):] if heure_cible in HEURES_TIRAGES else [heure_cible]
 
-def analyser_relations_rgntc(tous_les_tirages, fenetre=FENETRE_RGNTC):
+def calculer_affinites_temporelles(tous_les_tirages, date_cible, heures=(), mode="recent"):
+    """Affinités arrêtées à la veille de `date_cible`, pour tous les créneaux `heures` à la fois : lues dans
+    l'index calendaire de la copie locale (sur la période du mode), sinon par parcours des tirages chargés."""
+    plage = plage_copie_locale(mode)
+    if plage:
+        agregats, X, horodatages, debut, fin = plage
+        veille = int(np.searchsorted(horodatages, calcul_matriciel.horodatage(datetime.combine(date_cible, datetime.min.time()))))
+        comptes = agregats_cumules.calendrier_plage(agregats, X, horodatages, debut, max(debut, min(fin, veille)))
+        return agregats_cumules.affinites_calendrier(comptes, date_cible, heures)
+    return analyser_affinites_temporelles(tous_les_tirages, date_cible, heures)
+
+def analyser_relations_rgntc(tous_les_tirages, fenetre=FENETRE_RGNTC, moteur=None):
+    moteur = moteur or MOTEUR_RGNTC
+    if moteur == "numpy" and NUMPY_DISPONIBLE:
+        return analyser_relations_rgntc_numpy(tous_les_tirages, fenetre)
     print("-> Calcul des relations RGNTC...")
     rapport = defaultdict(lambda: {k: Counter() for k in ["precurseurs", "compagnons", "suiveurs"]})
     total = len(tous_les_tirages)
-    for i, t in enumerate(tous_les_tirages):
-        nums = set(t['numeros_sortis'])
-        for n1 in nums: rapport[n1]['compagnons'].update(list(nums - {n1}))
+    numeros_sortis = [t.numeros_sortis for t in tous_les_tirages]  # décodés une seule fois
+    for i, nums in enumerate(numeros_sortis):
+        for n1 in nums: rapport[n1]['compagnons'].update([n for n in nums if n != n1])
         for j in range(max(0, i - fenetre), i):
-            for n_actuel in nums: rapport[n_actuel]['precurseurs'].update(tous_les_tirages[j]['numeros_sortis'])
+            for n_actuel in nums: rapport[n_actuel]['precurseurs'].update(numeros_sortis[j])
         for j in range(i + 1, min(total, i + 1 + fenetre)):
-            for n_actuel in nums: rapport[n_actuel]['suiveurs'].update(tous_les_tirages[j]['numeros_sortis'])
-    return {num: {k: v.most_common(50) for k, v in rel.items()} for num, rel in rapport.items()}
+            for n_actuel in nums: rapport[n_actuel]['suiveurs'].update(numeros_sortis[j])
+    return {num: {k: plus_frequents(v, 50) for k, v in rel.items()} for num, rel in rapport.items()}
+
+def plus_frequents(compteur, top):
+    """Counter.most_common(top) avec les égalités par numéro croissant (et non par ordre d'apparition),
+    comme calcul_matriciel.top_relations : la coupure à `top` garde les mêmes numéros dans les deux moteurs."""
+    return sorted(compteur.items(), key=lambda item: (-item[1], item[0]))[:top]
+
+def analyser_relations_rgntc_numpy(tous_les_tirages, fenetre=FENETRE_RGNTC):
+    """Même résultat que le moteur Python, calculé par produits matriciels sur la matrice d'incidence."""
+    print("-> Calcul des relations RGNTC (moteur NumPy)...")
+    X = calcul_matriciel.matrice_incidence(tous_les_tirages)
+    matrices = calcul_matriciel.matrices_rgntc(X, fenetre)
+    return calcul_matriciel.rapport_depuis_matrices(matrices, calcul_matriciel.numeros_presents(X))
+
+def calculer_matrices_rgntc(tous_les_tirages, fenetre=FENETRE_RGNTC):
+    """Matrices 90x90 des relations et fréquence de chaque numéro (snapshot incrémental s'il est à jour)."""
+    etat = rgntc_incremental.etat_pour_tirages(tous_les_tirages, fenetre, LIMITE_TIRAGES)
+    return rgntc_incremental.matrices_depuis_etat(etat), etat["frequences"]
+
+def plage_copie_locale(mode):
+    """(agregats, X, horodatages, debut, fin) : agrégats cumulés de la copie locale et tirages [debut, fin)
+    de la période du mode ("recent" : les LIMITE_TIRAGES derniers). None si indisponible."""
+    if not (NUMPY_DISPONIBLE and UTILISER_STOCKAGE_LOCAL and MOTEUR_RGNTC == "numpy"): return None
+    try:
+        if db: stockage_local.synchroniser(db)
+        agregats, X = agregats_cumules.agregats_copie_locale(FENETRE_RGNTC)
+        if agregats is None: return None
+        colonnes, _ = stockage_local.charger_colonnes()
+        horodatages = colonnes["horodatages"][:len(X)]
+        if mode == "recent": debut, fin = max(0, len(X) - LIMITE_TIRAGES), len(X)
+        else: debut, fin = agregats_cumules.indices_plage(horodatages, *bornes_mode_analyse(mode))
+    except Exception as e:
+        print(f"❌ Agrégats cumulés indisponibles : {e}"); return None
+    return agregats, X, horodatages, debut, fin
+
+def calculer_matrices_plage(mode):
+    """(matrices, frequences) des relations RGNTC sur la période du mode, à partir des agrégats cumulés
+    de la copie locale (coût indépendant de la longueur de la période). None si indisponible ou vide."""
+    plage = plage_copie_locale(mode)
+    if not plage: return None
+    agregats, X, _, debut, fin = plage
+    if fin <= debut: return None
+    print(f"-> Relations RGNTC sur {fin - debut} tirages ({libelle_mode_analyse(mode)}) par les agrégats cumulés.")
+    return agregats_cumules.matrices_plage(agregats, X, debut, fin), agregats_cumules.frequences(agregats, debut, fin)
+
+def calculer_rapport_rgntc(tous_les_tirages, fenetre=FENETRE_RGNTC, matrices_rgntc=None):
+    """Relations RGNTC du pipeline, à partir des matrices (calculées ici si non fournies)."""
+    if not (NUMPY_DISPONIBLE and MOTEUR_RGNTC == "numpy"):
+        return analyser_relations_rgntc(tous_les_tirages, fenetre)
+    matrices, frequences = matrices_rgntc or calculer_matrices_rgntc(tous_les_tirages, fenetre)
+    return calcul_matriciel.rapport_depuis_matrices(matrices, [int(i) + 1 for i in np.flatnonzero(frequences)])
 
 def calculer_forme_et_ecart(tous_les_tirages, fenetre=FENETRE_FORME_ECART):
+    """Moteur de référence (une seule fenêtre, parcours des tirages)."""
     print("-> Calcul de la Forme et de l'Écart...")
-    forme_ecart_data, derniers_tirages_sets = {}, [set(t['numeros_sortis']) for t in tous_les_tirages[-fenetre:]]
+    forme_ecart_data, derniers_masques = {}, [t.masque for t in tous_les_tirages[-fenetre:]]
     for numero in range(1, 91):
-        forme = sum(1 for ts in derniers_tirages_sets if numero in ts)
+        bit = 1 << (numero - 1)
+        forme = sum(1 for m in derniers_masques if m & bit)
         ecart = 0
-        for ts in reversed(derniers_tirages_sets):
-            if numero in ts: break
+        for m in reversed(derniers_masques):
+            if m & bit: break
             ecart += 1
-        if ecart == len(derniers_tirages_sets) and forme == 0: ecart = fenetre
+        if ecart == len(derniers_masques) and forme == 0: ecart = fenetre
         forme_ecart_data[numero] = {"forme": forme, "ecart": ecart}
     return forme_ecart_data
 
-def generer_et_sauvegarder_heatmaps(rapport_rgntc, tous_les_tirages):
-    if not VISUALISATION_DISPONIBLE:
-        return {"erreur": f"Bibliothèques de visualisation non disponibles. Raison : {ERREUR_VISUALISATION}"}
+def calculer_formes_et_ecarts(tous_les_tirages, fenetres=FENETRES_FORME_ECART):
+    """{fenetre: {numero: {"forme", "ecart"}}} pour plusieurs fenêtres en un appel : dernières apparitions
+    et sommes préfixes de la copie locale, sinon matrice d'incidence des tirages chargés."""
+    if not NUMPY_DISPONIBLE:
+        return {f: calculer_forme_et_ecart(tous_les_tirages, f or len(tous_les_tirages)) for f in fenetres}
+    plage = plage_copie_locale("recent")
+    if plage:
+        return agregats_cumules.formes_et_ecarts(plage[0], fenetres)
+    X = calcul_matriciel.matrice_incidence(tous_les_tirages)
+    formes = {f: X[-f if f else 0:].sum(axis=0) for f in fenetres}
+    # Résumé Firestore déjà lu et à jour avec ces tirages : fenêtre « tout » sur tout l'historique.
+    # Dates comparées en horodatages : le résumé donne des dates UTC naïves, Firestore des dates avec fuseau.
+    resume = cache_donnees.lire("resume")
+    if (resume and resume["tirages"] and tous_les_tirages
+            and calcul_matriciel.horodatage(resume["tirages"][-1].date_obj) == calcul_matriciel.horodatage(tous_les_tirages[-1].date_obj)):
+        formes = {f: forme if f else resume["frequences"] for f, forme in formes.items()}
+        return calcul_matriciel.formes_et_ecarts(formes, resume["derniere_apparition"], resume["nombre_total"])
+    return calcul_matriciel.formes_et_ecarts(formes, calcul_matriciel.derniere_apparition(X), X.shape[0])
+
+def charger_index_cooccurrences(tous_les_tirages=None):
+    """Index des paires et triplets de tout l'historique (copie locale), sinon des tirages chargés ; None sans NumPy."""
+    if not NUMPY_DISPONIBLE: return None
+    if UTILISER_STOCKAGE_LOCAL:
+        try:
+            if db: stockage_local.synchroniser(db)
+            index = cooccurrences.index_copie_locale()
+            if index is not None: return index
+        except Exception as e:
+            print(f"❌ Index des co-occurrences indisponible : {e}")
+    return cooccurrences.construire_depuis_tirages(tous_les_tirages) if tous_les_tirages else None
+
+def requete_cooccurrences(db_client, numeros=(), portee="combine", k=10):
+    """Route admin : compagnons d'un ou deux numéros, sinon paires et triplets les plus fréquents.
+    Lève ValueError si la requête est invalide."""
+    global db
+    db = db_client
+    if not NUMPY_DISPONIBLE: raise ValueError("NumPy est nécessaire pour l'index des co-occurrences.")
+    if portee not in cooccurrences.PORTEES: raise ValueError(f"Portée inconnue : {portee}")
+    k = max(1, min(int(k), K_MAX_COOCCURRENCES))
+    index = charger_index_cooccurrences()
+    if index is None:  # pas de copie locale : index des tirages récents
+        index = charger_index_cooccurrences(cache_donnees.obtenir("tirages", lambda: lire_tirages_depuis_firestore(db), TTL_CACHE_TIRAGES))
+    if index is None: raise ValueError("Aucun tirage disponible.")
+    reponse = {"portee": portee, "tirages": index["nombre"]}
+    if numeros:
+        reponse["numeros"] = sorted(set(numeros))
+        reponse["compagnons"] = cooccurrences.compagnons(index, numeros, portee, k)
+    else:
+        reponse["paires"] = cooccurrences.top_paires(index, portee, k)
+        reponse["triplets"] = cooccurrences.top_triplets(index, portee, k)
+    return reponse
+
+def libelle_fenetre(fenetre):
+    return str(fenetre) if fenetre else "tout"
+
+def formes_candidats(top_candidats, formes_ecarts):
+    """Tableau de la page admin : forme de chaque candidat sur chaque fenêtre, écart sur la plus large."""
+    fenetres = list(formes_ecarts)
+    return {"fenetres": [libelle_fenetre(f) for f in fenetres],
+            "candidats": [{"numero": c, "score": s, "formes": [formes_ecarts[f][c]["forme"] for f in fenetres],
+                           "ecart": formes_ecarts[fenetres[-1]][c]["ecart"]} for c, s in top_candidats]}
+
+def generer_et_sauvegarder_heatmaps(rapport_rgntc, tous_les_tirages, matrices_rgntc=None):
+    """Construit les matrices des TOP_N_HEATMAP numéros les plus fréquents par indexation directe
+    (matrices RGNTC complètes si fournies, sinon à partir du rapport) puis les fait dessiner par le
+    processus de rendu. Retourne {type_relation: nom_fichier}."""
+    if not (VISUALISATION_DISPONIBLE and NUMPY_DISPONIBLE):
+        return {"erreur": f"Bibliothèques de visualisation non disponibles. Raison : {ERREUR_VISUALISATION or 'NumPy manquant'}"}
     print("-> Génération des heatmaps...")
-    static_folder = 'static'
-    if not os.path.exists(static_folder):
-        os.makedirs(static_folder)
-    freq_globale = Counter(num for t in tous_les_tirages for num in t['numeros_sortis'])
-    freqs_triees = freq_globale.most_common()
-    top_nums = [n for n, f in freqs_triees[:TOP_N_HEATMAP]]
-    chemins_images = {}
+    if matrices_rgntc is not None:
+        matrices, frequences = matrices_rgntc
+    else:
+        matrices = calcul_matriciel.matrices_depuis_rapport(rapport_rgntc)
+        frequences = calcul_matriciel.matrice_incidence(tous_les_tirages).sum(axis=0)
+    # Tri stable : à fréquence égale, le plus petit numéro d'abord
+    indices = [i for i in np.argsort(-np.asarray(frequences), kind="stable")[:TOP_N_HEATMAP] if frequences[i] > 0]
+    etiquettes = [int(i) + 1 for i in indices]
+    heatmaps = {}
     for type_relation in ['compagnons', 'suiveurs', 'precurseurs']:
-        matrice = pd.DataFrame(0, index=top_nums, columns=top_nums, dtype=int)
-        for num1 in top_nums:
-            if num1 in rapport_rgntc:
-                for num2, freq in rapport_rgntc[num1][type_relation]:
-                    if num2 in top_nums:
-                        if type_relation == 'compagnons':
-                            matrice.loc[num1, num2] = freq; matrice.loc[num2, num1] = freq
-                        else:
-                            matrice.loc[num1, num2] = freq
-        plt.figure(figsize=(18, 15))
-        sns.heatmap(matrice, annot=True, cmap="viridis", fmt="d", linewidths=.5)
+        matrice = np.ascontiguousarray(matrices[type_relation][np.ix_(indices, indices)], dtype=np.int64)
         titre = f"Heatmap des {type_relation.capitalize()} des {TOP_N_HEATMAP} Numéros les plus Fréquents"
-        plt.title(titre, fontsize=16)
-        nom_fichier = f'heatmap_{type_relation}.png'
-        chemin_fichier = os.path.join(static_folder, nom_fichier)
-        plt.savefig(chemin_fichier)
-        plt.close()
-        chemins_images[type_relation] = nom_fichier
+        heatmaps[type_relation] = (matrice, etiquettes, titre)
+    try:
+        chemins_images = rendu_heatmaps.rendre_heatmaps(heatmaps)
+    except Exception as e:
+        print(f"❌ Erreur pendant le rendu des heatmaps : {e}")
+        return {"erreur": f"Le rendu des heatmaps a échoué : {e}"}
     print("-> Heatmaps sauvegardées avec succès.")
     return chemins_images
 
-def generer_prompt_final_pour_ia(dernier_tirage, rapport_rgntc, forme_ecart_data, base_connaissance, affinites_temporelles):
-    nums_dernier_tirage = dernier_tirage['numeros_sortis']
+def classer_candidats(nums_dernier_tirage, rapport_rgntc, nombre=NOMBRE_CANDIDATS_A_ANALYSER):
+    """Score suiveur : somme des scores des numéros qui suivent ceux du dernier tirage (hors dernier tirage)."""
     scores_candidats = Counter()
     for numero in nums_dernier_tirage:
         if numero in rapport_rgntc:
             for suiveur, score in rapport_rgntc[numero]['suiveurs']:
                 if suiveur not in nums_dernier_tirage:
                     scores_candidats[suiveur] += score
-    top_candidats = scores_candidats.most_common(NOMBRE_CANDIDATS_A_ANALYSER)
+    return scores_candidats.most_common(nombre)
+
+def generer_prompt_final_pour_ia(dernier_tirage, rapport_rgntc, formes_ecarts, base_connaissance, affinites_temporelles, index_cooccurrences=None):
+    nums_dernier_tirage = dernier_tirage.numeros_sortis
+    top_candidats = classer_candidats(nums_dernier_tirage, rapport_rgntc)
     prompt = f"Tu es un expert en analyse de loterie. Fais une prédiction de 2 numéros en combinant toutes les informations.\n\n" \
              f"CONTEXTE:\n- Derniers numéros sortis: {nums_dernier_tirage}\n\n" \
              f"1. ANALYSE DYNAMIQUE (Candidats et leur état récent):\n"
+    fenetres = list(formes_ecarts)
     for candidat, score in top_candidats:
-        if candidat in forme_ecart_data:
-            forme = forme_ecart_data[candidat]['forme']; ecart = forme_ecart_data[candidat]['ecart']
-            prompt += f"- Candidat {candidat}: (Score Suiveur: {score}) | Forme: {forme}x/{FENETRE_FORME_ECART} | Écart: {ecart} tirages\n"
+        formes = ", ".join(f"{formes_ecarts[f][candidat]['forme']}x/{libelle_fenetre(f)}" for f in fenetres)
+        ecart = formes_ecarts[fenetres[-1]][candidat]['ecart']
+        prompt += f"- Candidat {candidat}: (Score Suiveur: {score}) | Forme: {formes} | Écart: {ecart} tirages\n"
     prompt += f"\n2. ANALYSE STATIQUE (Base de connaissance):\n"
     confirmations_trouvees = False
     if base_connaissance:
@@ -195,25 +466,68 @@ def generer_prompt_final_pour_ia(dernier_tirage, rapport_rgntc, forme_ecart_data
                     prompt += f"- CONFIRMATION: Le candidat {candidat} est un 'accompagnateur' connu du numéro {numero_sorti}.\n"
                     confirmations_trouvees = True
     if not confirmations_trouvees: prompt += "- Aucune confirmation directe trouvée.\n"
-    prompt += f"\n3. ANALYSE TEMPORELLE (basée sur la date du jour):\n"
-    fav_jour, fav_mois = affinites_temporelles
-    prompt += f"- Numéros favoris pour ce jour du mois : " + ", ".join([f"{n}({f}x)" for n, f in fav_jour] or ["Aucun"]) + "\n"
-    prompt += f"- Numéros favoris pour ce mois : " + ", ".join([f"{n}({f}x)" for n, f in fav_mois] or ["Aucun"]) + "\n"
+    prompt += f"\n3. ANALYSE TEMPORELLE (basée sur la date du tirage cible):\n"
+    formater = lambda favoris: ", ".join([f"{n}({f}x)" for n, f in favoris] or ["Aucun"])
+    prompt += f"- Numéros favoris pour ce jour du mois : " + formater(affinites_temporelles["jour"]) + "\n"
+    prompt += f"- Numéros favoris pour ce mois : " + formater(affinites_temporelles["mois"]) + "\n"
+    if "jour_semaine" in affinites_temporelles:
+        prompt += f"- Numéros favoris pour ce jour de la semaine : " + formater(affinites_temporelles["jour_semaine"]) + "\n"
+    for heure, favoris in list(affinites_temporelles.get("creneaux", {}).items())[:1]:
+        prompt += f"- Numéros favoris pour le tirage de {heure} : " + formater(favoris) + "\n"
+    if index_cooccurrences is not None:
+        prompt += f"\n4. CO-OCCURRENCES (triplets sur {index_cooccurrences['nombre']} tirages):\n"
+        troisiemes = cooccurrences.meilleurs_troisiemes(index_cooccurrences, nums_dernier_tirage)
+        for (a, b), c, fois in troisiemes:
+            prompt += f"- La paire {a}-{b} du dernier tirage est le plus souvent complétée par le {c} ({fois}x).\n"
+        if not troisiemes: prompt += "- Aucun triplet trouvé.\n"
     prompt += "\n\nTA MISSION FINALE:\n1. Synthétise toutes les convergences.\n2. Choisis les 2 numéros les plus logiques.\n3. Justifie ta prédiction finale."
     return prompt
 
-def appeler_ia_gemini(prompt):
+def interroger_gemini(prompt, sur_fragment=None):
+    """Appel direct à Gemini (sans cache) ; lève une exception en cas d'échec. Avec `sur_fragment`,
+    la réponse est demandée en flux et chaque fragment lui est transmis dès son arrivée."""
     if not (IA_DISPONIBLE and SECRETS_DISPONIBLES):
-        return "ERREUR: Module IA ou fichier de secrets non disponible."
+        metriques.compter_erreur_gemini("indisponible")
+        raise RuntimeError("ERREUR: Module IA ou fichier de secrets non disponible.")
+    api_key = settings.GOOGLE_API_KEY
+    if not api_key:
+        metriques.compter_erreur_gemini("cle_manquante")
+        raise RuntimeError("ERREUR : Clé GOOGLE_API_KEY non trouvée dans settings.py")
     try:
-        api_key = settings.GOOGLE_API_KEY
-        if not api_key: return "ERREUR : Clé GOOGLE_API_KEY non trouvée dans settings.py"
+        genai = charger_genai()
         genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-2.5-flash')
-        response = model.generate_content(prompt, request_options={'timeout': 100})
-        return response.text
+        model = genai.GenerativeModel(MODELE_GEMINI)
+        with metriques.mesurer("gemini", histogramme="gemini_duree_secondes"):
+            if sur_fragment is None:
+                response = model.generate_content(prompt, request_options={'timeout': 100})
+                return response.text
+            debut, fragments = time.perf_counter(), []
+            for morceau in model.generate_content(prompt, stream=True, request_options={'timeout': 100}):
+                if not fragments: metriques.observer("gemini_premier_fragment_secondes", time.perf_counter() - debut)
+                fragments.append(morceau.text)
+                sur_fragment(morceau.text)
+            return "".join(fragments)
     except Exception as e:
-        return f"Erreur API Gemini: {e}"
+        metriques.compter_erreur_gemini(type(e).__name__)
+        raise RuntimeError(f"Erreur API Gemini: {e}") from e
+
+def appeler_ia_gemini(prompt, sur_fragment=None):
+    """Réponse de Gemini via le cache des réponses (empreinte du prompt normalisé et du modèle).
+    Retourne (reponse, erreur) : `erreur` est None en cas de succès ; une erreur n'est jamais mise en cache."""
+    cle = cache_reponses_ia.empreinte(prompt, MODELE_GEMINI)
+    reponse = cache_reponses_ia.lire(db, cle)
+    if reponse is not None:
+        print(f"-> Réponse de l'IA trouvée dans le cache ({cle[:12]}).")
+        if sur_fragment: sur_fragment(reponse)
+        return reponse, None
+    try:
+        reponse = interroger_gemini(prompt, sur_fragment)
+    except Exception as e:
+        return None, str(e)
+    if not reponse:
+        return None, "Erreur API Gemini: réponse vide."
+    cache_reponses_ia.ecrire(db, cle, reponse, MODELE_GEMINI)
+    return reponse, None
 
 def extraire_prediction_finale(texte_ia):
     try:
@@ -228,60 +542,261 @@ def extraire_prediction_finale(texte_ia):
     except Exception:
         return "Erreur lors de l'extraction de la prédiction."
 
-def lancer_analyse_complete(db_client):
-    """Exécute tout le pipeline, génère les heatmaps et retourne les résultats."""
+class ExtracteurPrediction:
+    """extraire_prediction_finale appliquée au fil du flux : seules les lignes complètes arrivées depuis
+    le dernier fragment sont examinées. `prediction` est provisoire (une ligne « sont : » peut être
+    remplacée par deux numéros en gras plus loin) ; la prédiction enregistrée est calculée sur le texte complet."""
+
+    def __init__(self):
+        self.texte, self.position, self.numeros_gras, self.prediction_ligne = "", 0, [], None
+
+    def ajouter(self, fragment):
+        """Ajoute un fragment ; retourne la prédiction provisoire (None tant qu'aucune n'est trouvée)."""
+        self.texte += fragment
+        fin = self.texte.rfind("\n") + 1
+        for ligne in self.texte[self.position:fin].splitlines():
+            if len(self.numeros_gras) < 2:
+                self.numeros_gras += re.findall(r'\*\*\s*(\d{1,2})\s*\*\*', ligne)
+            if self.prediction_ligne is None and ("prédiction finale" in ligne.lower() or "sont :" in ligne.lower()):
+                numeros = re.findall(r'\b(\d{1,2})\b', ligne)
+                if len(numeros) >= 2: self.prediction_ligne = f"Les numéros prédits sont : {numeros[0]} et {numeros[1]}"
+        self.position = max(self.position, fin)
+        return self.prediction
+
+    @property
+    def prediction(self):
+        if len(self.numeros_gras) >= 2: return f"Les numéros prédits sont : {self.numeros_gras[0]} et {self.numeros_gras[1]}"
+        return self.prediction_ligne
+
+def resultat_cache_valide(resultat, dernier_tirage_api):
+    """Une prédiction en cache n'est valable que si elle part du même dernier tirage : l'ID ne contient que
+    le jour, et une prévision de la journée ne vaut que tant qu'aucun tirage plus récent n'est arrivé."""
+    return resultat.get("dernier_tirage_id") in (None, dernier_tirage_api.get("doc_id"))
+
+def dernier_tirage_connu():
+    """Dernier tirage mémorisé (ce processus ou un autre de la machine), quel que soit son âge et sans appel
+    réseau ; None s'il n'y en a pas."""
+    if not MODULES_COLLECTE_DISPONIBLES: return None
+    return lire_dernier_tirage_memorise(float("inf"))
+
+def preparer_analyse(db_client, mode=None):
+    """Détermine la cible et l'ID de cache ; retourne (contexte, resultat_en_cache_ou_erreur)."""
     global db
     db = db_client
     if not db:
-        return {"erreur": "La connexion à la base de données n'est pas disponible."}
+        return None, {"erreur": "La connexion à la base de données n'est pas disponible."}
+    mode = mode or MODE_ANALYSE
+    if not mode_analyse_valide(mode):
+        return None, {"erreur": f"Mode d'analyse invalide : {mode}", "cible": "Inconnue"}
     
-    dernier_tirage_api, cible_tirage = detecter_prochain_tirage_et_contexte()
+    with metriques.mesurer("contexte"):
+        dernier_tirage_api, cible_tirage = detecter_prochain_tirage_et_contexte()
     if not dernier_tirage_api:
-        return {"erreur": cible_tirage, "cible": "Inconnue"}
-    date_jour = datetime.now().strftime('%Y-%m-%d')
-    id_cache = f"{date_jour}_{cible_tirage.replace(' ', '').replace(':', 'h').replace('(', '').replace(')', '')}"
+        return None, {"erreur": cible_tirage, "cible": "Inconnue"}
+    id_cache = calculer_id_cache(dernier_tirage_api['data']['date_obj'], cible_tirage, mode)
     cache_ref = db.collection('predictions_cache').document(id_cache)
-    doc_cache = cache_ref.get()
-    
-    if doc_cache.exists:
+    with metriques.mesurer("lecture_cache_predictions"):
+        doc_cache = cache_ref.get()
+    metriques.compter_lectures('predictions_cache')
+    trouve = doc_cache.exists and resultat_cache_valide(doc_cache.to_dict(), dernier_tirage_api)
+    metriques.compter_cache_predictions(trouve)
+
+    if trouve:
         print(f"--- Analyse pour la cible '{cible_tirage}' trouvée dans le cache ! ---")
-        return doc_cache.to_dict()
-    
-    print(f"--- Nouvelle analyse pour la cible '{cible_tirage}' ---")
-    base_connaissance = lire_base_connaissance_depuis_firestore(db)
-    tous_les_tirages = lire_tirages_depuis_firestore(db)
+        return None, doc_cache.to_dict()
+    contexte = {"dernier_tirage_api": dernier_tirage_api, "cible": cible_tirage, "id_cache": id_cache, "cache_ref": cache_ref, "mode": mode}
+    return contexte, None
+
+def lancer_analyse_complete(db_client, mode=None):
+    """Exécute tout le pipeline, génère les heatmaps et retourne les résultats."""
+    contexte, resultat = preparer_analyse(db_client, mode)
+    if contexte is None: return resultat
+    return executer_analyse(contexte)
+
+def charger_donnees_communes(dernier_tirage_api, mode="recent"):
+    """Lectures et calculs communs à toutes les cibles qui suivent un même dernier tirage (relations RGNTC,
+    forme / écart, classement des candidats, co-occurrences). Retourne (donnees, erreur)."""
+    with metriques.mesurer("chargement_connaissance"):
+        base_connaissance = cache_donnees.obtenir("connaissance", lambda: lire_base_connaissance_depuis_firestore(db), TTL_CACHE_CONNAISSANCE)
+    with metriques.mesurer("chargement_tirages"):
+        tous_les_tirages = cache_donnees.obtenir("tirages", lambda: lire_tirages_depuis_firestore(db), TTL_CACHE_TIRAGES)
     if not tous_les_tirages or not base_connaissance:
-        return {"erreur": "Le chargement des données depuis Firestore a échoué."}
-
-    dernier_tirage_contexte = {
-        'date_obj': dernier_tirage_api['data']['date_obj'],
-        'nom_du_tirage': dernier_tirage_api['data']['nom_du_tirage'],
-        'gagnants': dernier_tirage_api['data']['gagnants'],
-        'machine': dernier_tirage_api['data']['machine'],
-        'numeros_sortis': list(set(dernier_tirage_api['data']['gagnants'] + dernier_tirage_api['data']['machine']))
-    }
-    
-    rapport_rgntc = analyser_relations_rgntc(tous_les_tirages)
-    forme_ecart_data = calculer_forme_et_ecart(tous_les_tirages)
-    affinites_temporelles = analyser_affinites_temporelles(tous_les_tirages, datetime.now().date())
+        return None, "Le chargement des données depuis Firestore a échoué."
+
+    dernier_tirage_contexte = Tirage.depuis_dict(dernier_tirage_api['data'])
     
-    chemins_heatmaps = generer_et_sauvegarder_heatmaps(rapport_rgntc, tous_les_tirages)
+    with metriques.mesurer("rgntc"):
+        matrices_rgntc = calculer_matrices_plage(mode) if mode != "recent" else None
+        if mode != "recent" and matrices_rgntc is None:
+            print(f"-> Période « {libelle_mode_analyse(mode)} » indisponible : analyse sur les {LIMITE_TIRAGES} derniers tirages.")
+            mode = "recent"
+        if matrices_rgntc is None and NUMPY_DISPONIBLE and MOTEUR_RGNTC == "numpy":
+            matrices_rgntc = calculer_matrices_rgntc(tous_les_tirages)
+        rapport_rgntc = calculer_rapport_rgntc(tous_les_tirages, matrices_rgntc=matrices_rgntc)
+    with metriques.mesurer("forme_ecart"):
+        formes_ecarts = calculer_formes_et_ecarts(tous_les_tirages)
+    with metriques.mesurer("cooccurrences"):
+        index_cooccurrences = charger_index_cooccurrences(tous_les_tirages)
+
+    # Numéros dans l'ordre de sortie donné par l'API
+    gagnants_str = ",".join(map(str, dernier_tirage_api['data'].get('gagnants', [])))
+    machine_str = ",".join(map(str, dernier_tirage_api['data'].get('machine', [])))
+    contexte_str = f"{dernier_tirage_contexte.date_obj.strftime('%d/%m/%Y %H:%M')},{dernier_tirage_contexte.nom_du_tirage},\"{gagnants_str}\",\"{machine_str}\""
+    return {"tirages": tous_les_tirages, "connaissance": base_connaissance, "dernier_tirage": dernier_tirage_contexte,
+            "mode": mode, "matrices": matrices_rgntc, "rapport": rapport_rgntc, "formes_ecarts": formes_ecarts,
+            "index_cooccurrences": index_cooccurrences, "contexte": contexte_str,
+            "formes_candidats": formes_candidats(classer_candidats(dernier_tirage_contexte.numeros_sortis, rapport_rgntc), formes_ecarts),
+            "dernier_tirage_id": dernier_tirage_api.get("doc_id")}, None
+
+def _statistiques(communs, cible_tirage):
+    return {"contexte": communs["contexte"], "cible": cible_tirage, "mode_analyse": libelle_mode_analyse(communs["mode"]),
+            "formes_candidats": communs["formes_candidats"], "dernier_tirage_id": communs["dernier_tirage_id"]}
 
-    gagnants_str = ",".join(map(str, dernier_tirage_contexte.get('gagnants', [])))
-    machine_str = ",".join(map(str, dernier_tirage_contexte.get('machine', [])))
-    contexte_str = f"{dernier_tirage_contexte['date_obj'].strftime('%d/%m/%Y %H:%M')},{dernier_tirage_contexte['nom_du_tirage']},\"{gagnants_str}\",\"{machine_str}\""
+def _prompt(communs, affinites_temporelles):
+    with metriques.mesurer("prompt"):
+        return generer_prompt_final_pour_ia(communs["dernier_tirage"], communs["rapport"], communs["formes_ecarts"],
+                                            communs["connaissance"], affinites_temporelles, communs["index_cooccurrences"])
 
-    reponse_ia = appeler_ia_gemini(generer_prompt_final_pour_ia(dernier_tirage_contexte, rapport_rgntc, forme_ecart_data, base_connaissance, affinites_temporelles))
-    prediction_simple = extraire_prediction_finale(reponse_ia)
+def _dessiner_heatmaps(communs):
+    with metriques.mesurer("heatmaps"):
+        return generer_et_sauvegarder_heatmaps(communs["rapport"], communs["tirages"], communs["matrices"])
 
-    resultat_final = {
-        "contexte": contexte_str, "reponse_ia": reponse_ia,
-        "prediction_simple": prediction_simple, "cible": cible_tirage,
-        "timestamp": datetime.now(), "erreur": None,
-        "heatmaps": chemins_heatmaps
-    }
+def _resultat_final(statistiques, reponse_ia, chemins_heatmaps):
+    return dict(statistiques, reponse_ia=reponse_ia, prediction_simple=extraire_prediction_finale(reponse_ia),
+                timestamp=datetime.now(), erreur=None, heatmaps=chemins_heatmaps)
+
+def executer_analyse(contexte, publier=None):
+    """Calcule l'analyse d'une cible (préparée par preparer_analyse) et la sauvegarde dans le cache.
+    `publier(evenement, donnees)` reçoit l'avancement au fil de l'eau : "contexte" (statistiques, avant
+    l'appel à Gemini), "texte" (chaque fragment de la réponse) et "prediction" (prédiction provisoire)."""
+    dernier_tirage_api, cible_tirage = contexte["dernier_tirage_api"], contexte["cible"]
+    id_cache, cache_ref = contexte["id_cache"], contexte["cache_ref"]
+    print(f"--- Nouvelle analyse pour la cible '{cible_tirage}' ---")
+    communs, erreur = charger_donnees_communes(dernier_tirage_api, contexte.get("mode", "recent"))
+    if erreur: return {"erreur": erreur}
+    with metriques.mesurer("affinites_temporelles"):
+        date_cible, heures_restantes = date_et_heures_cible(communs["dernier_tirage"].date_obj, cible_tirage)
+        affinites_temporelles = calculer_affinites_temporelles(communs["tirages"], date_cible, heures_restantes, communs["mode"])
+
+    statistiques = _statistiques(communs, cible_tirage)
+    if publier: publier("contexte", statistiques)
+
+    prompt = _prompt(communs, affinites_temporelles)
+    # Les heatmaps sont dessinées (processus de rendu) pendant que Gemini répond
+    with ThreadPoolExecutor(max_workers=1) as executeur:
+        heatmaps = executeur.submit(_dessiner_heatmaps, communs)
+        if publier:
+            extracteur = ExtracteurPrediction()
+            def sur_fragment(fragment):
+                prediction_avant = extracteur.prediction
+                publier("texte", fragment)
+                if extracteur.ajouter(fragment) != prediction_avant: publier("prediction", extracteur.prediction)
+            reponse_ia, erreur_ia = appeler_ia_gemini(prompt, sur_fragment)
+        else:
+            reponse_ia, erreur_ia = appeler_ia_gemini(prompt)
+        with metriques.mesurer("attente_heatmaps"):
+            chemins_heatmaps = heatmaps.result()
+    if erreur_ia:
+        # Pas de sauvegarde : la cible sera recalculée (et Gemini rappelé) à la prochaine demande
+        print(f"❌ {erreur_ia}")
+        return dict(statistiques, erreur=erreur_ia, heatmaps=chemins_heatmaps)
+    resultat_final = _resultat_final(statistiques, reponse_ia, chemins_heatmaps)
     
     print(f"Sauvegarde de l'analyse dans le cache avec l'ID : {id_cache}")
-    cache_ref.set(resultat_final)
+    with metriques.mesurer("sauvegarde_cache_predictions"):
+        cache_ref.set(resultat_final)
+    metriques.compter_ecritures('predictions_cache')
     
-    return resultat_final
\ No newline at end of file
+    return resultat_final
+
+def preparer_analyses_journee(db_client, mode=None):
+    """Cibles de la prévision de la journée : la prochaine cible et les créneaux suivants du même jour.
+    La prochaine cible a l'ID de cache de /analyser ; un créneau suivant a son propre ID (suffixe
+    "_prevision") : une analyse faite après les tirages intermédiaires ne le rencontre jamais, et la
+    prévision est recalculée dès qu'un tirage plus récent est arrivé.
+    Retourne (contextes à calculer, {cible: resultat déjà en cache}), ou (None, erreur)."""
+    global db
+    db = db_client
+    if not db:
+        return None, {"erreur": "La connexion à la base de données n'est pas disponible."}
+    mode = mode or MODE_ANALYSE
+    if not mode_analyse_valide(mode):
+        return None, {"erreur": f"Mode d'analyse invalide : {mode}"}
+    with metriques.mesurer("contexte"):
+        dernier_tirage_api, cible_tirage = detecter_prochain_tirage_et_contexte()
+    if not dernier_tirage_api:
+        return None, {"erreur": cible_tirage}
+    date_dernier_tirage = dernier_tirage_api['data']['date_obj']
+    date_cible, heures_restantes = date_et_heures_cible(date_dernier_tirage, cible_tirage)
+
+    contextes, en_cache = [], {}
+    with metriques.mesurer("lecture_cache_predictions"):
+        for i, heure in enumerate(heures_restantes):
+            cible = f"{cible_tirage.split(' (')[0]} ({heure})"  # « Aujourd'hui (16:00) », « Demain (08:00) »...
+            id_cache = calculer_id_cache(date_dernier_tirage, cible, mode) + ("_prevision" if i else "")
+            cache_ref = db.collection('predictions_cache').document(id_cache)
+            doc_cache = cache_ref.get()
+            metriques.compter_lectures('predictions_cache')
+            trouve = doc_cache.exists and resultat_cache_valide(doc_cache.to_dict(), dernier_tirage_api)
+            metriques.compter_cache_predictions(trouve)
+            if trouve:
+                en_cache[cible] = doc_cache.to_dict()
+            else:
+                contextes.append({"dernier_tirage_api": dernier_tirage_api, "cible": cible, "id_cache": id_cache, "cache_ref": cache_ref,
+                                  "mode": mode, "date_cible": date_cible, "heures": heures_restantes[i:]})
+    return contextes, en_cache
+
+def executer_analyses_journee(contextes, publier=None):
+    """Calcule en une passe les cibles préparées par preparer_analyses_journee : lectures, relations RGNTC,
+    forme / écart, affinités (tous les créneaux à la fois) et heatmaps sont partagés ; les appels à Gemini
+    partent en parallèle (au plus MAX_APPELS_IA_PARALLELES) et les résultats sont écrits en un seul lot.
+    `publier(id_cache, evenement, donnees)` reçoit les statistiques de chaque cible ("contexte").
+    Retourne {id_cache: resultat} ; une cible dont l'appel à Gemini échoue n'est pas enregistrée."""
+    if not contextes: return {}
+    premier = contextes[0]
+    print(f"--- Prévision de la journée : {', '.join(c['cible'] for c in contextes)} ---")
+    communs, erreur = charger_donnees_communes(premier["dernier_tirage_api"], premier["mode"])
+    if erreur: return {c["id_cache"]: {"erreur": erreur, "cible": c["cible"]} for c in contextes}
+    with metriques.mesurer("affinites_temporelles"):
+        heures = max((c["heures"] for c in contextes), key=len)
+        affinites = calculer_affinites_temporelles(communs["tirages"], premier["date_cible"], heures, communs["mode"])
+
+    statistiques, prompts = {}, {}
+    for contexte in contextes:
+        id_cache = contexte["id_cache"]
+        statistiques[id_cache] = _statistiques(communs, contexte["cible"])
+        if publier: publier(id_cache, "contexte", statistiques[id_cache])
+        # Même prompt qu'une analyse seule depuis ce tirage : créneaux à partir de celui de la cible
+        creneaux = {h: affinites["creneaux"][h] for h in contexte["heures"]}
+        prompts[id_cache] = _prompt(communs, dict(affinites, creneaux=creneaux))
+
+    # Heatmaps communes dessinées pendant que Gemini répond ; au plus MAX_APPELS_IA_PARALLELES appels à la fois
+    with ThreadPoolExecutor(max_workers=1) as executeur, ThreadPoolExecutor(max_workers=MAX_APPELS_IA_PARALLELES) as appels_ia:
+        heatmaps = executeur.submit(_dessiner_heatmaps, communs)
+        reponses = dict(zip(prompts, appels_ia.map(appeler_ia_gemini, prompts.values())))
+        with metriques.mesurer("attente_heatmaps"):
+            chemins_heatmaps = heatmaps.result()
+
+    resultats, lot, nombre = {}, db.batch(), 0
+    for contexte in contextes:
+        id_cache = contexte["id_cache"]
+        reponse_ia, erreur_ia = reponses[id_cache]
+        if erreur_ia:
+            print(f"❌ {contexte['cible']} : {erreur_ia}")
+            resultats[id_cache] = dict(statistiques[id_cache], erreur=erreur_ia, heatmaps=chemins_heatmaps)
+            continue
+        resultats[id_cache] = _resultat_final(statistiques[id_cache], reponse_ia, chemins_heatmaps)
+        lot.set(contexte["cache_ref"], resultats[id_cache]); nombre += 1
+    if nombre:
+        print(f"Sauvegarde de {nombre} analyse(s) dans le cache en un lot.")
+        with metriques.mesurer("sauvegarde_cache_predictions"):
+            lot.commit()
+        metriques.compter_ecritures('predictions_cache', nombre)
+    return resultats
+
+def lancer_analyses_journee(db_client, mode=None):
+    """Prévision de la journée sans tâche de fond (hors serveur web) : {cible: resultat}, cibles en cache comprises."""
+    contextes, en_cache = preparer_analyses_journee(db_client, mode)
+    if contextes is None: return en_cache
+    resultats = executer_analyses_journee(contextes)
+    return dict(en_cache, **{c["cible"]: resultats[c["id_cache"]] for c in contextes})
@@ -1,13 +1,17 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash
-import firebase_admin
-from firebase_admin import credentials, auth, firestore
+from flask import Flask, render_template, request, redirect, url_for, session, flash, send_from_directory, abort, Response, jsonify
 import os
 import json
+import threading
+import metriques
+# Backend de stockage : Firestore (défaut) ou SQLite local (BACKEND_STOCKAGE=sqlite)
+import firestore_sqlite
 
 # --- On importe nos bibliothèques personnelles ---
 try:
-    from analyse_loto import lancer_analyse_complete
+    from analyse_loto import lancer_analyse_complete, mode_analyse_valide, MODES_ANALYSE, requete_cooccurrences
     from cron_update_firestore import lancer_collecte_vers_firestore
+    from taches_analyse import soumettre_analyse, soumettre_analyses_journee, etat_analyse, suivre_analyse
+    from prechauffage import demarrer_planificateur, PRECHAUFFAGE_ACTIF
     MODULES_DISPONIBLES = True
 except ImportError as e:
     print(f"Erreur d'importation des modules locaux : {e}")
@@ -25,20 +29,65 @@ except ImportError:
 app = Flask(__name__, static_folder='static')
 # --- FIN DE LA MODIFICATION ---
 app.secret_key = os.urandom(24)
+# Analyse en tâche de fond avec page de statut (mettre "0" pour l'ancien mode synchrone)
+ANALYSE_ASYNCHRONE = os.environ.get("ANALYSE_ASYNCHRONE", "1") == "1"
+# Page d'attente alimentée en direct (SSE) : statistiques puis réponse de Gemini au fil de l'eau ("0" : rafraîchissement périodique)
+ANALYSE_EN_FLUX = os.environ.get("ANALYSE_EN_FLUX", "1") == "1"
+# Jeton exigé par /metrics (en-tête "Authorization: Bearer <jeton>") ; sans jeton, /metrics est réservé aux admins
+METRIQUES_JETON = os.environ.get("METRIQUES_JETON")
+ROUTES_SANS_JOURNAL = ('metriques_prometheus', 'heatmap', 'static')
 
-# --- INITIALISATION DE FIREBASE (une seule fois, au démarrage de l'app) ---
+# --- INITIALISATION DE FIREBASE (une seule fois par processus, à la première utilisation) ---
+# Différée pour accélérer le démarrage des workers et pour ne jamais ouvrir de connexion gRPC
+# dans le maître gunicorn avant le fork (PRECHARGER_DEPENDANCES=1, voir gunicorn.conf.py).
 db = None
-try:
-    if not SECRETS_DISPONIBLES:
-        raise ValueError("Fichier settings.py manquant ou invalide. L'application ne peut pas démarrer.")
-    
-    cred = credentials.Certificate(settings.FIREBASE_SERVICE_ACCOUNT_DICT)
-    firebase_admin.initialize_app(cred)
-    db = firestore.client()
-    print("✅ [APP] Connexion à Firebase réussie au démarrage.")
+_verrou_db = threading.Lock()
+
+def obtenir_db():
+    global db
+    if db is not None: return db
+    with _verrou_db:
+        if db is not None: return db
+        if firestore_sqlite.BACKEND_SQLITE:
+            db = firestore_sqlite.client_sqlite()
+            return db
+        try:
+            if not SECRETS_DISPONIBLES:
+                raise ValueError("Fichier settings.py manquant ou invalide. L'application ne peut pas démarrer.")
+            import firebase_admin
+            from firebase_admin import credentials, firestore
+            if not firebase_admin._apps:
+                cred = credentials.Certificate(settings.FIREBASE_SERVICE_ACCOUNT_DICT)
+                firebase_admin.initialize_app(cred)
+            db = firestore.client()
+            print("✅ [APP] Connexion à Firebase réussie.")
+        except Exception as e:
+            print(f"❌ [APP] ERREUR CRITIQUE : Impossible d'initialiser Firebase. {e}")
+    return db
+
+# --- SERVICES DE FOND (démarrés à la première requête du worker) ---
+_services_demarres = False
 
-except Exception as e:
-    print(f"❌ [APP] ERREUR CRITIQUE AU DÉMARRAGE : Impossible d'initialiser Firebase. {e}")
+@app.before_request
+def demarrer_services():
+    global _services_demarres
+    if _services_demarres or not MODULES_DISPONIBLES: return
+    _services_demarres = True
+    # Préchauffage : analyse de la prochaine cible calculée dès la collecte (PRECHAUFFAGE_ACTIF=1)
+    if PRECHAUFFAGE_ACTIF: demarrer_planificateur(obtenir_db())
+
+# --- JOURNAL DE TEMPS PAR REQUÊTE ---
+@app.before_request
+def ouvrir_journal_requete():
+    if request.endpoint not in ROUTES_SANS_JOURNAL:
+        metriques.ouvrir_journal("requete", route=request.endpoint, methode=request.method)
+
+@app.after_request
+def fermer_journal_requete(reponse):
+    duree = metriques.fermer_journal(statut=reponse.status_code)
+    if duree is not None:
+        metriques.observer("requete_duree_secondes", duree, route=request.endpoint or "inconnue")
+    return reponse
 
 
 # --- ROUTES DE L'APPLICATION ---
@@ -47,11 +96,20 @@ def login():
     if 'user_uid' in session:
         return redirect(url_for('dashboard'))
     if request.method == 'POST':
+        db = obtenir_db()
         if not db:
             flash("Erreur serveur : la base de données n'est pas connectée.", "error")
             return render_template('login.html')
         email = request.form['email']
         password = request.form['password']
+        if firestore_sqlite.BACKEND_SQLITE:
+            # Sans Firebase Auth : mot de passe haché dans la collection 'users' (voir firestore_sqlite.py --utilisateur)
+            utilisateur = firestore_sqlite.authentifier(db, email, password)
+            if utilisateur is None:
+                flash("Identifiants invalides.", "error"); return render_template('login.html')
+            session['user_uid'], session['user_email'], session['is_admin'] = utilisateur
+            return redirect(url_for('dashboard'))
+        from firebase_admin import auth
         try:
             user = auth.get_user_by_email(email)
             session['user_uid'] = user.uid
@@ -68,15 +126,62 @@ def login():
 @app.route('/dashboard')
 def dashboard():
     if 'user_uid' not in session: return redirect(url_for('login'))
-    return render_template('dashboard.html', user_email=session.get('user_email'), is_admin=session.get('is_admin', False))
+    return render_template('dashboard.html', user_email=session.get('user_email'), is_admin=session.get('is_admin', False),
+                           modes_analyse=MODES_ANALYSE if MODULES_DISPONIBLES else {})
 
 @app.route('/analyser', methods=['POST'])
 def analyser():
     if 'user_uid' not in session: return redirect(url_for('login'))
     if not MODULES_DISPONIBLES:
         flash("Erreur serveur : module d'analyse manquant.", "error"); return redirect(url_for('dashboard'))
-    # On passe la connexion 'db' qui a été initialisée au démarrage
-    resultats = lancer_analyse_complete(db)
+    mode = request.form.get('mode') or None
+    if mode == 'plage':
+        mode = f"plage:{request.form.get('date_debut', '')}:{request.form.get('date_fin', '')}"
+    if mode and not mode_analyse_valide(mode):
+        flash("Période d'analyse invalide.", "error"); return redirect(url_for('dashboard'))
+    if not ANALYSE_ASYNCHRONE:
+        # On passe la connexion 'db' qui a été initialisée au démarrage
+        return afficher_resultats(lancer_analyse_complete(obtenir_db(), mode))
+    id_cache, resultats = soumettre_analyse(obtenir_db(), mode)
+    if id_cache is None:  # résultat déjà en cache ou erreur de contexte
+        return afficher_resultats(resultats)
+    return redirect(url_for('statut_analyse', id_cache=id_cache))
+
+@app.route('/analyse/<id_cache>')
+def statut_analyse(id_cache):
+    if 'user_uid' not in session: return redirect(url_for('login'))
+    if not MODULES_DISPONIBLES:
+        flash("Erreur serveur : module d'analyse manquant.", "error"); return redirect(url_for('dashboard'))
+    etat, resultats = etat_analyse(obtenir_db(), id_cache)
+    if etat in ("termine", "erreur"):
+        return afficher_resultats(resultats)
+    if etat == "inconnue":
+        flash("Cette analyse n'existe pas ou a expiré. Relancez-la.", "error"); return redirect(url_for('dashboard'))
+    if ANALYSE_EN_FLUX:
+        return render_template('analyse_flux.html', id_cache=id_cache, is_admin=session.get('is_admin', False))
+    return render_template('analyse_en_cours.html', id_cache=id_cache)
+
+@app.route('/analyse/<id_cache>/flux')
+def flux_analyse(id_cache):
+    # Server-sent events : "contexte", "texte", "prediction", puis "fin" (la page se recharge sur le résultat)
+    if 'user_uid' not in session: abort(403)
+    if not MODULES_DISPONIBLES: abort(503)
+    try:
+        depuis = int(request.headers.get('Last-Event-ID', -1)) + 1  # reprise après une reconnexion du navigateur
+    except ValueError:
+        depuis = 0
+    def evenements(db):
+        for evenement in suivre_analyse(db, id_cache, depuis):
+            if evenement is None:
+                yield ": maintien\n\n"; continue
+            numero, type_evenement, donnees = evenement
+            yield f"id: {numero}\nevent: {type_evenement}\ndata: {json.dumps(donnees, ensure_ascii=False, default=str)}\n\n"
+    reponse = Response(evenements(obtenir_db()), mimetype='text/event-stream')
+    reponse.headers['Cache-Control'] = 'no-cache'
+    reponse.headers['X-Accel-Buffering'] = 'no'  # pas de mise en tampon par un proxy nginx
+    return reponse
+
+def afficher_resultats(resultats):
     if session.get('is_admin'):
         return render_template('resultat_admin.html', resultats=resultats)
     else:
@@ -92,6 +197,49 @@ def mettre_a_jour():
     message = lancer_collecte_vers_firestore()
     flash(message); return redirect(url_for('dashboard'))
 
+@app.route('/admin/cooccurrences')
+def cooccurrences_admin():
+    # ?numeros=12,47&portee=gagnants|machine|combine&k=10 ; sans numéros : paires et triplets les plus fréquents
+    if not session.get('is_admin'): abort(403)
+    if not MODULES_DISPONIBLES: abort(503)
+    try:
+        numeros = [int(n) for n in request.args.get('numeros', '').replace(' ', '').split(',') if n]
+    except ValueError:
+        return jsonify({"erreur": "Numéros invalides (ex. : ?numeros=12,47)."}), 400
+    try:
+        reponse = requete_cooccurrences(obtenir_db(), numeros, request.args.get('portee', 'combine'), request.args.get('k', 10))
+    except ValueError as e:
+        return jsonify({"erreur": str(e)}), 400
+    return jsonify(reponse)
+
+@app.route('/admin/analyser_journee', methods=['POST'])
+def analyser_journee_admin():
+    # Précalcule en tâche de fond la prochaine cible et les créneaux suivants du même jour ; ?mode=... comme
+    # /analyser. Répond tout de suite : l'état de chaque cible se suit sur /analyse/<id_cache>
+    if not session.get('is_admin'): abort(403)
+    if not MODULES_DISPONIBLES: abort(503)
+    en_cours, resultats = soumettre_analyses_journee(obtenir_db(), request.values.get('mode') or None)
+    if en_cours is None:
+        return jsonify(resultats), 400
+    return jsonify({"en_cours": {cible: url_for('statut_analyse', id_cache=id_cache) for cible, id_cache in en_cours.items()},
+                    "en_cache": {cible: r.get("prediction_simple") for cible, r in resultats.items() if not r.get("erreur")},
+                    "erreurs": {cible: r["erreur"] for cible, r in resultats.items() if r.get("erreur")}}), 202
+
+@app.route('/heatmaps/<nom_fichier>')
+def heatmap(nom_fichier):
+    # Les noms contiennent l'empreinte des données : une image ne change jamais, cache d'un an
+    if not (nom_fichier.startswith('heatmap_') and nom_fichier.endswith('.png')): abort(404)
+    reponse = send_from_directory(app.static_folder, nom_fichier, max_age=31536000)
+    reponse.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return reponse
+
+@app.route('/metrics')
+def metriques_prometheus():
+    if METRIQUES_JETON:
+        if request.headers.get('Authorization') != f"Bearer {METRIQUES_JETON}": abort(403)
+    elif not session.get('is_admin'): abort(403)
+    return Response(metriques.exposition(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/logout')
 def logout():
     session.clear(); return redirect(url_for('login'))
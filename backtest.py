@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+# Backtest « walk-forward » du classement des candidats (score suiveur) sur tout l'historique du CSV.
+# À chaque tirage, les relations RGNTC de la fenêtre des derniers tirages et la forme / l'écart sont
+# mis à jour de façon incrémentale (ajout du nouveau tirage, retrait du plus ancien), puis les
+# top-N candidats sont comparés au tirage suivant. Aucun appel à Gemini : seul le classement est évalué.
+# Usage :
+#   python backtest.py                                   -> balayage par défaut, sur tous les cœurs
+#   python backtest.py --fenetres-rgntc 1,3,5 --fenetres-forme 20,50 --candidats 5,15
+#   python backtest.py --taille-fenetre 1000 --processus 4 --json resultats_backtest.json
+
+import os
+import sys
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+import calcul_matriciel
+from tirage_compact import Tirage
+from analyse_loto import classer_candidats, FENETRE_RGNTC, FENETRE_FORME_ECART, NOMBRE_CANDIDATS_A_ANALYSER, LIMITE_TIRAGES
+from migrate_to_firestore import preparer_tirages, NOM_FICHIER_DONNEES_CSV
+
+# --- CONFIGURATIONS ---
+FENETRES_RGNTC = [1, 2, FENETRE_RGNTC, 5, 8]
+FENETRES_FORME = [10, 20, FENETRE_FORME_ECART, 100, 200]
+CANDIDATS = [2, 5, 10, NOMBRE_CANDIDATS_A_ANALYSER]
+TOP_RELATIONS = 50  # longueur des listes de suiveurs du rapport RGNTC
+
+def charger_historique(chemin=NOM_FICHIER_DONNEES_CSV):
+    """Matrice d'incidence (tirages x 90, uint8) de tout le CSV, tirages triés par date (ordre du fichier à égalité)."""
+    documents = sorted(preparer_tirages(chemin), key=lambda d: d[1]['date_obj'])
+    return calcul_matriciel.matrice_incidence([Tirage.depuis_dict(d) for _, d in documents]).astype(np.uint8)
+
+def backtest(X, fenetre_rgntc, taille_fenetre, fenetres_forme, candidats, debut=None):
+    """Rejoue l'historique pour une fenêtre RGNTC et une taille de fenêtre de tirages ; toutes les
+    valeurs de `fenetres_forme` et de `candidats` sont évaluées dans la même passe.
+    Retourne {(fenetre_forme, nombre_candidats): statistiques}."""
+    X = X.astype(np.int64)
+    total, n_max = X.shape[0], max(candidats)
+    debut = taille_fenetre if debut is None else debut
+    # État RGNTC de la fenêtre [bas, i] : mêmes mises à jour que rgntc_incremental (suiveurs = précurseursᵀ)
+    precurseurs = np.zeros((calcul_matriciel.NUMERO_MAX, calcul_matriciel.NUMERO_MAX), dtype=np.int64)
+    # Forme : nombre d'apparitions dans les F derniers tirages ; écart : tirages depuis la dernière apparition
+    formes = {f: np.zeros(calcul_matriciel.NUMERO_MAX, dtype=np.int64) for f in fenetres_forme}
+    derniere_apparition = np.full(calcul_matriciel.NUMERO_MAX, -1, dtype=np.int64)
+    cumuls = {(f, n): {"touches": 0, "au_moins_un": 0, "etapes": 0, "forme_touches": 0, "forme_tous": 0,
+                       "ecart_touches": 0, "ecart_tous": 0, "nb_touches": 0, "nb_tous": 0, "attendu": 0.0}
+              for f in fenetres_forme for n in candidats}
+    bas = 0
+    for i in range(total - 1):
+        x = X[i]
+        debut_precedents = max(bas, i - fenetre_rgntc)
+        precurseurs += np.outer(x, X[debut_precedents:i].sum(axis=0))
+        if i - bas + 1 > taille_fenetre:
+            # Le plus ancien tirage sort : il était précurseur des `fenetre_rgntc` tirages suivants
+            precurseurs -= np.outer(X[bas + 1:bas + 1 + fenetre_rgntc].sum(axis=0), X[bas])
+            bas += 1
+        for f, forme in formes.items():
+            forme += x
+            if i - f >= 0: forme -= X[i - f]
+        derniere_apparition[x > 0] = i
+        if i + 1 < debut: continue
+
+        nums_dernier_tirage = [int(k) + 1 for k in np.flatnonzero(x)]
+        suiveurs = precurseurs.T
+        rapport = {n: {"suiveurs": calcul_matriciel.top_relations(suiveurs[n - 1], TOP_RELATIONS)} for n in nums_dernier_tirage}
+        classement = [c for c, _ in classer_candidats(nums_dernier_tirage, rapport, n_max)]
+        suivant = X[i + 1]
+        taille_suivant = int(suivant.sum())
+        top = np.array(classement, dtype=np.int64) - 1
+        # Sommes préfixes sur le classement : les statistiques de chaque N se lisent à l'indice N
+        touches = np.concatenate(([0], np.cumsum(suivant[top] > 0)))
+        ecarts_top = i - derniere_apparition[top]
+        for f in fenetres_forme:
+            forme_top = formes[f][top]
+            ecart_top = np.where(derniere_apparition[top] >= 0, np.minimum(ecarts_top, f), f)
+            forme_cumul = np.concatenate(([0], np.cumsum(forme_top)))
+            ecart_cumul = np.concatenate(([0], np.cumsum(ecart_top)))
+            touche = suivant[top] > 0
+            forme_touches = np.concatenate(([0], np.cumsum(forme_top * touche)))
+            ecart_touches = np.concatenate(([0], np.cumsum(ecart_top * touche)))
+            for n in candidats:
+                k = min(n, top.size)
+                c = cumuls[(f, n)]
+                c["etapes"] += 1
+                c["touches"] += int(touches[k]); c["au_moins_un"] += int(touches[k] > 0)
+                c["attendu"] += k * taille_suivant / calcul_matriciel.NUMERO_MAX
+                c["forme_tous"] += int(forme_cumul[k]); c["ecart_tous"] += int(ecart_cumul[k]); c["nb_tous"] += k
+                c["forme_touches"] += int(forme_touches[k]); c["ecart_touches"] += int(ecart_touches[k])
+                c["nb_touches"] += int(touches[k])
+
+    resultats = {}
+    for (f, n), c in cumuls.items():
+        etapes = max(1, c["etapes"])
+        resultats[(f, n)] = {
+            "etapes": c["etapes"],
+            "touches_moyennes": c["touches"] / etapes,
+            "taux_au_moins_un": c["au_moins_un"] / etapes,
+            "touches_attendues_hasard": c["attendu"] / etapes,
+            "gain_sur_hasard": c["touches"] / c["attendu"] if c["attendu"] else 0.0,
+            "forme_moyenne_candidats": c["forme_tous"] / max(1, c["nb_tous"]),
+            "forme_moyenne_touches": c["forme_touches"] / max(1, c["nb_touches"]),
+            "ecart_moyen_candidats": c["ecart_tous"] / max(1, c["nb_tous"]),
+            "ecart_moyen_touches": c["ecart_touches"] / max(1, c["nb_touches"]),
+        }
+    return resultats
+
+def _executer_configuration(arguments):
+    X, fenetre_rgntc, taille_fenetre, fenetres_forme, candidats = arguments
+    debut = time.perf_counter()
+    resultats = backtest(X, fenetre_rgntc, taille_fenetre, fenetres_forme, candidats)
+    return fenetre_rgntc, resultats, time.perf_counter() - debut
+
+def balayer(X, fenetres_rgntc=FENETRES_RGNTC, fenetres_forme=FENETRES_FORME, candidats=CANDIDATS,
+            taille_fenetre=LIMITE_TIRAGES, processus=None):
+    """Une passe par fenêtre RGNTC, réparties sur les cœurs. Retourne la liste des résultats à plat."""
+    lignes = []
+    configurations = [(X, f, taille_fenetre, list(fenetres_forme), list(candidats)) for f in fenetres_rgntc]
+    with ProcessPoolExecutor(max_workers=processus or os.cpu_count()) as executeur:
+        for fenetre_rgntc, resultats, duree in executeur.map(_executer_configuration, configurations):
+            print(f"-> Fenêtre RGNTC {fenetre_rgntc} rejouée en {duree:.1f} s.")
+            for (fenetre_forme, nombre), stats in sorted(resultats.items()):
+                lignes.append({"fenetre_rgntc": fenetre_rgntc, "fenetre_forme": fenetre_forme, "candidats": nombre,
+                               "taille_fenetre": taille_fenetre, **stats})
+    return lignes
+
+def afficher(lignes):
+    print(f"\n{'RGNTC':>5} {'Forme':>5} {'N':>3} {'Touches':>8} {'Hasard':>7} {'Gain':>6} {'>=1':>6} {'Forme T/C':>11} {'Écart T/C':>11}")
+    for l in lignes:
+        print(f"{l['fenetre_rgntc']:>5} {l['fenetre_forme']:>5} {l['candidats']:>3} {l['touches_moyennes']:8.3f} "
+              f"{l['touches_attendues_hasard']:7.3f} {l['gain_sur_hasard']:6.3f} {l['taux_au_moins_un']:6.1%} "
+              f"{l['forme_moyenne_touches']:5.2f}/{l['forme_moyenne_candidats']:<5.2f} {l['ecart_moyen_touches']:5.1f}/{l['ecart_moyen_candidats']:<5.1f}")
+
+if __name__ == '__main__':
+    arguments = sys.argv[1:]
+    def valeur(option): return arguments[arguments.index(option) + 1] if option in arguments else None
+    def entiers(option, defaut): return [int(v) for v in valeur(option).split(",")] if valeur(option) else defaut
+    debut = time.perf_counter()
+    X = charger_historique(valeur("--csv") or NOM_FICHIER_DONNEES_CSV)
+    print(f"-> {X.shape[0]} tirages chargés en {time.perf_counter() - debut:.1f} s.")
+    lignes = balayer(X, entiers("--fenetres-rgntc", FENETRES_RGNTC), entiers("--fenetres-forme", FENETRES_FORME),
+                     entiers("--candidats", CANDIDATS), int(valeur("--taille-fenetre") or LIMITE_TIRAGES),
+                     int(valeur("--processus") or 0) or None)
+    afficher(lignes)
+    if valeur("--json"):
+        with open(valeur("--json"), "w", encoding="utf-8") as f:
+            json.dump(lignes, f, indent=2)
+    print(f"\n✅ Backtest terminé en {time.perf_counter() - debut:.1f} s.")
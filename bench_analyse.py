@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+# Mesure du temps et de la mémoire de pointe de chaque étape de l'analyse, sur des tirages synthétiques.
+# Usage :
+#   python bench_analyse.py                          -> 1k, 10k et 100k tirages, rapport à l'écran
+#   python bench_analyse.py --tailles 1000,10000     -> tailles choisies
+#   python bench_analyse.py --json res.json          -> enregistre aussi les mesures
+#   python bench_analyse.py --reference ref.json     -> code de sortie 1 en cas de régression
+#   BACKEND_STOCKAGE=sqlite python bench_analyse.py  -> mêmes mesures avec la base SQLite au lieu de la doublure en mémoire
+# Les tirages sont générés avec une graine fixe (5 gagnants + 5 machine parmi 90, noms réels de
+# MAPPINGS_HORAIRES). Firestore est remplacé par la doublure locale et Gemini par une réponse fixe :
+# rien ne sort de la machine. Tout est exécuté dans un dossier temporaire (snapshot, images).
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import platform
+import tempfile
+import tracemalloc
+from datetime import datetime, timedelta
+
+DOSSIER_PROJET = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, DOSSIER_PROJET)
+from tirage_compact import Tirage
+
+# --- CONFIGURATIONS ---
+TAILLES_PAR_DEFAUT = [1000, 10000, 100000]
+GRAINE = 20240101
+NOMBRE_MESURES = 3
+MAX_TIRAGES_MOTEUR_PYTHON = 10000  # le moteur RGNTC de référence est trop lent au-delà
+SEUIL_REGRESSION_TEMPS = 1.25      # +25 % par rapport à la référence
+SEUIL_REGRESSION_MEMOIRE = 1.20    # +20 %
+TEMPS_MINIMAL_COMPARE = 0.005      # secondes : en dessous, l'écart est du bruit
+REPONSE_IA_SIMULEE = ("Synthèse des convergences...\n\n"
+                      "**Prédiction finale :** les numéros retenus sont **12** et **47**.")
+LATENCE_IA_SIMULEE = float(os.environ.get("LATENCE_IA_SIMULEE", "0"))  # secondes
+
+def generer_tirages(nombre, graine=GRAINE):
+    """Tirages synthétiques au format de l'analyse, triés par date : les créneaux de MAPPINGS_HORAIRES
+    se suivent jour après jour, le nom dépend du jour de la semaine quand le créneau en a plusieurs."""
+    from cron_update_firestore import MAPPINGS_HORAIRES
+    generateur = random.Random(graine)
+    creneaux = sorted(MAPPINGS_HORAIRES.items())
+    jour = datetime(2000, 1, 1)
+    tirages = []
+    while len(tirages) < nombre:
+        for heure, noms in creneaux:
+            if len(tirages) >= nombre: break
+            nom = noms[jour.weekday() % len(noms)]
+            gagnants = generateur.sample(range(1, 91), 5)
+            machine = generateur.sample(range(1, 91), 5)
+            tirages.append(Tirage.depuis_numeros(jour + timedelta(hours=int(heure[:2])), nom, gagnants, machine))
+        jour += timedelta(days=1)
+    return tirages
+
+def db_locale(tirages):
+    """Doublure Firestore (en mémoire, ou base SQLite si BACKEND_STOCKAGE=sqlite) remplie avec les tirages
+    et la vraie base de connaissance."""
+    import migrate_to_firestore
+    import firestore_sqlite
+    from firestore_local import ClientLocal
+    from rgntc_incremental import cle_tirage
+    db = firestore_sqlite.ClientSQLite(f"bench_{len(tirages)}.sqlite3") if firestore_sqlite.BACKEND_SQLITE else ClientLocal()
+    documents = [(cle_tirage(t.date_obj, t.nom_du_tirage), t.vers_dict()) for t in tirages]
+    migrate_to_firestore.ecrire_documents(db, 'tirages', documents)
+    connaissance = migrate_to_firestore.preparer_base_connaissance(os.path.join(DOSSIER_PROJET, migrate_to_firestore.NOM_FICHIER_BASE_CONNAISSANCE))
+    migrate_to_firestore.ecrire_documents(db, 'connaissance', [(str(n), {"accompagnateurs": a}) for n, a in connaissance.items()])
+    return db
+
+def ia_simulee(prompt, sur_fragment=None):
+    if LATENCE_IA_SIMULEE: time.sleep(LATENCE_IA_SIMULEE)
+    if sur_fragment: sur_fragment(REPONSE_IA_SIMULEE)
+    return REPONSE_IA_SIMULEE, None
+
+def preparer_environnement():
+    """Bascule dans un dossier temporaire et neutralise les appels externes de analyse_loto."""
+    dossier = tempfile.mkdtemp(prefix="bench_analyse_")
+    os.chdir(dossier)
+    import analyse_loto
+    analyse_loto.appeler_ia_gemini = ia_simulee
+    analyse_loto.UTILISER_STOCKAGE_LOCAL = False
+    return dossier
+
+def reinitialiser_caches(db=None):
+    """Chaque mesure part à froid : caches mémoire, snapshot RGNTC, images et cache des prédictions."""
+    import cache_donnees
+    cache_donnees.invalider("tirages", "connaissance")
+    for chemin in ("rgntc_snapshot.npz", "static"):
+        if os.path.isdir(chemin): shutil.rmtree(chemin)
+        elif os.path.exists(chemin): os.remove(chemin)
+    if db is not None: db.vider('predictions_cache')
+
+def etapes_a_mesurer(tirages, db):
+    """{nom: fonction sans argument} pour chaque étape de l'analyse."""
+    import analyse_loto as a
+    dernier = tirages[-1]
+    contexte = {"doc_id": "bench", "data": dernier.vers_dict()}
+    cible = a.calculer_cible(dernier.date_obj.strftime('%H:%M'))
+    a.detecter_prochain_tirage_et_contexte = lambda: (contexte, cible)
+    rapport = a.analyser_relations_rgntc(tirages, moteur="numpy")
+    forme = a.calculer_formes_et_ecarts(tirages)
+    affinites = a.analyser_affinites_temporelles(tirages, dernier.date_obj.date())
+    connaissance = a.lire_base_connaissance_depuis_firestore(db)
+
+    def analyse_complete():
+        resultat = a.lancer_analyse_complete(db)
+        if resultat.get("erreur"): raise RuntimeError(f"Analyse complète en échec : {resultat['erreur']}")
+    etapes = {
+        "analyser_relations_rgntc[numpy]": lambda: a.analyser_relations_rgntc(tirages, moteur="numpy"),
+        "calculer_forme_et_ecart": lambda: a.calculer_forme_et_ecart(tirages),
+        "calculer_formes_et_ecarts": lambda: a.calculer_formes_et_ecarts(tirages),
+        "analyser_affinites_temporelles": lambda: a.analyser_affinites_temporelles(tirages, dernier.date_obj.date()),
+        "charger_index_cooccurrences": lambda: a.charger_index_cooccurrences(tirages),
+        "generer_et_sauvegarder_heatmaps": lambda: a.generer_et_sauvegarder_heatmaps(rapport, tirages),
+        "generer_prompt_final_pour_ia": lambda: a.generer_prompt_final_pour_ia(dernier, rapport, forme, connaissance, affinites),
+        "lancer_analyse_complete": analyse_complete,
+    }
+    if len(tirages) <= MAX_TIRAGES_MOTEUR_PYTHON:
+        etapes["analyser_relations_rgntc[python]"] = lambda: a.analyser_relations_rgntc(tirages, moteur="python")
+    return etapes
+
+def mesurer_etape(fonction, db):
+    """Médiane de NOMBRE_MESURES exécutions à froid, puis une exécution sous tracemalloc pour la mémoire
+    de pointe (allocations Python et NumPy du processus ; le rendu des images se fait hors processus)."""
+    durees = []
+    for _ in range(NOMBRE_MESURES):
+        reinitialiser_caches(db)
+        debut = time.perf_counter()
+        fonction()
+        durees.append(time.perf_counter() - debut)
+    reinitialiser_caches(db)
+    tracemalloc.start()
+    try:
+        fonction()
+        _, pic = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"temps_s": sorted(durees)[NOMBRE_MESURES // 2], "memoire_pic_mo": pic / 1e6}
+
+def mesurer(tailles):
+    resultats = {}
+    for taille in tailles:
+        print(f"\n--- {taille} tirages synthétiques ---")
+        tirages = generer_tirages(taille)
+        db = db_locale(tirages)
+        resultats[str(taille)] = {}
+        for nom, fonction in etapes_a_mesurer(tirages, db).items():
+            mesure = mesurer_etape(fonction, db)
+            resultats[str(taille)][nom] = mesure
+            print(f"{mesure['temps_s'] * 1000:10.1f} ms  {mesure['memoire_pic_mo']:8.1f} Mo  {nom}")
+    return resultats
+
+def comparer(resultats, reference):
+    """Liste des régressions (temps ou mémoire de pointe) par rapport à un rapport précédent."""
+    regressions = []
+    for taille, etapes in resultats.items():
+        for nom, mesure in etapes.items():
+            ancienne = reference.get("resultats", {}).get(taille, {}).get(nom)
+            if not ancienne: continue
+            if mesure["temps_s"] > TEMPS_MINIMAL_COMPARE and mesure["temps_s"] > ancienne["temps_s"] * SEUIL_REGRESSION_TEMPS:
+                regressions.append(f"{nom} ({taille}) : {mesure['temps_s']*1000:.1f} ms > {ancienne['temps_s']*1000:.1f} ms x {SEUIL_REGRESSION_TEMPS}")
+            if mesure["memoire_pic_mo"] > ancienne["memoire_pic_mo"] * SEUIL_REGRESSION_MEMOIRE and mesure["memoire_pic_mo"] > 1:
+                regressions.append(f"{nom} ({taille}) : {mesure['memoire_pic_mo']:.1f} Mo > {ancienne['memoire_pic_mo']:.1f} Mo x {SEUIL_REGRESSION_MEMOIRE}")
+    return regressions
+
+if __name__ == '__main__':
+    arguments = sys.argv[1:]
+    def valeur(option): return arguments[arguments.index(option) + 1] if option in arguments else None
+    tailles = [int(t) for t in valeur("--tailles").split(",")] if valeur("--tailles") else TAILLES_PAR_DEFAUT
+    chemin_json, chemin_reference = valeur("--json"), valeur("--reference")
+    chemin_json = chemin_json and os.path.abspath(chemin_json)
+    reference = None
+    if chemin_reference:
+        with open(chemin_reference, encoding="utf-8") as f:
+            reference = json.load(f)
+    dossier = preparer_environnement()
+    try:
+        rapport = {"meta": {"date": datetime.now().isoformat(timespec="seconds"), "python": platform.python_version(),
+                            "machine": platform.machine(), "graine": GRAINE, "mesures": NOMBRE_MESURES},
+                   "resultats": mesurer(tailles)}
+    finally:
+        os.chdir(DOSSIER_PROJET)
+        shutil.rmtree(dossier, ignore_errors=True)
+    if chemin_json:
+        with open(chemin_json, "w", encoding="utf-8") as f:
+            json.dump(rapport, f, indent=2, sort_keys=True)
+    if reference:
+        regressions = comparer(rapport["resultats"], reference)
+        if regressions:
+            print("\n❌ Régressions par rapport à la référence :\n- " + "\n- ".join(regressions)); sys.exit(1)
+        print("\n✅ Aucune régression par rapport à la référence.")
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# Mesure du temps d'import au démarrage d'un worker (python -X importtime dans un processus neuf).
+# Usage :
+#   python bench_demarrage.py                    -> rapport des modules les plus coûteux
+#   python bench_demarrage.py --json res.json    -> enregistre aussi les mesures
+#   python bench_demarrage.py --budget budget_demarrage.json  -> code de sortie 1 si le budget est dépassé
+# Le budget est un JSON {"total_ms": ..., "modules": {"nom": ms_max}} ; les temps sont cumulés
+# (le module et tout ce qu'il importe).
+
+import re
+import sys
+import json
+import subprocess
+
+MODULES_PAR_DEFAUT = ["app"]
+NOMBRE_MESURES = 3
+TOP_AFFICHES = 25
+
+LIGNE_IMPORTTIME = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+def mesurer_imports(module):
+    """Importe `module` dans un interpréteur neuf ; retourne {module importé: temps cumulé en ms}."""
+    resultat = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                              capture_output=True, text=True)
+    if resultat.returncode != 0:
+        raise RuntimeError(f"L'import de {module} a échoué :\n{resultat.stderr[-2000:]}")
+    temps = {}
+    for ligne in resultat.stderr.splitlines():
+        correspondance = LIGNE_IMPORTTIME.match(ligne)
+        if correspondance:
+            temps[correspondance.group(4)] = int(correspondance.group(2)) / 1000.0
+    return temps
+
+def mesurer(module):
+    """Médiane de NOMBRE_MESURES imports (le premier réchauffe le cache disque)."""
+    mesures = [mesurer_imports(module) for _ in range(NOMBRE_MESURES)]
+    noms = set().union(*mesures)
+    return {nom: sorted(m.get(nom, 0.0) for m in mesures)[NOMBRE_MESURES // 2] for nom in noms}
+
+def verifier_budget(temps, module, budget):
+    depassements = []
+    total = temps.get(module, 0.0)
+    if "total_ms" in budget and total > budget["total_ms"]:
+        depassements.append(f"total ({module}) : {total:.0f} ms > {budget['total_ms']} ms")
+    for nom, maximum in budget.get("modules", {}).items():
+        if temps.get(nom, 0.0) > maximum:
+            depassements.append(f"{nom} : {temps[nom]:.0f} ms > {maximum} ms")
+    return depassements
+
+if __name__ == '__main__':
+    arguments = sys.argv[1:]
+    chemin_json = arguments[arguments.index("--json") + 1] if "--json" in arguments else None
+    chemin_budget = arguments[arguments.index("--budget") + 1] if "--budget" in arguments else None
+    modules = [a for i, a in enumerate(arguments) if not a.startswith("--") and (i == 0 or arguments[i - 1] not in ("--json", "--budget"))] or MODULES_PAR_DEFAUT
+    rapport, depassements = {}, []
+    budget = None
+    if chemin_budget:
+        with open(chemin_budget, encoding="utf-8") as f:
+            budget = json.load(f)
+    for module in modules:
+        temps = mesurer(module)
+        rapport[module] = temps
+        print(f"\n--- Import de '{module}' : {temps.get(module, 0.0):.0f} ms ---")
+        for nom, ms in sorted(temps.items(), key=lambda e: e[1], reverse=True)[:TOP_AFFICHES]:
+            print(f"{ms:10.1f} ms  {nom}")
+        if budget: depassements += verifier_budget(temps, module, budget)
+    if chemin_json:
+        with open(chemin_json, "w", encoding="utf-8") as f:
+            json.dump(rapport, f, indent=2, sort_keys=True)
+    if depassements:
+        print("\n❌ Budget de démarrage dépassé :\n- " + "\n- ".join(depassements)); sys.exit(1)
+    if budget: print("\n✅ Budget de démarrage respecté.")
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+# Ce fichier fournit un cache en mémoire, partagé par tout le processus, pour les données lues
+# depuis Firestore (tirages, base de connaissance). Chaque entrée a une durée de vie (TTL) et
+# la taille totale est bornée (éviction des entrées les moins récemment utilisées).
+# L'invalidation explicite (après une collecte) touche aussi un fichier de génération par clé :
+# les autres workers et processus de la même machine ignorent alors leur copie à la lecture suivante.
+
+import os
+import sys
+import time
+import tempfile
+import threading
+from collections import OrderedDict
+
+# --- CONFIGURATIONS ---
+TTL_PAR_DEFAUT = int(os.environ.get("CACHE_DONNEES_TTL", "3600"))  # secondes
+TAILLE_MAX_OCTETS = int(os.environ.get("CACHE_DONNEES_TAILLE_MAX", str(64 * 1024 * 1024)))
+FICHIER_GENERATION = os.environ.get("CACHE_DONNEES_GENERATION", os.path.join(tempfile.gettempdir(), "loto_cache_generation"))
+
+# cle -> (valeur, expiration, taille, generation)
+_entrees = OrderedDict()
+_taille_totale = 0
+_verrou = threading.Lock()
+_verrous_chargement = {}
+
+def estimer_taille(objet, deja_vus=None):
+    """Estimation (récursive) de la mémoire occupée par un objet Python."""
+    deja_vus = set() if deja_vus is None else deja_vus
+    if id(objet) in deja_vus: return 0
+    deja_vus.add(id(objet))
+    taille = sys.getsizeof(objet)
+    if hasattr(objet, "nbytes"): return taille + int(objet.nbytes)
+    if isinstance(objet, dict):
+        taille += sum(estimer_taille(k, deja_vus) + estimer_taille(v, deja_vus) for k, v in objet.items())
+    elif isinstance(objet, (list, tuple, set, frozenset)):
+        taille += sum(estimer_taille(e, deja_vus) for e in objet)
+    return taille
+
+def _fichier_generation(cle):
+    return f"{FICHIER_GENERATION}_{cle}"
+
+def generation(cle):
+    """Date de la dernière invalidation de `cle` (par n'importe quel processus de la machine)."""
+    try:
+        return os.stat(_fichier_generation(cle)).st_mtime_ns
+    except OSError:
+        return None
+
+def _retirer(cle):
+    global _taille_totale
+    _taille_totale -= _entrees.pop(cle)[2]
+
+def lire(cle):
+    """Retourne la valeur en cache (ou None si absente, expirée ou invalidée)."""
+    generation_actuelle = generation(cle)
+    with _verrou:
+        entree = _entrees.get(cle)
+        if entree is None: return None
+        if entree[1] < time.monotonic() or entree[3] != generation_actuelle:
+            _retirer(cle); return None
+        _entrees.move_to_end(cle)
+        return entree[0]
+
+def ecrire(cle, valeur, ttl=None, generation_lecture=None):
+    """Met `valeur` en cache. `generation_lecture` est la génération observée avant le chargement :
+    si une invalidation a eu lieu pendant le chargement, la valeur sera rejetée à la lecture suivante."""
+    global _taille_totale
+    taille = estimer_taille(valeur)
+    if taille > TAILLE_MAX_OCTETS:
+        print(f"-> Cache données : '{cle}' ({taille} octets) dépasse la taille maximale, non mis en cache.")
+        return
+    if generation_lecture is None: generation_lecture = generation(cle)
+    with _verrou:
+        if cle in _entrees: _retirer(cle)
+        while _entrees and _taille_totale + taille > TAILLE_MAX_OCTETS:
+            _retirer(next(iter(_entrees)))
+        _entrees[cle] = (valeur, time.monotonic() + (TTL_PAR_DEFAUT if ttl is None else ttl), taille, generation_lecture)
+        _taille_totale += taille
+
+def obtenir(cle, chargeur, ttl=None):
+    """Retourne la valeur en cache ou appelle `chargeur()` (un seul chargement à la fois par clé).
+    Une valeur vide (None, liste ou dict vide) n'est pas mise en cache."""
+    valeur = lire(cle)
+    if valeur is not None: return valeur
+    with _verrou:
+        verrou_cle = _verrous_chargement.setdefault(cle, threading.Lock())
+    with verrou_cle:
+        valeur = lire(cle)
+        if valeur is not None: return valeur
+        generation_lecture = generation(cle)
+        valeur = chargeur()
+        if valeur: ecrire(cle, valeur, ttl, generation_lecture)
+        return valeur
+
+def invalider(*cles):
+    """Invalide les clés données dans ce processus et, via leur fichier de génération,
+    dans les autres processus de la machine."""
+    with _verrou:
+        for cle in cles:
+            if cle in _entrees: _retirer(cle)
+    for cle in cles:
+        try:
+            with open(_fichier_generation(cle), "w") as f:
+                f.write(str(time.time_ns()))
+        except OSError as e:
+            print(f"❌ Cache données : fichier de génération inaccessible ({e}).")
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# Ce fichier met en cache les réponses de Gemini, adressées par leur contenu : la clé est l'empreinte
+# SHA-256 du prompt normalisé et du nom du modèle. Mêmes données (dernier tirage, candidats, affinités)
+# pour une autre cible, après un redémarrage ou lors d'une relance après erreur : la réponse est réutilisée.
+# Deux niveaux : la mémoire du processus (cache_donnees, LRU borné en taille) puis Firestore (collection
+# 'reponses_ia', partagée par les workers et conservée entre les redémarrages). Chaque entrée expire
+# après TTL_CACHE_IA secondes ; le champ 'expire' peut aussi servir de politique TTL Firestore pour
+# supprimer les documents périmés. Seules les réponses réussies sont enregistrées, jamais une erreur.
+
+import os
+import re
+import hashlib
+import unicodedata
+from datetime import datetime, timedelta, timezone
+
+import cache_donnees
+import metriques
+
+# --- CONFIGURATIONS ---
+COLLECTION_CACHE_IA = 'reponses_ia'
+TTL_CACHE_IA = int(os.environ.get("TTL_CACHE_IA", str(7 * 86400)))  # secondes
+VERSION_CLE = "1"  # à incrémenter si la normalisation du prompt change
+
+def normaliser_prompt(prompt):
+    """Forme canonique du prompt : Unicode NFC, fins de ligne \\n, sans espaces en fin de ligne ni lignes vides en trop."""
+    texte = unicodedata.normalize("NFC", prompt).replace("\r\n", "\n").replace("\r", "\n")
+    texte = "\n".join(ligne.rstrip() for ligne in texte.split("\n"))
+    return re.sub(r"\n{3,}", "\n\n", texte).strip()
+
+def empreinte(prompt, modele):
+    """Clé du cache : SHA-256 du prompt normalisé et du modèle."""
+    h = hashlib.sha256()
+    for partie in (VERSION_CLE, modele, normaliser_prompt(prompt)):
+        h.update(partie.encode("utf-8")); h.update(b"\0")
+    return h.hexdigest()
+
+def _cle_memoire(cle):
+    return f"reponse_ia_{cle}"
+
+def lire(db, cle):
+    """Réponse en cache (mémoire, puis Firestore) ou None si absente ou expirée."""
+    reponse = cache_donnees.lire(_cle_memoire(cle))
+    if reponse is not None:
+        metriques.compter_cache_ia("memoire")
+        return reponse
+    if db is not None:
+        try:
+            doc = db.collection(COLLECTION_CACHE_IA).document(cle).get()
+            metriques.compter_lectures(COLLECTION_CACHE_IA)
+            donnees = doc.to_dict() if doc.exists else None
+            restant = (donnees["expire"] - datetime.now(timezone.utc)).total_seconds() if donnees else 0
+            if restant > 0 and donnees.get("reponse"):
+                cache_donnees.ecrire(_cle_memoire(cle), donnees["reponse"], restant)
+                metriques.compter_cache_ia("firestore")
+                return donnees["reponse"]
+        except Exception as e:
+            print(f"❌ Lecture du cache des réponses IA impossible : {e}")
+    metriques.compter_cache_ia("absent")
+    return None
+
+def ecrire(db, cle, reponse, modele):
+    """Enregistre une réponse réussie dans les deux niveaux."""
+    if not reponse: return
+    cache_donnees.ecrire(_cle_memoire(cle), reponse, TTL_CACHE_IA)
+    if db is None: return
+    maintenant = datetime.now(timezone.utc)
+    try:
+        db.collection(COLLECTION_CACHE_IA).document(cle).set(
+            {"reponse": reponse, "modele": modele, "cree": maintenant, "expire": maintenant + timedelta(seconds=TTL_CACHE_IA)})
+        metriques.compter_ecritures(COLLECTION_CACHE_IA)
+    except Exception as e:
+        print(f"❌ Écriture du cache des réponses IA impossible : {e}")
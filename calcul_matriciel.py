@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+# Ce fichier regroupe les calculs vectorisés (NumPy) utilisés par l'analyse.
+
+from datetime import datetime, timedelta, timezone
+import numpy as np
+
+from tirage_compact import masque_numeros, numeros_masque
+
+# --- CONFIGURATIONS ---
+NUMERO_MAX = 90
+TYPES_RELATIONS = ("precurseurs", "compagnons", "suiveurs")
+
+def matrice_incidence(tous_les_tirages):
+    """Construit la matrice tirages x 90 (1 si le numéro est sorti dans le tirage) à partir des masques."""
+    masques = np.array([masque_depuis_entier(t.masque) for t in tous_les_tirages], dtype=np.uint64).reshape(-1, 2)
+    return matrice_depuis_masques(masques).astype(np.float64)
+
+def sommes_fenetre_precedente(X, fenetre):
+    """Ligne i = somme des lignes [i - fenetre, i) de X (fenêtre glissante par sommes cumulées)."""
+    cumul = np.zeros((X.shape[0] + 1, X.shape[1]), dtype=X.dtype)
+    np.cumsum(X, axis=0, out=cumul[1:])
+    indices = np.arange(X.shape[0])
+    return cumul[indices] - cumul[np.maximum(0, indices - fenetre)]
+
+def matrices_rgntc(X, fenetre):
+    """Retourne les matrices 90x90 des relations : M[n-1, m-1] = nombre de fois où m est relation de n."""
+    compagnons = X.T @ X
+    np.fill_diagonal(compagnons, 0)
+    # precurseurs[n, m] : m sorti dans l'un des `fenetre` tirages qui précèdent un tirage contenant n
+    precurseurs = X.T @ sommes_fenetre_precedente(X, fenetre)
+    # Les suiveurs sont la relation inverse des précurseurs
+    return {
+        "precurseurs": np.rint(precurseurs).astype(np.int64),
+        "compagnons": np.rint(compagnons).astype(np.int64),
+        "suiveurs": np.rint(precurseurs.T).astype(np.int64),
+    }
+
+def derniere_apparition(X, decalage=0):
+    """Indice (+ decalage) du dernier tirage de X où chaque numéro est sorti, -1 s'il n'y est jamais sorti."""
+    if X.shape[0] == 0: return np.full(NUMERO_MAX, -1, dtype=np.int64)
+    dernier = decalage + X.shape[0] - 1 - np.argmax(X[::-1] > 0, axis=0)
+    return np.where(X.any(axis=0), dernier, -1).astype(np.int64)
+
+def formes_et_ecarts(formes, derniere, nombre):
+    """{fenetre: {numero: {"forme", "ecart"}}} à partir de `formes` ({fenetre: apparitions de chaque numéro
+    dans les `fenetre` derniers tirages}, None = tout l'historique) et des dernières apparitions.
+    L'écart (tirages depuis la dernière sortie) est plafonné à la fenêtre, comme calculer_forme_et_ecart."""
+    ecarts = np.where(derniere >= 0, nombre - 1 - derniere, np.iinfo(np.int64).max)
+    resultats = {}
+    for fenetre, forme in formes.items():
+        ecart = np.minimum(ecarts, fenetre or nombre)
+        resultats[fenetre] = {n + 1: {"forme": int(forme[n]), "ecart": int(ecart[n])} for n in range(NUMERO_MAX)}
+    return resultats
+
+def top_relations(ligne, top=50):
+    """Équivalent de Counter.most_common(top) sur une ligne de matrice (égalités par numéro croissant)."""
+    non_nuls = np.flatnonzero(ligne)
+    if non_nuls.size == 0: return []
+    ordre = np.lexsort((non_nuls, -ligne[non_nuls]))[:top]
+    return [(int(non_nuls[k]) + 1, int(ligne[non_nuls[k]])) for k in ordre]
+
+def rapport_depuis_matrices(matrices, numeros_presents, top=50):
+    """Convertit les matrices au format {num: {relation: most_common(top)}} de l'analyse."""
+    return {int(num): {k: top_relations(matrices[k][num - 1], top) for k in TYPES_RELATIONS} for num in numeros_presents}
+
+def matrices_depuis_rapport(rapport_rgntc):
+    """Opération inverse (approchée) : matrices 90x90 à partir des listes most_common du rapport."""
+    matrices = {k: np.zeros((NUMERO_MAX, NUMERO_MAX), dtype=np.int64) for k in TYPES_RELATIONS}
+    for num, relations in rapport_rgntc.items():
+        for k in TYPES_RELATIONS:
+            if relations[k]:
+                numeros, valeurs = zip(*relations[k])
+                matrices[k][num - 1, np.array(numeros) - 1] = valeurs
+    # Les compagnons sont symétriques : on complète les paires tronquées d'un seul côté
+    matrices["compagnons"] = np.maximum(matrices["compagnons"], matrices["compagnons"].T)
+    return matrices
+
+def numeros_presents(X):
+    """Numéros (1-90) sortis au moins une fois dans la matrice d'incidence."""
+    return [int(i) + 1 for i in np.flatnonzero(X.sum(axis=0))]
+
+def horodatage(date_obj):
+    """Secondes depuis 1970 (les dates Firestore sont en UTC, celles de l'API sont naïves)."""
+    if date_obj.tzinfo: date_obj = date_obj.astimezone(timezone.utc).replace(tzinfo=None)
+    return int((date_obj - datetime(1970, 1, 1)).total_seconds())
+
+def date_depuis_horodatage(secondes):
+    return datetime(1970, 1, 1) + timedelta(seconds=int(secondes))
+
+# --- MASQUES 90 BITS (2 x uint64 : numéros 1-64 puis 65-90) ---
+def masque_depuis_entier(masque):
+    """Masque 90 bits (entier) -> couple (bits 1-64, bits 65-90)."""
+    return masque & 0xFFFFFFFFFFFFFFFF, masque >> 64
+
+def entier_depuis_masque(bas, haut):
+    return int(bas) | (int(haut) << 64)
+
+def masque_depuis_numeros(numeros):
+    """Retourne le masque d'un tirage sous forme de couple (bits 1-64, bits 65-90)."""
+    return masque_depuis_entier(masque_numeros(numeros))
+
+def numeros_depuis_masque(bas, haut):
+    return numeros_masque(entier_depuis_masque(bas, haut))
+
+def matrice_depuis_masques(masques):
+    """Tableau (N, 2) de masques uint64 -> matrice d'incidence N x 90 (uint8)."""
+    octets = np.ascontiguousarray(masques, dtype='<u8').view(np.uint8).reshape(-1, 16)
+    return np.unpackbits(octets, axis=1, bitorder='little')[:, :NUMERO_MAX]
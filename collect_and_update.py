@@ -7,11 +7,19 @@ from datetime import datetime, timedelta
 import locale
 import os
 import re
+import io
+import csv
+import json
 
 # --- CONFIGURATION ---
 API_URL = "https://lotobonheur.ci/api/results"
 NOM_FICHIER_DONNEES = "resultats_loto_bonheur_COMPLET.csv"
 COLONNES_FINALES = ["date_complete", "nom_du_tirage", "numeros_gagnants", "numeros_machine"]
+# Ingestion incrémentale : index compact des clés récentes (date_complete, nom_du_tirage)
+COLLECTE_INCREMENTALE = os.environ.get("COLLECTE_CSV_INCREMENTALE", "1") == "1"
+NOM_FICHIER_INDEX = NOM_FICHIER_DONNEES + ".index.json"
+HORIZON_INDEX_JOURS = 21  # l'API renvoie au plus quelques semaines de résultats
+FORMAT_DATE_API = '%d/%m/%Y %H:%M'
 
 # --- MAPPINGS HORAIRES ---
 MAPPINGS_HORAIRES = {
@@ -74,11 +82,84 @@ def transform_api_data_to_dataframe(api_data):
                     if parsed: all_draws.append(parsed)
     return pd.DataFrame(all_draws)
 
-# --- LA FONCTION PRINCIPALE QUE L'ON VA IMPORTER ---
-def lancer_collecte():
-    """Exécute tout le pipeline de collecte et retourne un message de statut."""
-    print("--- Lancement de la collecte (version web) ---")
-    
+# --- INGESTION INCRÉMENTALE ---
+def construire_index(df_final, taille_fichier):
+    """Index du fichier : taille, date la plus récente et clés des HORIZON_INDEX_JOURS derniers jours."""
+    dates = pd.to_datetime(df_final['date_complete'], format='mixed', dayfirst=True)
+    derniere_date = dates.max()
+    horizon = derniere_date - timedelta(days=HORIZON_INDEX_JOURS)
+    recents = df_final[dates >= horizon]
+    return {
+        "taille": taille_fichier, "derniere_date": derniere_date.isoformat(), "horizon": horizon.isoformat(),
+        "cles_recentes": [[d, n] for d, n in zip(recents['date_complete'].astype(str), recents['nom_du_tirage'].astype(str))],
+    }
+
+def lire_index():
+    try:
+        with open(NOM_FICHIER_INDEX, encoding="utf-8") as f:
+            index = json.load(f)
+        if os.path.getsize(NOM_FICHIER_DONNEES) != index["taille"]:
+            print("-> Index du fichier CSV périmé (taille différente).")
+            return None
+        return index
+    except (OSError, ValueError, KeyError):
+        return None
+
+def ecrire_index(index):
+    temporaire = NOM_FICHIER_INDEX + ".tmp"
+    with open(temporaire, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False)
+    os.replace(temporaire, NOM_FICHIER_INDEX)
+
+def ajouter_en_fin_de_fichier(df_nouveau):
+    """Ajoute les lignes vraiment nouvelles en fin de fichier. Retourne le nombre d'ajouts, ou None
+    si un recalcul complet est nécessaire (pas d'index valide ou tirage arrivé dans le désordre).
+    Les lignes antérieures à l'horizon de l'index sont ignorées : l'index ne les couvre pas, et les
+    traiter comme nouvelles imposerait une réécriture complète à chaque collecte."""
+    index = lire_index()
+    if index is None: return None
+    derniere_date, horizon = datetime.fromisoformat(index["derniere_date"]), datetime.fromisoformat(index["horizon"])
+    cles_connues = {tuple(c) for c in index["cles_recentes"]}
+    nouvelles, ignorees = {}, 0
+    for ligne in df_nouveau[COLONNES_FINALES].astype(str).itertuples(index=False):
+        cle = (ligne.date_complete, ligne.nom_du_tirage)
+        if cle in cles_connues: continue
+        try:
+            date_obj = datetime.strptime(ligne.date_complete, FORMAT_DATE_API)
+        except ValueError:
+            continue  # date illisible : ligne ignorée, comme dans parse_draw_data
+        if date_obj < horizon:
+            ignorees += 1; continue
+        if date_obj < derniere_date:
+            print(f"-> Tirage hors ordre ({ligne.date_complete} {ligne.nom_du_tirage}) : réécriture complète.")
+            return None
+        nouvelles[cle] = (date_obj, ligne)  # en cas de doublon dans l'API, la dernière occurrence gagne
+    if ignorees:
+        print(f"-> {ignorees} tirage(s) antérieur(s) à l'horizon de l'index ({HORIZON_INDEX_JOURS} jours) ignoré(s).")
+    if not nouvelles: return 0
+    tampon = io.StringIO()
+    ecrivain = csv.writer(tampon, lineterminator="\n")
+    for date_obj, ligne in sorted(nouvelles.values(), key=lambda v: v[0]):
+        ecrivain.writerow(list(ligne))
+    # Une seule écriture en mode ajout, puis fsync : l'index n'est mis à jour qu'ensuite, une écriture
+    # interrompue est donc détectée (taille différente) et corrigée par une réécriture complète.
+    with open(NOM_FICHIER_DONNEES, "rb") as f:
+        f.seek(max(0, index["taille"] - 1))
+        prefixe = "" if f.read(1) in (b"\n", b"") else "\n"
+    with open(NOM_FICHIER_DONNEES, "a", encoding="utf-8", newline="") as f:
+        f.write(prefixe + tampon.getvalue())
+        f.flush(); os.fsync(f.fileno())
+    dates_ajoutees = [v[0] for v in nouvelles.values()]
+    nouvelle_derniere = max(dates_ajoutees + [derniere_date])
+    nouvel_horizon = nouvelle_derniere - timedelta(days=HORIZON_INDEX_JOURS)
+    cles = [c for c in index["cles_recentes"] if pd.to_datetime(c[0], format='mixed', dayfirst=True) >= nouvel_horizon] \
+        if nouvel_horizon > horizon else index["cles_recentes"]
+    ecrire_index({"taille": os.path.getsize(NOM_FICHIER_DONNEES), "derniere_date": nouvelle_derniere.isoformat(),
+                  "horizon": nouvel_horizon.isoformat(), "cles_recentes": cles + [list(c) for c in nouvelles]})
+    return len(nouvelles)
+
+def reecrire_fichier_complet(df_nouveau):
+    """Ancien fonctionnement : fusion, dédoublonnage, tri et réécriture (atomique) du fichier."""
     if os.path.exists(NOM_FICHIER_DONNEES):
         df_existant = pd.read_csv(NOM_FICHIER_DONNEES)
     else:
@@ -86,12 +167,6 @@ def lancer_collecte():
     
     taille_avant = len(df_existant)
 
-    latest_api_data = get_latest_data_from_api()
-    df_nouveau = transform_api_data_to_dataframe(latest_api_data)
-
-    if df_nouveau.empty:
-        return "Aucune nouvelle donnée valide à ajouter. Le fichier est déjà à jour."
-    
     df_combine = pd.concat([df_existant, df_nouveau], ignore_index=True)
     df_combine.drop_duplicates(subset=['date_complete', 'nom_du_tirage'], keep='last', inplace=True)
     
@@ -99,10 +174,31 @@ def lancer_collecte():
     df_final = df_combine.sort_values(by='date_obj', ascending=True).drop(columns=['date_obj'])
     df_final = df_final[COLONNES_FINALES]
     
-    df_final.to_csv(NOM_FICHIER_DONNEES, index=False)
+    temporaire = NOM_FICHIER_DONNEES + ".tmp"
+    df_final.to_csv(temporaire, index=False)
+    os.replace(temporaire, NOM_FICHIER_DONNEES)
+    ecrire_index(construire_index(df_final, os.path.getsize(NOM_FICHIER_DONNEES)))
+    return len(df_final) - taille_avant
+
+# --- LA FONCTION PRINCIPALE QUE L'ON VA IMPORTER ---
+def lancer_collecte(incremental=None):
+    """Exécute tout le pipeline de collecte et retourne un message de statut.
+    En mode incrémental, seules les lignes nouvelles sont ajoutées en fin de fichier ; le fichier
+    n'est réécrit entièrement que sans index valide ou si un tirage arrive dans le désordre."""
+    print("--- Lancement de la collecte (version web) ---")
+    incremental = COLLECTE_INCREMENTALE if incremental is None else incremental
+
+    latest_api_data = get_latest_data_from_api()
+    df_nouveau = transform_api_data_to_dataframe(latest_api_data)
+
+    if df_nouveau.empty:
+        return "Aucune nouvelle donnée valide à ajouter. Le fichier est déjà à jour."
+
+    nouveaux_ajouts = ajouter_en_fin_de_fichier(df_nouveau) if incremental and os.path.exists(NOM_FICHIER_DONNEES) else None
+    if nouveaux_ajouts is None:
+        nouveaux_ajouts = reecrire_fichier_complet(df_nouveau)
     
-    nouveaux_ajouts = len(df_final) - taille_avant
     if nouveaux_ajouts > 0:
         return f"Mise à jour réussie ! {nouveaux_ajouts} tirage(s) ajouté(s)."
     else:
-        return "Aucune nouvelle donnée à ajouter. Le fichier est déjà à jour."
\ No newline at end of file
+        return "Aucune nouvelle donnée à ajouter. Le fichier est déjà à jour."
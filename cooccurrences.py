@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+# Ce fichier maintient un index des co-occurrences de paires et de triplets sur tout l'historique,
+# pour trois portées : numéros gagnants, numéros machine et tirage combiné (union gagnants + machine).
+# - Paires : matrice 90x90 (comptes complets, sans la troncature most_common(50) des compagnons RGNTC).
+# - Triplets : un compteur par combinaison a < b < c, rangée dans l'ordre colexicographique
+#   (C(90, 3) = 117 480 cases, ~470 Ko par portée au lieu d'un Counter de tuples).
+# L'index est construit en une passe vectorisée, enregistré à côté de la copie locale et prolongé
+# quand des tirages arrivent (reconstruit si l'historique a changé, comme les agrégats cumulés).
+
+import os
+from itertools import combinations
+import numpy as np
+
+import calcul_matriciel
+import stockage_local
+import agregats_cumules
+
+# --- CONFIGURATIONS ---
+PORTEES = ("gagnants", "machine", "combine")
+PORTEE_DEFAUT = "combine"
+NOMBRE_TRIPLETS = 90 * 89 * 88 // 6
+TAILLE_LOT = 20000  # tirages traités à la fois pendant la construction (mémoire bornée)
+NOM_FICHIER = "cooccurrences.npz"
+FORMAT_INDEX = 2  # à incrémenter si le calcul d'une portée change : un index d'un autre format est reconstruit
+
+# Index déjà chargé par ce processus : (version de la copie locale, index)
+_index_memoire = None
+_table_triplets = None
+
+def rang_triplets(triplets):
+    """Rang colexicographique de triplets d'indices (0-89) triés a < b < c : C(c, 3) + C(b, 2) + a."""
+    triplets = np.asarray(triplets, dtype=np.int64)
+    a, b, c = triplets[..., 0], triplets[..., 1], triplets[..., 2]
+    return c * (c - 1) * (c - 2) // 6 + b * (b - 1) // 2 + a
+
+def table_triplets():
+    """Triplets (numéros 1-90) rangés par rang : table[rang] = (a, b, c)."""
+    global _table_triplets
+    if _table_triplets is None:
+        triplets = np.array(list(combinations(range(calcul_matriciel.NUMERO_MAX), 3)), dtype=np.int64)
+        table = np.empty_like(triplets)
+        table[rang_triplets(triplets)] = triplets + 1
+        _table_triplets = table
+    return _table_triplets
+
+def _comptes_triplets(X):
+    """Nombre d'apparitions de chaque triplet dans les tirages X (uint8, tirages x 90)."""
+    comptes = np.zeros(NOMBRE_TRIPLETS, dtype=np.int64)
+    for debut in range(0, len(X), TAILLE_LOT):
+        lot = X[debut:debut + TAILLE_LOT]
+        tailles = lot.sum(axis=1, dtype=np.int64)
+        k = int(tailles.max()) if len(lot) else 0
+        if k < 3: continue
+        # Indices des numéros sortis de chaque tirage, croissants, complétés jusqu'à k colonnes
+        positions = np.argsort(lot == 0, axis=1, kind="stable")[:, :k]
+        choix = np.array(list(combinations(range(k), 3)))
+        valides = choix[:, 2][None, :] < tailles[:, None]
+        rangs = rang_triplets(np.stack([positions[:, choix[:, 0]], positions[:, choix[:, 1]], positions[:, choix[:, 2]]], axis=-1))
+        comptes += np.bincount(rangs[valides], minlength=NOMBRE_TRIPLETS)
+    return comptes
+
+def _matrices_portees(masques_gagnants, masques_machine):
+    """Matrices d'incidence (uint8) de chaque portée, depuis les masques gagnants et machine."""
+    gagnants = calcul_matriciel.matrice_depuis_masques(masques_gagnants)
+    machine = calcul_matriciel.matrice_depuis_masques(masques_machine)
+    return {"gagnants": gagnants, "machine": machine, "combine": gagnants | machine}
+
+def _prolonger(index, masques_gagnants, masques_machine):
+    """Ajoute à l'index les tirages [nombre, len(masques_gagnants))."""
+    ancien = index["nombre"]
+    for portee, X in _matrices_portees(masques_gagnants[ancien:], masques_machine[ancien:]).items():
+        Xf = X.astype(np.float64)  # produit BLAS, exact pour des comptes < 2**53
+        paires = np.rint(Xf.T @ Xf).astype(np.int32)
+        np.fill_diagonal(paires, 0)
+        index[f"paires_{portee}"] = index[f"paires_{portee}"] + paires
+        index[f"triplets_{portee}"] = index[f"triplets_{portee}"] + _comptes_triplets(X).astype(np.int32)
+    index["nombre"] = len(masques_gagnants)
+
+def construire(masques_gagnants, masques_machine):
+    """Index complet à partir des masques (N x 2 uint64) des numéros gagnants et des numéros machine."""
+    index = {"nombre": 0}
+    for portee in PORTEES:
+        index[f"paires_{portee}"] = np.zeros((calcul_matriciel.NUMERO_MAX, calcul_matriciel.NUMERO_MAX), dtype=np.int32)
+        index[f"triplets_{portee}"] = np.zeros(NOMBRE_TRIPLETS, dtype=np.int32)
+    _prolonger(index, np.asarray(masques_gagnants), np.asarray(masques_machine))
+    return index
+
+def construire_depuis_tirages(tirages):
+    """Index des tirages chargés (Tirage), quand la copie locale n'est pas disponible."""
+    masques_gagnants = np.array([calcul_matriciel.masque_depuis_entier(t.masque_gagnants) for t in tirages], dtype=np.uint64).reshape(-1, 2)
+    masques_machine = np.array([calcul_matriciel.masque_depuis_entier(t.masque_machine) for t in tirages], dtype=np.uint64).reshape(-1, 2)
+    return construire(masques_gagnants, masques_machine)
+
+# --- REQUÊTES ---
+def compagnons(index, numeros, portee=PORTEE_DEFAUT, k=10):
+    """Meilleurs compagnons d'un numéro (paires) ou d'une paire de numéros (triplets) : [(numero, fois)]."""
+    numeros = sorted(set(numeros))
+    if portee not in PORTEES: raise ValueError(f"Portée inconnue : {portee}")
+    if not all(1 <= n <= calcul_matriciel.NUMERO_MAX for n in numeros): raise ValueError("Numéros hors de 1-90.")
+    if len(numeros) == 1:
+        ligne = index[f"paires_{portee}"][numeros[0] - 1].astype(np.int64)
+    elif len(numeros) == 2:
+        a, b = numeros[0] - 1, numeros[1] - 1
+        troisiemes = np.arange(calcul_matriciel.NUMERO_MAX)
+        triplets = np.sort(np.stack([np.full_like(troisiemes, a), np.full_like(troisiemes, b), troisiemes], axis=1), axis=1)
+        ligne = index[f"triplets_{portee}"][rang_triplets(triplets)].astype(np.int64)
+        ligne[[a, b]] = 0
+    else:
+        raise ValueError("Les compagnons se demandent pour un ou deux numéros.")
+    return calcul_matriciel.top_relations(ligne, k)
+
+def top_paires(index, portee=PORTEE_DEFAUT, k=10):
+    """Paires les plus fréquentes : [((a, b), fois)], à égalité dans l'ordre des numéros."""
+    a, b = np.triu_indices(calcul_matriciel.NUMERO_MAX, 1)
+    comptes = index[f"paires_{portee}"][a, b]
+    ordre = np.lexsort((b, a, -comptes))[:k]
+    return [((int(a[i]) + 1, int(b[i]) + 1), int(comptes[i])) for i in ordre if comptes[i] > 0]
+
+def top_triplets(index, portee=PORTEE_DEFAUT, k=10):
+    """Triplets les plus fréquents : [((a, b, c), fois)]."""
+    comptes = index[f"triplets_{portee}"]
+    k = min(k, NOMBRE_TRIPLETS)
+    # Tous les triplets au moins égaux au k-ième compte, puis ordre des numéros (a, b, c) à égalité
+    seuil = max(1, np.partition(comptes, NOMBRE_TRIPLETS - k)[NOMBRE_TRIPLETS - k])
+    candidats = np.flatnonzero(comptes >= seuil)
+    triplets = table_triplets()[candidats]
+    ordre = np.lexsort((triplets[:, 2], triplets[:, 1], triplets[:, 0], -comptes[candidats]))[:k]
+    return [(tuple(int(n) for n in triplets[i]), int(comptes[candidats[i]])) for i in ordre]
+
+def meilleurs_troisiemes(index, numeros, portee=PORTEE_DEFAUT, k=5):
+    """Pour chaque paire de `numeros`, le numéro qui la complète le plus souvent ; les k triplets les
+    plus fréquents : [((a, b), troisieme, fois)]."""
+    paires = np.array(list(combinations(sorted(set(numeros)), 2)), dtype=np.int64).reshape(-1, 2) - 1
+    if not len(paires): return []
+    troisiemes = np.arange(calcul_matriciel.NUMERO_MAX)
+    triplets = np.stack([np.repeat(paires[:, :1], len(troisiemes), axis=1), np.repeat(paires[:, 1:], len(troisiemes), axis=1),
+                         np.broadcast_to(troisiemes, (len(paires), len(troisiemes)))], axis=-1)
+    comptes = index[f"triplets_{portee}"][rang_triplets(np.sort(triplets, axis=-1))].astype(np.int64)
+    comptes[np.arange(len(paires)), paires[:, 0]] = 0
+    comptes[np.arange(len(paires)), paires[:, 1]] = 0
+    meilleurs = comptes.argmax(axis=1)  # à égalité, le plus petit numéro
+    fois = comptes[np.arange(len(paires)), meilleurs]
+    ordre = np.lexsort((paires[:, 1], paires[:, 0], -fois))[:k]
+    return [((int(paires[i, 0]) + 1, int(paires[i, 1]) + 1), int(meilleurs[i]) + 1, int(fois[i])) for i in ordre if fois[i] > 0]
+
+# --- PERSISTANCE (à côté de la copie locale) ---
+def sauvegarder(index, empreinte, chemin):
+    temporaire = f"{chemin}.{os.getpid()}.tmp.npz"  # un fichier temporaire par worker
+    np.savez_compressed(temporaire, empreinte=np.array(empreinte), format=np.array(FORMAT_INDEX),
+                        **{k: np.asarray(v) for k, v in index.items()})
+    os.replace(temporaire, chemin)
+
+def charger(chemin):
+    try:
+        with np.load(chemin) as donnees:
+            index = {k: donnees[k] for k in donnees.files}
+    except (OSError, ValueError):
+        return None, None
+    if int(index.pop("format", 1)) != FORMAT_INDEX: return None, None
+    index["nombre"] = int(index["nombre"])
+    return index, str(index.pop("empreinte"))
+
+def index_copie_locale():
+    """Index à jour avec la copie locale des tirages (prolongé ou reconstruit si nécessaire), None si elle est vide."""
+    global _index_memoire
+    colonnes, _ = stockage_local.charger_colonnes()
+    meta = stockage_local.lire_meta()
+    if colonnes is None or not meta: return None
+    if _index_memoire and _index_memoire[0] == meta["version"]:
+        return _index_memoire[1]
+    chemin = os.path.join(stockage_local.DOSSIER_STOCKAGE, NOM_FICHIER)
+    index, empreinte_fichier = charger(chemin)
+    nombre = len(colonnes["masques"])
+    if (index is None or index["nombre"] > nombre
+            or empreinte_fichier != agregats_cumules.empreinte(colonnes, index["nombre"])):
+        print("-> Index des co-occurrences absent ou périmé : reconstruction sur tout l'historique.")
+        index = construire(colonnes["masques_gagnants"], colonnes["masques_machine"])
+        sauvegarder(index, agregats_cumules.empreinte(colonnes, nombre), chemin)
+    elif index["nombre"] < nombre:
+        print(f"-> Index des co-occurrences prolongé de {nombre - index['nombre']} tirage(s).")
+        _prolonger(index, colonnes["masques_gagnants"], colonnes["masques_machine"])
+        sauvegarder(index, agregats_cumules.empreinte(colonnes, nombre), chemin)
+    _index_memoire = (meta["version"], index)
+    return index
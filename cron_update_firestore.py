@@ -1,13 +1,15 @@
 # -*- coding: utf-8 -*-
 # Ce fichier est une bibliothèque de fonctions conçue pour mettre à jour Firestore.
 
-import firebase_admin
-from firebase_admin import credentials, firestore
-import requests
-from datetime import datetime
+# firebase_admin et requests sont importés à la première utilisation (démarrage rapide des workers)
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import re
 import os
 import json
+import time
+import random
+import tempfile
 
 # --- On importe nos secrets (si le fichier existe) ---
 try:
@@ -16,12 +18,35 @@ try:
 except ImportError:
     SECRETS_DISPONIBLES = False
 
+# Cache en mémoire des tirages lus par l'analyse (invalidé après chaque ajout)
+import cache_donnees
+import metriques
+# Représentation compacte des tirages (copie locale, snapshot RGNTC)
+from tirage_compact import Tirage
+# Backend de stockage : Firestore (défaut) ou SQLite local (BACKEND_STOCKAGE=sqlite)
+import firestore_sqlite
+
+# --- Snapshot RGNTC et copie locale des tirages (optionnels, NumPy) ---
+try:
+    import rgntc_incremental
+    import stockage_local
+    import agregats_cumules
+    import resume_firestore
+    RGNTC_INCREMENTAL_DISPONIBLE = True
+except ImportError:
+    RGNTC_INCREMENTAL_DISPONIBLE = False
+
 # --- VARIABLE GLOBALE POUR LA DB (initialisée à None) ---
 db = None
 
 def init_firestore():
     """Initialise la connexion à Firestore si elle n'est pas déjà faite."""
     global db
+    if firestore_sqlite.BACKEND_SQLITE:
+        if db is None: db = firestore_sqlite.client_sqlite()
+        return True
+    import firebase_admin
+    from firebase_admin import credentials, firestore
     if db is None and not firebase_admin._apps:
         print("Tentative d'initialisation de Firebase...")
         try:
@@ -61,6 +86,21 @@ MAPPINGS_HORAIRES = {
     "21H": ["Digital 21h"], "22H": ["Digital 22h"], "23H": ["Digital 23h"]
 }
 
+# Watermark : date du dernier tirage ingéré et IDs de la fenêtre récente (une seule lecture par collecte)
+COLLECTION_META = 'meta'
+DOCUMENT_WATERMARK = 'watermark_tirages'
+FENETRE_WATERMARK = timedelta(days=int(os.environ.get("FENETRE_WATERMARK_JOURS", "21")))  # > historique renvoyé par l'API
+TAILLE_LOT = 499
+MAX_LOTS_PARALLELES = int(os.environ.get("MAX_LOTS_PARALLELES", "4"))
+NOMBRE_ESSAIS_LOT = 4
+DELAI_NOUVEL_ESSAI_LOT = 1.0  # secondes, doublé à chaque essai
+
+FICHIER_CONTEXTE = os.environ.get("FICHIER_CONTEXTE", os.path.join(tempfile.gettempdir(), "loto_dernier_tirage.json"))
+
+# Dernière réponse de l'API (pour les requêtes conditionnelles) et dernier tirage mémorisé
+_derniere_reponse_api = None
+_dernier_tirage_memorise = None
+
 def deviner_heure_precise(nom_tirage):
     for heure, noms in MAPPINGS_HORAIRES.items():
         if nom_tirage in noms: return heure.replace('H', ':00')
@@ -70,14 +110,60 @@ def deviner_heure_precise(nom_tirage):
     return "00:00"
 
 def get_latest_data_from_api():
+    """Appel conditionnel (ETag / Last-Modified) : si l'API répond 304, la dernière réponse est réutilisée."""
+    global _derniere_reponse_api
+    import requests
     print("-> Appel de l'API Loto Bonheur...")
+    entetes = {}
+    if _derniere_reponse_api:
+        if _derniere_reponse_api.get("etag"): entetes["If-None-Match"] = _derniere_reponse_api["etag"]
+        if _derniere_reponse_api.get("last_modified"): entetes["If-Modified-Since"] = _derniere_reponse_api["last_modified"]
     try:
-        response = requests.get(API_URL, timeout=30)
+        with metriques.mesurer("api_lotobonheur"):
+            response = requests.get(API_URL, timeout=30, headers=entetes)
+        if response.status_code == 304 and _derniere_reponse_api:
+            print("-> API inchangée (304), réutilisation de la dernière réponse.")
+            return _derniere_reponse_api["donnees"]
         response.raise_for_status()
-        return response.json()
+        donnees = response.json()
+        _derniere_reponse_api = {"etag": response.headers.get("ETag"), "last_modified": response.headers.get("Last-Modified"), "donnees": donnees}
+        return donnees
     except Exception as e:
         print(f"-> Erreur API : {e}"); return None
 
+# --- DERNIER TIRAGE CONNU (contexte de l'analyse) ---
+def memoriser_dernier_tirage(tirages):
+    """Mémorise le plus récent des tirages parsés (format {"doc_id", "data"}), en mémoire et dans
+    FICHIER_CONTEXTE pour les autres processus de la machine."""
+    global _dernier_tirage_memorise
+    if not tirages: return
+    dernier = max(tirages, key=lambda t: t['data']['date_obj'])
+    _dernier_tirage_memorise = (time.time(), dernier)
+    try:
+        donnees = {"doc_id": dernier["doc_id"], "data": dict(dernier["data"], date_obj=dernier["data"]["date_obj"].isoformat())}
+        temporaire = FICHIER_CONTEXTE + ".tmp"
+        with open(temporaire, "w", encoding="utf-8") as f:
+            json.dump(donnees, f, ensure_ascii=False)
+        os.replace(temporaire, FICHIER_CONTEXTE)
+    except OSError as e:
+        print(f"❌ Impossible d'écrire le contexte partagé : {e}")
+
+def lire_dernier_tirage_memorise(ttl):
+    """Retourne le dernier tirage mémorisé il y a moins de `ttl` secondes (ce processus ou un autre), sinon None."""
+    global _dernier_tirage_memorise
+    if _dernier_tirage_memorise and time.time() - _dernier_tirage_memorise[0] < ttl:
+        return _dernier_tirage_memorise[1]
+    try:
+        date_fichier = os.path.getmtime(FICHIER_CONTEXTE)
+        if time.time() - date_fichier >= ttl: return None
+        with open(FICHIER_CONTEXTE, encoding="utf-8") as f:
+            donnees = json.load(f)
+        donnees["data"]["date_obj"] = datetime.fromisoformat(donnees["data"]["date_obj"])
+        _dernier_tirage_memorise = (date_fichier, donnees)
+        return donnees
+    except (OSError, ValueError, KeyError):
+        return None
+
 def parse_draw_data(draw, date_str, current_year):
     if not isinstance(draw, dict) or not draw.get('winningNumbers') or '.' in draw.get('winningNumbers'): return None
     draw_name = draw.get('drawName', '').strip()
@@ -106,63 +192,165 @@ def parse_and_transform(api_data):
     print(f"-> {len(all_draws)} tirages valides extraits de l'API.")
     return all_draws
 
-def lancer_collecte_vers_firestore():
-    """Fonction principale optimisée pour respecter les quotas de Firestore."""
+# --- WATERMARK DE COLLECTE ET ÉCRITURE DES LOTS ---
+def _date_naive(date_obj):
+    """Les dates Firestore sont en UTC avec fuseau, celles de l'API sont naïves (Abidjan = UTC)."""
+    return date_obj.astimezone(timezone.utc).replace(tzinfo=None) if date_obj.tzinfo else date_obj
+
+def _date_depuis_id(doc_id):
+    return datetime.strptime(doc_id[:12], '%Y%m%d%H%M')
+
+def lire_watermark():
+    """Lit le document watermark : {"date_obj": dernier tirage ingéré, "ids_recents": IDs de la fenêtre}.
+    S'il n'existe pas encore, il est reconstitué depuis les derniers tirages de la collection.
+    Retourne None en cas d'erreur."""
+    print("-> Lecture du watermark de collecte...")
+    try:
+        doc = db.collection(COLLECTION_META).document(DOCUMENT_WATERMARK).get()
+        metriques.compter_lectures(COLLECTION_META)
+        if doc.exists:
+            donnees = doc.to_dict()
+            date_obj = _date_naive(donnees["date_obj"]) if donnees.get("date_obj") else None
+            return {"date_obj": date_obj, "ids_recents": list(donnees.get("ids_recents", []))}
+        print("-> Watermark absent : reconstitution depuis les 300 derniers tirages.")
+        query = db.collection('tirages').order_by('date_obj', direction='DESCENDING').limit(300).select([])
+        ids = [d.id for d in query.stream()]
+        metriques.compter_lectures('tirages', len(ids))
+        date_obj = max((_date_depuis_id(i) for i in ids), default=None)
+        return {"date_obj": date_obj, "ids_recents": ids}
+    except Exception as e:
+        print(f"❌ Erreur lors de la lecture du watermark : {e}")
+        return None
+
+def mettre_a_jour_watermark(watermark, tirages_ajoutes):
+    """Avance le watermark après écriture des tirages. Seuls les IDs de la fenêtre sont conservés."""
+    date_obj = max(t["data"]["date_obj"] for t in tirages_ajoutes)
+    if watermark["date_obj"]: date_obj = max(date_obj, watermark["date_obj"])
+    limite = date_obj - FENETRE_WATERMARK
+    ids = set(watermark["ids_recents"]) | {t["doc_id"] for t in tirages_ajoutes}
+    ids_recents = sorted(i for i in ids if _date_depuis_id(i) > limite)
+    try:
+        db.collection(COLLECTION_META).document(DOCUMENT_WATERMARK).set(
+            {"date_obj": date_obj, "ids_recents": ids_recents, "mis_a_jour": datetime.now(timezone.utc)})
+        metriques.compter_ecritures(COLLECTION_META)
+    except Exception as e:
+        # Sans conséquence sur les données : les tirages seront simplement réécrits à la prochaine collecte
+        print(f"❌ Impossible de mettre à jour le watermark : {e}")
+
+def _ecrire_lot(lot, numero):
+    """Écrit un lot (<= 499 documents) avec nouvelles tentatives et attente exponentielle."""
+    for essai in range(NOMBRE_ESSAIS_LOT):
+        try:
+            collection_ref = db.collection('tirages')
+            batch = db.batch()
+            for tirage in lot:
+                batch.set(collection_ref.document(tirage["doc_id"]), tirage["data"])
+            batch.commit()
+            metriques.compter_ecritures('tirages', len(lot))
+            print(f"   -> Lot {numero} : {len(lot)} documents envoyés.")
+            return lot
+        except Exception as e:
+            if essai == NOMBRE_ESSAIS_LOT - 1: raise
+            attente = DELAI_NOUVEL_ESSAI_LOT * 2 ** essai * (1 + random.random())
+            print(f"   -> Lot {numero} : échec ({e}), nouvel essai dans {attente:.1f} s.")
+            time.sleep(attente)
+
+def ecrire_lots_en_parallele(tirages):
+    """Écrit les tirages par lots de 499, plusieurs lots à la fois. Retourne les tirages écrits."""
+    lots = [tirages[i:i + TAILLE_LOT] for i in range(0, len(tirages), TAILLE_LOT)]
+    if not lots: return []
+    ecrits = []
+    with ThreadPoolExecutor(max_workers=min(MAX_LOTS_PARALLELES, len(lots)), thread_name_prefix="lot") as executeur:
+        futures = {executeur.submit(_ecrire_lot, lot, numero): numero for numero, lot in enumerate(lots, 1)}
+        for future in as_completed(futures):
+            try:
+                ecrits.extend(future.result())
+            except Exception as e:
+                print(f"❌ Lot {futures[future]} abandonné : {e}")
+    return ecrits
+
+def lancer_collecte_vers_firestore(prechauffer=True):
+    """Fonction principale optimisée pour respecter les quotas de Firestore. Retourne un message de statut.
+    Si de nouveaux tirages sont ajoutés et `prechauffer` est vrai, l'analyse de la prochaine cible est lancée."""
+    nouveaux_ajouts, message = collecter_vers_firestore()
+    if nouveaux_ajouts > 0 and prechauffer:
+        try:
+            import prechauffage  # import local : prechauffage dépend de analyse_loto, qui importe ce module
+            prechauffage.prechauffer_prochaine_cible(db)
+        except Exception as e:
+            print(f"❌ Préchauffage de la prochaine cible impossible : {e}")
+    return message
+
+def collecter_vers_firestore():
+    """Écrit les nouveaux tirages de l'API dans Firestore. Retourne (nombre d'ajouts, message)."""
+    with metriques.journal("collecte"):
+        with metriques.mesurer("collecte"):
+            return _collecter_vers_firestore()
+
+def _collecter_vers_firestore():
     if not init_firestore():
-        return "Erreur : La connexion à Firestore n'a pas pu être établie."
+        return 0, "Erreur : La connexion à Firestore n'a pas pu être établie."
 
     print("\n--- Lancement de la collecte vers Firestore (Optimisée) ---")
     
     api_data = get_latest_data_from_api()
     nouveaux_tirages = parse_and_transform(api_data)
+    memoriser_dernier_tirage(nouveaux_tirages)
 
     if not nouveaux_tirages:
         message = "Aucun nouveau tirage valide trouvé dans l'API."
-        print(message); return message
+        print(message); return 0, message
+
+    # Dédoublonnage : une seule lecture (le document watermark) au lieu des 300 derniers IDs
+    with metriques.mesurer("lecture_watermark"):
+        watermark = lire_watermark()
+    if watermark is None:
+        return 0, "Erreur lors de la vérification des données existantes."
+    date_limite = watermark["date_obj"] - FENETRE_WATERMARK if watermark["date_obj"] else None
+    ids_recents = set(watermark["ids_recents"])
+    a_ecrire = [t for t in nouveaux_tirages
+                if t["doc_id"] not in ids_recents and (date_limite is None or t["data"]["date_obj"] > date_limite)]
+    print(f"-> {len(nouveaux_tirages) - len(a_ecrire)} tirage(s) déjà présent(s), {len(a_ecrire)} à écrire.")
+
+    with metriques.mesurer("ecriture_tirages"):
+        tirages_ajoutes = ecrire_lots_en_parallele(a_ecrire)
+    nouveaux_ajouts = len(tirages_ajoutes)
+    if tirages_ajoutes:
+        mettre_a_jour_watermark(watermark, tirages_ajoutes)
+
+    if tirages_ajoutes and RGNTC_INCREMENTAL_DISPONIBLE:
+        try:
+            rgntc_incremental.integrer_nouveaux_tirages(tirages_ajoutes)
+        except Exception as e:
+            print(f"❌ Mise à jour du snapshot RGNTC impossible : {e}")
+        # La copie locale n'est complétée que si elle existe déjà (sinon elle serait amorcée incomplète)
+        try:
+            if stockage_local.lire_meta():
+                stockage_local.ajouter_tirages([Tirage.depuis_dict(t["data"]) for t in tirages_ajoutes])
+                agregats_cumules.agregats_copie_locale()  # prolonge les agrégats et l'index calendaire
+        except Exception as e:
+            print(f"❌ Mise à jour de la copie locale des tirages impossible : {e}")
+        # Résumé lu par l'analyse (1 document au lieu de ~1 000) ; reconstruit au besoin depuis 'tirages'
+        try:
+            with metriques.mesurer("resume_analyse"):
+                resume_firestore.mettre_a_jour(db, tirages_ajoutes)
+        except Exception as e:
+            print(f"❌ Mise à jour du résumé d'analyse impossible : {e}")
 
-    collection_ref = db.collection('tirages')
-    batch = db.batch()
-    nouveaux_ajouts = 0
-    
-    # --- OPTIMISATION MAJEURE ICI ---
-    # 1. On récupère les IDs des 300 derniers tirages stockés
-    print("-> Récupération des IDs récents depuis Firestore...")
-    try:
-        # .select([]) est une astuce pour ne récupérer que les IDs, ce qui est très rapide et peu coûteux
-        query = collection_ref.order_by('date_obj', direction='DESCENDING').limit(300).select([])
-        docs = query.stream()
-        ids_existants = set(doc.id for doc in docs)
-        print(f"-> {len(ids_existants)} IDs récents chargés pour vérification.")
-    except Exception as e:
-        print(f"❌ Erreur lors de la récupération des IDs existants : {e}")
-        return "Erreur lors de la vérification des données existantes."
-    # --- FIN DE L'OPTIMISATION ---
-    
-    operations_count = 0
-    for tirage in nouveaux_tirages:
-        # On vérifie si l'ID du nouveau tirage est déjà dans notre liste d'IDs récents
-        if tirage["doc_id"] not in ids_existants:
-            doc_ref = collection_ref.document(tirage["doc_id"])
-            batch.set(doc_ref, tirage["data"])
-            nouveaux_ajouts += 1
-            operations_count += 1
-            if operations_count >= 499:
-                print(f"   -> Envoi d'un lot de {operations_count} documents...")
-                batch.commit()
-                batch = db.batch()
-                operations_count = 0
-
-    if operations_count > 0:
-        print(f"   -> Envoi du dernier lot de {operations_count} documents...")
-        batch.commit()
-    
     if nouveaux_ajouts > 0:
+        cache_donnees.invalider("tirages")
+        cache_donnees.invalider("resume")
+    if nouveaux_ajouts < len(a_ecrire):
+        message = f"Mise à jour partielle : {len(a_ecrire) - nouveaux_ajouts} tirage(s) non écrit(s), ils seront repris à la prochaine collecte."
+    elif nouveaux_ajouts > 0:
         message = f"Mise à jour réussie ! {nouveaux_ajouts} tirage(s) ajouté(s) à Firestore."
     else:
         message = "Base de données déjà à jour. Aucun ajout."
         
     print(message)
-    return message
+    return nouveaux_ajouts, message
 
 if __name__ == '__main__':
-    lancer_collecte_vers_firestore()
\ No newline at end of file
+    # Collecte seule : le préchauffage est fait par le serveur web (planificateur de prechauffage.py), dont
+    # le dossier static/ sert les heatmaps référencées par predictions_cache
+    collecter_vers_firestore()
\ No newline at end of file
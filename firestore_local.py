@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+# Ce fichier est une doublure locale (en mémoire) du client Firestore, pour les essais à blanc
+# et les mesures de débit sans toucher à la vraie base ni consommer de quota.
+# Seules les opérations utilisées par le projet sont reproduites : collection / document,
+# get / set / create / update / delete, where / order_by / limit / select / stream, batch / commit,
+# et la précondition `write_option(last_update_time=...)` d'une mise à jour (date de modification du snapshot).
+# Une latence par aller-retour peut être simulée, et les lectures / écritures sont comptées.
+
+import copy
+import time
+import threading
+from datetime import datetime, timezone
+
+# --- CONFIGURATIONS ---
+TAILLE_MAX_LOT = 500  # limite Firestore d'un batch
+
+OPERATEURS = {
+    '==': lambda a, b: a == b, '!=': lambda a, b: a != b,
+    '<': lambda a, b: a < b, '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b, '>=': lambda a, b: a >= b,
+    'in': lambda a, b: a in b, 'array_contains': lambda a, b: isinstance(a, list) and b in a,
+}
+
+def _normaliser(valeur):
+    """Comme Firestore : les dates sans fuseau sont enregistrées (et relues) en UTC."""
+    if isinstance(valeur, datetime) and valeur.tzinfo is None:
+        return valeur.replace(tzinfo=timezone.utc)
+    if isinstance(valeur, dict):
+        return {cle: _normaliser(v) for cle, v in valeur.items()}
+    if isinstance(valeur, list):
+        return [_normaliser(v) for v in valeur]
+    return valeur
+
+class DejaExistant(Exception):
+    """Levée par `create()` si le document existe déjà (équivalent de AlreadyExists)."""
+
+class Introuvable(Exception):
+    """Levée par `update()` si le document n'existe pas (équivalent de NotFound)."""
+
+class PreconditionEchouee(Exception):
+    """Levée par `update()` si le document a changé depuis `last_update_time` (équivalent de FailedPrecondition)."""
+
+class OptionEcriture:
+    def __init__(self, last_update_time=None):
+        self.last_update_time = last_update_time
+
+def verifier_ecriture(reference, action, option, mis_a_jour):
+    """Contrôles d'une opération "update" : document existant et, avec une option, non modifié depuis."""
+    if action != "update": return
+    if mis_a_jour is None:
+        raise Introuvable(f"{reference._collection}/{reference.id} n'existe pas.")
+    if option is not None and option.last_update_time is not None and option.last_update_time != mis_a_jour:
+        raise PreconditionEchouee(f"{reference._collection}/{reference.id} a été modifié entre-temps.")
+
+class InstantaneLocal:
+    def __init__(self, id, donnees, update_time=None):
+        self.id = id
+        self.exists = donnees is not None
+        self._donnees = donnees
+        self.update_time = update_time
+
+    def to_dict(self):
+        return copy.deepcopy(self._donnees) if self.exists else None
+
+    def get(self, champ):
+        return (self._donnees or {}).get(champ)
+
+class DocumentLocal:
+    def __init__(self, client, collection, id):
+        self._client, self._collection, self.id = client, collection, id
+
+    def get(self):
+        self._client._aller_retour(lectures=1)
+        with self._client._verrou:
+            donnees = self._client._documents.get(self._collection, {}).get(self.id)
+            mis_a_jour = self._client._mises_a_jour.get((self._collection, self.id))
+        return InstantaneLocal(self.id, copy.deepcopy(donnees), mis_a_jour)
+
+    def set(self, donnees, merge=False):
+        self._client._aller_retour(ecritures=1)
+        self._client._ecrire([(self, "set", donnees, merge)])
+
+    def create(self, donnees):
+        self._client._aller_retour(ecritures=1)
+        self._client._ecrire([(self, "create", donnees, False)])
+
+    def update(self, donnees, option=None):
+        self._client._aller_retour(ecritures=1)
+        self._client._ecrire([(self, "update", donnees, option)])
+
+    def delete(self):
+        self._client._aller_retour(ecritures=1)
+        self._client._ecrire([(self, "delete", None, False)])
+
+class RequeteLocale:
+    def __init__(self, client, collection, filtres=(), tri=None, limite=None):
+        self._client, self._collection = client, collection
+        self._filtres, self._tri, self._limite = list(filtres), tri, limite
+
+    def _copie(self, **modifs):
+        valeurs = {"filtres": self._filtres, "tri": self._tri, "limite": self._limite}
+        valeurs.update(modifs)
+        return RequeteLocale(self._client, self._collection, **valeurs)
+
+    def where(self, champ, operateur, valeur):
+        return self._copie(filtres=self._filtres + [(champ, OPERATEURS[operateur], _normaliser(valeur))])
+
+    def order_by(self, champ, direction='ASCENDING'):
+        return self._copie(tri=(champ, direction == 'DESCENDING'))
+
+    def limit(self, nombre):
+        return self._copie(limite=nombre)
+
+    def select(self, champs):
+        return self
+
+    def stream(self):
+        with self._client._verrou:
+            documents = list(self._client._documents.get(self._collection, {}).items())
+        resultats = [(i, d) for i, d in documents
+                     if all(champ in d and test(d[champ], valeur) for champ, test, valeur in self._filtres)]
+        if self._tri:
+            champ, decroissant = self._tri
+            resultats = [(i, d) for i, d in resultats if champ in d]
+            resultats.sort(key=lambda r: r[1][champ], reverse=decroissant)
+        if self._limite is not None:
+            resultats = resultats[:self._limite]
+        # Firestore facture au moins une lecture par requête, même vide
+        self._client._aller_retour(lectures=max(1, len(resultats)))
+        return iter([InstantaneLocal(i, copy.deepcopy(d), self._client._mises_a_jour.get((self._collection, i))) for i, d in resultats])
+
+    def get(self):
+        return list(self.stream())
+
+class CollectionLocale(RequeteLocale):
+    def __init__(self, client, nom):
+        super().__init__(client, nom)
+        self.id = nom
+
+    def document(self, id):
+        return DocumentLocal(self._client, self._collection, str(id))
+
+class LotLocal:
+    def __init__(self, client):
+        self._client, self._operations = client, []
+
+    def set(self, reference, donnees, merge=False):
+        self._operations.append((reference, "set", donnees, merge))
+
+    def create(self, reference, donnees):
+        self._operations.append((reference, "create", donnees, False))
+
+    def delete(self, reference):
+        self._operations.append((reference, "delete", None, False))
+
+    def commit(self):
+        if len(self._operations) > TAILLE_MAX_LOT:
+            raise ValueError(f"Un lot ne peut pas dépasser {TAILLE_MAX_LOT} opérations.")
+        self._client._aller_retour(ecritures=len(self._operations))
+        self._client._ecrire(self._operations)
+
+class ClientLocal:
+    """Remplace `firestore.client()`. `latence` : secondes simulées par aller-retour réseau."""
+
+    def __init__(self, latence=0.0):
+        self.latence = latence
+        self.lectures = 0
+        self.ecritures = 0
+        self.allers_retours = 0
+        self._documents = {}
+        self._mises_a_jour = {}  # (collection, id) -> date de modification (ns), comme `update_time`
+        self._verrou = threading.Lock()
+
+    def collection(self, nom):
+        return CollectionLocale(self, nom)
+
+    def batch(self):
+        return LotLocal(self)
+
+    def write_option(self, last_update_time=None):
+        return OptionEcriture(last_update_time)
+
+    def _aller_retour(self, lectures=0, ecritures=0):
+        if self.latence: time.sleep(self.latence)
+        with self._verrou:
+            self.allers_retours += 1
+            self.lectures += lectures
+            self.ecritures += ecritures
+
+    def _ecrire(self, operations):
+        """Applique les opérations de façon atomique (tout ou rien), comme un batch Firestore.
+        Opérations : (reference, action, donnees, merge), ou (reference, "update", donnees, option)."""
+        with self._verrou:
+            for reference, action, _, option in operations:
+                if action == "create" and reference.id in self._documents.get(reference._collection, {}):
+                    raise DejaExistant(f"{reference._collection}/{reference.id} existe déjà.")
+                verifier_ecriture(reference, action, option, self._mises_a_jour.get((reference._collection, reference.id)))
+            maintenant = time.time_ns()
+            for reference, action, donnees, merge in operations:
+                collection = self._documents.setdefault(reference._collection, {})
+                cle = (reference._collection, reference.id)
+                if action == "delete":
+                    collection.pop(reference.id, None); self._mises_a_jour.pop(cle, None)
+                    continue
+                self._mises_a_jour[cle] = max(maintenant, self._mises_a_jour.get(cle, 0) + 1)
+                if action == "update" or (merge and reference.id in collection):
+                    collection[reference.id].update(_normaliser(copy.deepcopy(donnees)))
+                else:
+                    collection[reference.id] = _normaliser(copy.deepcopy(donnees))
+
+    def nombre_documents(self, collection):
+        with self._verrou:
+            return len(self._documents.get(collection, {}))
+
+    def vider(self, collection=None):
+        """Supprime une collection (ou toutes) sans compter d'écriture."""
+        with self._verrou:
+            if collection is None: self._documents.clear(); self._mises_a_jour.clear()
+            else:
+                self._documents.pop(collection, None)
+                self._mises_a_jour = {cle: v for cle, v in self._mises_a_jour.items() if cle[0] != collection}
@@ -0,0 +1,350 @@
+# -*- coding: utf-8 -*-
+# Ce fichier fournit un second backend de stockage : le sous-ensemble de l'API du client Firestore
+# utilisé par le projet (le même que firestore_local), enregistré dans une base SQLite.
+# Toutes les collections (tirages, connaissance, predictions_cache, users, meta...) partagent une table
+# de documents JSON ; les champs `date_obj` et `nom_du_tirage` sont recopiés dans des colonnes indexées,
+# de sorte que les requêtes des tirages (where / order_by / limit sur la date) sont exécutées par SQLite.
+# BACKEND_STOCKAGE=sqlite fait tourner l'application, le collecteur et les benchmarks sans Firestore
+# (connexion des utilisateurs comprise, mot de passe haché dans 'users') ; la base peut aussi servir
+# de réplique en lecture, rattrapée depuis Firestore avec --repliquer.
+# Usage :
+#   python firestore_sqlite.py --charger                     -> CSV + base de connaissance -> SQLite
+#   python firestore_sqlite.py --utilisateur email [--admin] -> crée (ou modifie) un utilisateur local
+#   python firestore_sqlite.py --repliquer                   -> copie les nouveaux tirages depuis Firestore
+
+import os
+import sys
+import json
+import time
+import base64
+import sqlite3
+import threading
+import uuid
+from datetime import datetime, timezone
+
+from firestore_local import DejaExistant, OPERATEURS, OptionEcriture, verifier_ecriture
+
+# --- CONFIGURATIONS ---
+BACKEND_STOCKAGE = os.environ.get("BACKEND_STOCKAGE", "firestore")  # "firestore" ou "sqlite"
+BACKEND_SQLITE = BACKEND_STOCKAGE == "sqlite"
+CHEMIN_SQLITE = os.environ.get("CHEMIN_SQLITE", "loto.sqlite3")
+TAILLE_MAX_LOT = 500  # limite Firestore d'un batch, conservée pour un comportement identique
+CHAMPS_INDEXES = ("date_obj", "nom_du_tirage")
+OPERATEURS_SQL = {'==': '=', '!=': '!=', '<': '<', '<=': '<=', '>': '>', '>=': '>='}
+FORMAT_DATE = "%Y-%m-%dT%H:%M:%S.%f"  # UTC, ordre lexicographique = ordre chronologique
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    collection TEXT NOT NULL,
+    id TEXT NOT NULL,
+    donnees TEXT NOT NULL,
+    date_obj TEXT,
+    nom_du_tirage TEXT,
+    mis_a_jour INTEGER,
+    PRIMARY KEY (collection, id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_documents_date ON documents (collection, date_obj);
+CREATE INDEX IF NOT EXISTS idx_documents_nom ON documents (collection, nom_du_tirage, date_obj);
+"""
+
+_client = None
+_verrou_client = threading.Lock()
+
+# --- ENCODAGE DES DOCUMENTS ---
+def _date_utc(valeur):
+    """Comme Firestore : les dates sans fuseau sont enregistrées (et relues) en UTC."""
+    return valeur.replace(tzinfo=timezone.utc) if valeur.tzinfo is None else valeur.astimezone(timezone.utc)
+
+def _encoder(valeur):
+    if isinstance(valeur, datetime): return {"$date": _date_utc(valeur).strftime(FORMAT_DATE)}
+    if isinstance(valeur, (bytes, bytearray)): return {"$octets": base64.b64encode(valeur).decode("ascii")}
+    if isinstance(valeur, dict): return {str(cle): _encoder(v) for cle, v in valeur.items()}
+    if isinstance(valeur, (list, tuple)): return [_encoder(v) for v in valeur]
+    return valeur
+
+def _decoder(valeur):
+    if isinstance(valeur, dict):
+        if len(valeur) == 1 and "$date" in valeur:
+            return datetime.strptime(valeur["$date"], FORMAT_DATE).replace(tzinfo=timezone.utc)
+        if len(valeur) == 1 and "$octets" in valeur: return base64.b64decode(valeur["$octets"])
+        return {cle: _decoder(v) for cle, v in valeur.items()}
+    if isinstance(valeur, list): return [_decoder(v) for v in valeur]
+    return valeur
+
+def _valeur_index(valeur):
+    """Valeur d'une colonne indexée (dates en texte UTC triable)."""
+    if isinstance(valeur, datetime): return _date_utc(valeur).strftime(FORMAT_DATE)
+    return valeur if isinstance(valeur, (str, int, float)) or valeur is None else json.dumps(_encoder(valeur))
+
+def _ligne(collection, id, donnees, mis_a_jour):
+    return (collection, id, json.dumps(_encoder(donnees), ensure_ascii=False),
+            *(_valeur_index(donnees.get(champ)) for champ in CHAMPS_INDEXES), mis_a_jour)
+
+def _normaliser(valeur):
+    if isinstance(valeur, datetime): return _date_utc(valeur)
+    if isinstance(valeur, list): return [_normaliser(v) for v in valeur]
+    return valeur
+
+# --- API FIRESTORE ---
+class InstantaneSQLite:
+    def __init__(self, id, donnees, update_time=None):
+        self.id = id
+        self.exists = donnees is not None
+        self._donnees = donnees
+        self.update_time = update_time
+
+    def to_dict(self):
+        return self._donnees
+
+    def get(self, champ):
+        return (self._donnees or {}).get(champ)
+
+class DocumentSQLite:
+    def __init__(self, client, collection, id):
+        self._client, self._collection, self.id = client, collection, id
+
+    def get(self):
+        ligne = self._client._connexion().execute(
+            "SELECT donnees, mis_a_jour FROM documents WHERE collection = ? AND id = ?", (self._collection, self.id)).fetchone()
+        return InstantaneSQLite(self.id, _decoder(json.loads(ligne[0])), ligne[1] or 0) if ligne else InstantaneSQLite(self.id, None)
+
+    def set(self, donnees, merge=False):
+        self._client._ecrire([(self, "set", donnees, merge)])
+
+    def create(self, donnees):
+        self._client._ecrire([(self, "create", donnees, False)])
+
+    def update(self, donnees, option=None):
+        self._client._ecrire([(self, "update", donnees, option)])
+
+    def delete(self):
+        self._client._ecrire([(self, "delete", None, False)])
+
+class RequeteSQLite:
+    def __init__(self, client, collection, filtres=(), tri=None, limite=None):
+        self._client, self._collection = client, collection
+        self._filtres, self._tri, self._limite = list(filtres), tri, limite
+
+    def _copie(self, **modifs):
+        valeurs = {"filtres": self._filtres, "tri": self._tri, "limite": self._limite}
+        valeurs.update(modifs)
+        return RequeteSQLite(self._client, self._collection, **valeurs)
+
+    def where(self, champ, operateur, valeur):
+        return self._copie(filtres=self._filtres + [(champ, operateur, _normaliser(valeur))])
+
+    def order_by(self, champ, direction='ASCENDING'):
+        return self._copie(tri=(champ, direction == 'DESCENDING'))
+
+    def limit(self, nombre):
+        return self._copie(limite=nombre)
+
+    def select(self, champs):
+        return self
+
+    def stream(self):
+        # Filtres et tri sur les colonnes indexées : exécutés par SQLite ; les autres en Python (comme firestore_local)
+        sql, parametres, restants = ["collection = ?"], [self._collection], []
+        for champ, operateur, valeur in self._filtres:
+            if champ in CHAMPS_INDEXES and operateur in OPERATEURS_SQL:
+                sql.append(f"{champ} {OPERATEURS_SQL[operateur]} ?"); parametres.append(_valeur_index(valeur))
+            elif champ in CHAMPS_INDEXES and operateur == 'in':
+                sql.append(f"{champ} IN ({', '.join('?' * len(valeur))})"); parametres += [_valeur_index(v) for v in valeur]
+            else:
+                restants.append((champ, OPERATEURS[operateur], valeur))
+        tri_sql = self._tri and self._tri[0] in CHAMPS_INDEXES
+        requete = "SELECT id, donnees, mis_a_jour FROM documents WHERE " + " AND ".join(sql)
+        if tri_sql:
+            requete += f" AND {self._tri[0]} IS NOT NULL ORDER BY {self._tri[0]} {'DESC' if self._tri[1] else 'ASC'}, id"
+        else:
+            requete += " ORDER BY id"  # ordre par défaut de Firestore : identifiant du document
+        if self._limite is not None and not restants and (tri_sql or not self._tri):
+            requete += f" LIMIT {int(self._limite)}"
+        lignes = self._client._connexion().execute(requete, parametres).fetchall()
+        mises_a_jour = {i: m or 0 for i, _, m in lignes}
+        resultats = [(i, _decoder(json.loads(d))) for i, d, _ in lignes]
+        resultats = [(i, d) for i, d in resultats if all(champ in d and test(d[champ], valeur) for champ, test, valeur in restants)]
+        if self._tri and not tri_sql:
+            champ, decroissant = self._tri
+            resultats = [(i, d) for i, d in resultats if champ in d]
+            resultats.sort(key=lambda r: r[1][champ], reverse=decroissant)
+        if self._limite is not None:
+            resultats = resultats[:self._limite]
+        return iter([InstantaneSQLite(i, d, mises_a_jour[i]) for i, d in resultats])
+
+    def get(self):
+        return list(self.stream())
+
+class CollectionSQLite(RequeteSQLite):
+    def __init__(self, client, nom):
+        super().__init__(client, nom)
+        self.id = nom
+
+    def document(self, id=None):
+        return DocumentSQLite(self._client, self._collection, str(id) if id is not None else uuid.uuid4().hex)
+
+class LotSQLite:
+    def __init__(self, client):
+        self._client, self._operations = client, []
+
+    def set(self, reference, donnees, merge=False):
+        self._operations.append((reference, "set", donnees, merge))
+
+    def create(self, reference, donnees):
+        self._operations.append((reference, "create", donnees, False))
+
+    def delete(self, reference):
+        self._operations.append((reference, "delete", None, False))
+
+    def commit(self):
+        if len(self._operations) > TAILLE_MAX_LOT:
+            raise ValueError(f"Un lot ne peut pas dépasser {TAILLE_MAX_LOT} opérations.")
+        self._client._ecrire(self._operations)
+
+class ClientSQLite:
+    """Remplace `firestore.client()` : une connexion SQLite par thread (mode WAL, lectures concurrentes)."""
+
+    def __init__(self, chemin=CHEMIN_SQLITE):
+        self.chemin = chemin
+        self._local = threading.local()
+        self._connexion().executescript(SCHEMA)
+        colonnes = [ligne[1] for ligne in self._connexion().execute("PRAGMA table_info(documents)")]
+        if "mis_a_jour" not in colonnes:  # base créée avant la colonne des dates de modification
+            self._connexion().execute("ALTER TABLE documents ADD COLUMN mis_a_jour INTEGER")
+
+    def _connexion(self):
+        connexion = getattr(self._local, "connexion", None)
+        if connexion is None:
+            connexion = sqlite3.connect(self.chemin, timeout=30, isolation_level=None)
+            connexion.execute("PRAGMA journal_mode=WAL")
+            connexion.execute("PRAGMA synchronous=NORMAL")
+            self._local.connexion = connexion
+        return connexion
+
+    def collection(self, nom):
+        return CollectionSQLite(self, nom)
+
+    def batch(self):
+        return LotSQLite(self)
+
+    def write_option(self, last_update_time=None):
+        return OptionEcriture(last_update_time)
+
+    def _ecrire(self, operations):
+        """Applique les opérations dans une transaction (tout ou rien), comme un batch Firestore.
+        Opérations : (reference, action, donnees, merge), ou (reference, "update", donnees, option)."""
+        connexion = self._connexion()
+        connexion.execute("BEGIN IMMEDIATE")
+        try:
+            maintenant = time.time_ns()
+            for reference, action, donnees, merge in operations:
+                cle = (reference._collection, reference.id)
+                if action == "delete":
+                    connexion.execute("DELETE FROM documents WHERE collection = ? AND id = ?", cle); continue
+                ligne = connexion.execute("SELECT donnees, mis_a_jour FROM documents WHERE collection = ? AND id = ?", cle).fetchone()
+                if action == "create" and ligne:
+                    raise DejaExistant(f"{reference._collection}/{reference.id} existe déjà.")
+                # Base antérieure à la colonne : un document existant sans date de modification vaut 0
+                verifier_ecriture(reference, action, merge, (ligne[1] or 0) if ligne else None)
+                if ligne and (merge is True or action == "update"):
+                    donnees = dict(_decoder(json.loads(ligne[0])), **donnees)
+                mis_a_jour = max(maintenant, (ligne[1] or 0) + 1) if ligne else maintenant
+                connexion.execute("INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?)", _ligne(*cle, donnees, mis_a_jour))
+            connexion.execute("COMMIT")
+        except BaseException:
+            connexion.execute("ROLLBACK")
+            raise
+
+    def charger_documents(self, collection, documents):
+        """Chargement en masse [(id, donnees)] en une transaction (sans la limite des batchs)."""
+        connexion = self._connexion()
+        connexion.execute("BEGIN IMMEDIATE")
+        try:
+            maintenant = time.time_ns()
+            connexion.executemany("INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?)",
+                                  (_ligne(collection, str(i), d, maintenant) for i, d in documents))
+            connexion.execute("COMMIT")
+        except BaseException:
+            connexion.execute("ROLLBACK")
+            raise
+        return len(documents)
+
+    def nombre_documents(self, collection):
+        return self._connexion().execute("SELECT COUNT(*) FROM documents WHERE collection = ?", (collection,)).fetchone()[0]
+
+    def vider(self, collection=None):
+        if collection is None: self._connexion().execute("DELETE FROM documents")
+        else: self._connexion().execute("DELETE FROM documents WHERE collection = ?", (collection,))
+
+def client_sqlite():
+    """Client partagé par le processus (BACKEND_STOCKAGE=sqlite)."""
+    global _client
+    with _verrou_client:
+        if _client is None:
+            _client = ClientSQLite()
+            print(f"✅ Stockage SQLite ouvert : {os.path.abspath(_client.chemin)}")
+        return _client
+
+# --- CHARGEMENT, UTILISATEURS, RÉPLIQUE ---
+def charger_fichiers(client, chemin_csv=None, chemin_connaissance=None):
+    """Charge le CSV historique et la base de connaissance, puis reconstruit le résumé d'analyse."""
+    import migrate_to_firestore
+    debut = time.perf_counter()
+    documents = migrate_to_firestore.preparer_tirages(chemin_csv or migrate_to_firestore.NOM_FICHIER_DONNEES_CSV)
+    client.charger_documents('tirages', documents)
+    connaissance = migrate_to_firestore.preparer_base_connaissance(chemin_connaissance or migrate_to_firestore.NOM_FICHIER_BASE_CONNAISSANCE)
+    client.charger_documents('connaissance', [(n, {"accompagnateurs": a}) for n, a in connaissance.items()])
+    print(f"✅ {len(documents)} tirages et {len(connaissance)} règles chargés dans SQLite en {time.perf_counter() - debut:.1f} s.")
+    try:
+        import resume_firestore
+        resume_firestore.reconstruire(client)
+    except ImportError:
+        print("-> NumPy absent : le résumé d'analyse sera construit par le collecteur.")
+    return len(documents)
+
+def enregistrer_utilisateur(client, email, mot_de_passe, admin=False):
+    """Crée ou modifie un utilisateur local ('users' : email, rôle, mot de passe haché). Retourne son uid."""
+    from werkzeug.security import generate_password_hash
+    existants = client.collection('users').where('email', '==', email).limit(1).get()
+    reference = client.collection('users').document(existants[0].id if existants else None)
+    reference.set({"email": email, "role": "admin" if admin else "user", "mot_de_passe": generate_password_hash(mot_de_passe)}, merge=True)
+    return reference.id
+
+def authentifier(client, email, mot_de_passe):
+    """Connexion locale (sans Firebase Auth) : (uid, email, est_admin), ou None si les identifiants sont faux."""
+    from werkzeug.security import check_password_hash
+    for doc in client.collection('users').where('email', '==', email).limit(1).stream():
+        donnees = doc.to_dict()
+        if donnees.get("mot_de_passe") and check_password_hash(donnees["mot_de_passe"], mot_de_passe):
+            return doc.id, donnees["email"], donnees.get("role") == "admin"
+    return None
+
+def repliquer(source, client, collections=('connaissance', 'meta')):
+    """Rattrape la réplique : tirages postérieurs au dernier présent (une requête), puis `collections` en entier."""
+    dernier = next(iter(client.collection('tirages').order_by('date_obj', direction='DESCENDING').limit(1).stream()), None)
+    requete = source.collection('tirages')
+    if dernier: requete = requete.where('date_obj', '>=', dernier.to_dict()['date_obj'])
+    tirages = [(doc.id, doc.to_dict()) for doc in requete.stream()]
+    client.charger_documents('tirages', tirages)
+    for collection in collections:
+        client.charger_documents(collection, [(doc.id, doc.to_dict()) for doc in source.collection(collection).stream()])
+    print(f"✅ Réplique SQLite à jour : {len(tirages)} tirage(s) copié(s).")
+    return len(tirages)
+
+if __name__ == "__main__":
+    arguments = sys.argv[1:]
+    client = ClientSQLite()
+    if "--charger" in arguments:
+        charger_fichiers(client)
+    elif "--utilisateur" in arguments:
+        import getpass
+        email = arguments[arguments.index("--utilisateur") + 1]
+        uid = enregistrer_utilisateur(client, email, getpass.getpass(f"Mot de passe pour {email} : "), admin="--admin" in arguments)
+        print(f"✅ Utilisateur {email} enregistré (uid {uid}).")
+    elif "--repliquer" in arguments:
+        from migrate_to_firestore import connecter_firestore  # la source reste Firestore, quel que soit BACKEND_STOCKAGE
+        source = connecter_firestore()
+        if source is None: sys.exit(1)
+        repliquer(source, client)
+    else:
+        print("Options : --charger | --utilisateur email [--admin] | --repliquer")
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+# Configuration gunicorn (lue automatiquement depuis le dossier de lancement).
+# PRECHARGER_DEPENDANCES=1 : l'application et les bibliothèques lourdes (pandas, matplotlib, seaborn,
+# Gemini, Firestore) sont importées une seule fois dans le maître, puis partagées par les workers
+# (fork). Firebase n'est jamais initialisé dans le maître : chaque worker se connecte à sa
+# première requête.
+# Les pages d'analyse en flux (SSE) gardent une connexion ouverte pendant la réponse de Gemini :
+# plusieurs threads par worker (gthread) évitent qu'un flux bloque tout le worker.
+
+import os
+
+PRECHARGER_DEPENDANCES = os.environ.get("PRECHARGER_DEPENDANCES", "0") == "1"
+
+preload_app = PRECHARGER_DEPENDANCES
+threads = int(os.environ.get("GUNICORN_THREADS", "8"))
+
+def on_starting(server):
+    # Métriques : les fichiers par processus d'une exécution précédente ne sont plus additionnés
+    import metriques
+    metriques.vider_dossier()
+    if PRECHARGER_DEPENDANCES:
+        from analyse_loto import precharger_dependances
+        precharger_dependances()
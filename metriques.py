@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+# Ce fichier mesure le pipeline : durée de chaque étape (histogrammes), documents Firestore lus / écrits,
+# consultations du cache des prédictions (succès / échec), latence et erreurs de Gemini.
+# Les métriques sont exposées au format texte Prometheus (route /metrics de app.py) et chaque requête
+# ou tâche de fond écrit une ligne JSON avec le détail de ses étapes (journal de temps).
+# Plusieurs processus (workers gunicorn, cron) : chacun écrit ses compteurs et histogrammes dans son propre
+# fichier de DOSSIER_METRIQUES (toutes les INTERVALLE_ECRITURE secondes), et /metrics additionne tous les
+# fichiers, quel que soit le worker qui répond. Le fichier d'un processus terminé (worker remplacé, cron) est
+# ajouté au fichier des processus terminés : les totaux ne diminuent jamais, sauf au démarrage de gunicorn
+# qui vide le dossier (gunicorn.conf.py). Le taux de succès du cache se calcule côté Prometheus :
+#   sum(rate(loto_predictions_cache_total{resultat="succes"}[5m])) / sum(rate(loto_predictions_cache_total[5m]))
+
+import os
+import json
+import time
+import tempfile
+import atexit
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows : les fichiers des processus terminés ne sont pas regroupés
+    fcntl = None
+
+# --- CONFIGURATIONS ---
+PREFIXE = "loto_"
+JOURNAL_ACTIF = os.environ.get("JOURNAL_TEMPS", "1") == "1"
+# Bornes (secondes) des histogrammes : de l'accès mémoire à l'appel Gemini (timeout 100 s)
+BORNES_DUREE = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+DOSSIER_METRIQUES = os.environ.get("METRIQUES_DOSSIER", os.path.join(tempfile.gettempdir(), "loto_metriques"))
+INTERVALLE_ECRITURE = 5  # secondes entre deux écritures du fichier d'un processus
+FICHIER_TERMINES = "termines.json"
+
+DESCRIPTIONS = {
+    "etape_duree_secondes": ("histogram", "Durée de chaque étape de l'analyse et de la collecte."),
+    "requete_duree_secondes": ("histogram", "Durée des requêtes HTTP par route."),
+    "firestore_documents_total": ("counter", "Documents Firestore lus ou écrits, par collection."),
+    "predictions_cache_total": ("counter", "Consultations du cache des prédictions (succes / echec)."),
+    "reponses_ia_cache_total": ("counter", "Consultations du cache des réponses de Gemini, par niveau (memoire / firestore / absent)."),
+    "gemini_duree_secondes": ("histogram", "Latence des appels à Gemini."),
+    "gemini_premier_fragment_secondes": ("histogram", "Délai avant le premier fragment d'une réponse de Gemini en flux."),
+    "gemini_erreurs_total": ("counter", "Appels à Gemini en erreur, par type."),
+}
+
+_verrou = threading.Lock()
+_compteurs = {}     # (nom, étiquettes) -> valeur
+_histogrammes = {}  # (nom, étiquettes) -> [compte par borne..., +Inf, somme]
+_local = threading.local()
+_processus = None  # (pid, nom du fichier) du processus courant, renouvelé après un fork
+_modifie = False
+
+def _cle(nom, etiquettes):
+    return nom, tuple(sorted(etiquettes.items()))
+
+def _suivre_processus():
+    """Appelé sous _verrou avant toute modification. Après un fork (workers gunicorn), les valeurs héritées
+    du maître restent dans son fichier : le worker repart de zéro avec son propre fichier et son écrivain."""
+    global _processus, _modifie
+    if _processus and _processus[0] == os.getpid(): return
+    _compteurs.clear(); _histogrammes.clear()
+    _processus = (os.getpid(), f"{os.getpid()}_{time.time_ns()}.json")  # pid réutilisable : fichier unique
+    _modifie = False
+    threading.Thread(target=_boucle_ecriture, name="metriques", daemon=True).start()
+
+def incrementer(nom, valeur=1, **etiquettes):
+    global _modifie
+    with _verrou:
+        _suivre_processus()
+        cle = _cle(nom, etiquettes)
+        _compteurs[cle] = _compteurs.get(cle, 0) + valeur
+        _modifie = True
+
+def observer(nom, valeur, **etiquettes):
+    global _modifie
+    with _verrou:
+        _suivre_processus()
+        _modifie = True
+        cle = _cle(nom, etiquettes)
+        histogramme = _histogrammes.setdefault(cle, [0] * (len(BORNES_DUREE) + 2))
+        for i, borne in enumerate(BORNES_DUREE):
+            if valeur <= borne: histogramme[i] += 1
+        histogramme[-2] += 1
+        histogramme[-1] += valeur
+
+# --- RACCOURCIS UTILISÉS PAR LE PIPELINE ---
+def compter_lectures(collection, nombre=1):
+    incrementer("firestore_documents_total", nombre, operation="lecture", collection=collection)
+    _noter_journal("firestore_lectures", nombre)
+
+def compter_ecritures(collection, nombre=1):
+    incrementer("firestore_documents_total", nombre, operation="ecriture", collection=collection)
+    _noter_journal("firestore_ecritures", nombre)
+
+def compter_cache_predictions(trouve):
+    incrementer("predictions_cache_total", resultat="succes" if trouve else "echec")
+    _noter_journal("predictions_cache", "succes" if trouve else "echec")
+
+def compter_cache_ia(niveau):
+    incrementer("reponses_ia_cache_total", niveau=niveau)
+    _noter_journal("reponses_ia_cache", niveau)
+
+def compter_erreur_gemini(type_erreur):
+    incrementer("gemini_erreurs_total", type=type_erreur)
+
+@contextmanager
+def mesurer(etape, histogramme=None):
+    """Chronomètre un bloc : histogramme des étapes (et `histogramme` si fourni) et, si un journal
+    est ouvert dans ce thread, détail par étape."""
+    debut = time.perf_counter()
+    try:
+        yield
+    finally:
+        duree = time.perf_counter() - debut
+        observer("etape_duree_secondes", duree, etape=etape)
+        if histogramme: observer(histogramme, duree)
+        _noter_journal("etapes_ms", (etape, duree * 1000))
+
+# --- JOURNAL DE TEMPS (une ligne JSON par requête ou tâche) ---
+def ouvrir_journal(evenement, **champs):
+    _local.journal = {"evenement": evenement, **champs, "etapes_ms": {}, "debut": time.perf_counter()}
+
+def _noter_journal(champ, valeur):
+    journal = getattr(_local, "journal", None)
+    if journal is None: return
+    if champ == "etapes_ms":
+        etape, ms = valeur
+        journal["etapes_ms"][etape] = round(journal["etapes_ms"].get(etape, 0) + ms, 1)
+    elif isinstance(valeur, (int, float)):
+        journal[champ] = journal.get(champ, 0) + valeur
+    else:
+        journal[champ] = valeur
+
+def fermer_journal(**champs):
+    """Écrit la ligne JSON du journal ouvert dans ce thread et retourne sa durée totale (secondes)."""
+    journal = getattr(_local, "journal", None)
+    _local.journal = None
+    if journal is None: return None
+    duree = time.perf_counter() - journal.pop("debut")
+    journal.update(champs, duree_ms=round(duree * 1000, 1))
+    if JOURNAL_ACTIF: print(json.dumps(journal, ensure_ascii=False, default=str), flush=True)
+    return duree
+
+@contextmanager
+def journal(evenement, **champs):
+    """Journal de temps d'une tâche de fond (analyse, collecte) ; ne remplace pas un journal déjà ouvert."""
+    if getattr(_local, "journal", None) is not None:
+        yield; return
+    ouvrir_journal(evenement, **champs)
+    try:
+        yield
+    finally:
+        fermer_journal()
+
+# --- FICHIERS PAR PROCESSUS ---
+def _serialiser(compteurs, histogrammes):
+    return {"compteurs": [[nom, etiquettes, valeur] for (nom, etiquettes), valeur in compteurs.items()],
+            "histogrammes": [[nom, etiquettes, valeurs] for (nom, etiquettes), valeurs in histogrammes.items()]}
+
+def _ajouter(total, donnees):
+    """Ajoute les valeurs sérialisées `donnees` à total = (compteurs, histogrammes)."""
+    compteurs, histogrammes = total
+    for nom, etiquettes, valeur in donnees.get("compteurs", []):
+        cle = (nom, tuple(map(tuple, etiquettes)))
+        compteurs[cle] = compteurs.get(cle, 0) + valeur
+    for nom, etiquettes, valeurs in donnees.get("histogrammes", []):
+        cle = (nom, tuple(map(tuple, etiquettes)))
+        cumul = histogrammes.setdefault(cle, [0] * len(valeurs))
+        for i, v in enumerate(valeurs): cumul[i] += v
+
+def _lire(nom_fichier):
+    try:
+        with open(os.path.join(DOSSIER_METRIQUES, nom_fichier), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _ecrire(nom_fichier, donnees):
+    chemin = os.path.join(DOSSIER_METRIQUES, nom_fichier)
+    temporaire = f"{chemin}.{os.getpid()}.tmp"
+    with open(temporaire, "w", encoding="utf-8") as f:
+        json.dump(donnees, f)
+    os.replace(temporaire, chemin)
+
+def ecrire_fichier_processus():
+    """Écrit les valeurs de ce processus dans son fichier (s'il a changé)."""
+    global _modifie
+    with _verrou:
+        if not _processus or _processus[0] != os.getpid() or not _modifie: return
+        donnees, nom_fichier, _modifie = _serialiser(_compteurs, _histogrammes), _processus[1], False
+    try:
+        os.makedirs(DOSSIER_METRIQUES, exist_ok=True)
+        _ecrire(nom_fichier, donnees)
+    except OSError as e:
+        print(f"❌ Impossible d'écrire les métriques du processus : {e}")
+
+atexit.register(ecrire_fichier_processus)
+
+def _boucle_ecriture():
+    pid = os.getpid()
+    while _processus and _processus[0] == pid:
+        time.sleep(INTERVALLE_ECRITURE)
+        ecrire_fichier_processus()
+
+def _processus_termine(nom_fichier):
+    try:
+        os.kill(int(nom_fichier.split("_")[0]), 0)
+    except ProcessLookupError:
+        return True
+    except (ValueError, OSError):
+        pass  # nom inattendu, ou processus d'un autre utilisateur (toujours vivant)
+    return False
+
+def _absorber_processus_termines():
+    """Ajoute les fichiers des processus terminés (workers remplacés, cron) au fichier des terminés puis
+    les supprime : le dossier ne grossit pas et leurs valeurs restent comptées."""
+    if not fcntl: return
+    with open(os.path.join(DOSSIER_METRIQUES, "verrou"), "w") as verrou:
+        fcntl.flock(verrou, fcntl.LOCK_EX)
+        existants = [f for f in os.listdir(DOSSIER_METRIQUES) if f.endswith(".json") and f != FICHIER_TERMINES]
+        fichiers = [f for f in existants if _processus_termine(f)]
+        if not fichiers: return
+        termines = _lire(FICHIER_TERMINES) or {"fichiers": []}
+        total = ({}, {})
+        _ajouter(total, termines)
+        # Les noms absorbés restent listés tant que leur fichier existe (un lecteur peut l'avoir déjà lu)
+        absorbes = [f for f in termines["fichiers"] if f in existants]
+        for f in fichiers:
+            donnees = _lire(f)
+            if donnees and f not in termines["fichiers"]: _ajouter(total, donnees)
+            if f not in absorbes: absorbes.append(f)
+        _ecrire(FICHIER_TERMINES, dict(_serialiser(*total), fichiers=absorbes))
+        for f in fichiers:
+            try: os.remove(os.path.join(DOSSIER_METRIQUES, f))
+            except OSError: pass
+
+def vider_dossier():
+    """Repart de zéro (démarrage de gunicorn) : supprime les fichiers des processus précédents."""
+    os.makedirs(DOSSIER_METRIQUES, exist_ok=True)
+    for f in os.listdir(DOSSIER_METRIQUES):
+        try: os.remove(os.path.join(DOSSIER_METRIQUES, f))
+        except OSError: pass
+
+def _valeurs_tous_processus():
+    """(compteurs, histogrammes) additionnés sur tous les processus, terminés compris."""
+    ecrire_fichier_processus()
+    total = ({}, {})
+    try:
+        _absorber_processus_termines()
+        fichiers = [f for f in os.listdir(DOSSIER_METRIQUES) if f.endswith(".json") and f != FICHIER_TERMINES]
+    except OSError:
+        fichiers = []
+    # Fichiers des processus lus avant celui des terminés : un fichier absorbé entre-temps est ignoré
+    par_fichier = {f: _lire(f) for f in fichiers}
+    termines = _lire(FICHIER_TERMINES) or {"fichiers": []}
+    _ajouter(total, termines)
+    for f, donnees in par_fichier.items():
+        if donnees and f not in termines["fichiers"]: _ajouter(total, donnees)
+    # Valeurs de ce processus pas encore écrites (dossier inaccessible) : on garde au moins les siennes
+    with _verrou:
+        if _processus and _processus[1] not in par_fichier:
+            _ajouter(total, _serialiser(_compteurs, _histogrammes))
+    return total
+
+# --- EXPOSITION PROMETHEUS ---
+def _format_etiquettes(etiquettes):
+    if not etiquettes: return ""
+    echapper = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{echapper(v)}"' for k, v in etiquettes) + "}"
+
+def exposition():
+    """Métriques de tous les processus (voir DOSSIER_METRIQUES) au format texte Prometheus (version 0.0.4)."""
+    compteurs, histogrammes = _valeurs_tous_processus()
+    lignes = []
+    for nom, (type_metrique, aide) in DESCRIPTIONS.items():
+        lignes.append(f"# HELP {PREFIXE}{nom} {aide}")
+        lignes.append(f"# TYPE {PREFIXE}{nom} {type_metrique}")
+        for (nom_cle, etiquettes), valeur in sorted(compteurs.items()):
+            if nom_cle == nom: lignes.append(f"{PREFIXE}{nom}{_format_etiquettes(etiquettes)} {valeur}")
+        for (nom_cle, etiquettes), histogramme in sorted(histogrammes.items()):
+            if nom_cle != nom: continue
+            for borne, compte in zip(BORNES_DUREE, histogramme):
+                lignes.append(f"{PREFIXE}{nom}_bucket{_format_etiquettes(etiquettes + (('le', str(borne)),))} {compte}")
+            lignes.append(f"{PREFIXE}{nom}_bucket{_format_etiquettes(etiquettes + (('le', '+Inf'),))} {histogramme[-2]}")
+            lignes.append(f"{PREFIXE}{nom}_sum{_format_etiquettes(etiquettes)} {histogramme[-1]}")
+            lignes.append(f"{PREFIXE}{nom}_count{_format_etiquettes(etiquettes)} {histogramme[-2]}")
+    return "\n".join(lignes) + "\n"
+
+def reinitialiser():
+    with _verrou:
+        _compteurs.clear(); _histogrammes.clear()
@@ -1,91 +1,223 @@
-import firebase_admin
-from firebase_admin import credentials, firestore
-import csv
-import pandas as pd
 import os
+import sys
+import json
+import time
+import random
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import pandas as pd
+import cache_donnees
 
 # --- CONFIGURATION ---
 NOM_FICHIER_DONNEES_CSV = "resultats_loto_bonheur_COMPLET.csv"
 NOM_FICHIER_BASE_CONNAISSANCE = "base de numero et cest accompagne.txt"
 NOM_CLE_SERVICE = "serviceAccountKey.json"
+# Fichier de reprise : lots déjà écrits, pour reprendre une migration interrompue là où elle s'est arrêtée
+NOM_FICHIER_REPRISE = "migration_reprise.json"
+TAILLE_LOT = 499
+NOMBRE_ECRIVAINS = int(os.environ.get("MIGRATION_ECRIVAINS", "8"))
+NOMBRE_ESSAIS_LOT = 5
+DELAI_NOUVEL_ESSAI_LOT = 1.0  # secondes, doublé à chaque essai
+LATENCE_BENCHMARK = 0.05  # aller-retour simulé par la doublure locale de Firestore (secondes)
 
 # --- FONCTIONS UTILITAIRES ---
 def nettoyer_numeros_str(numeros_str):
     if not isinstance(numeros_str, str): return []
     return [int(n.strip()) for n in numeros_str.split(',') if n.strip().isdigit()]
 
-# --- INITIALISATION DE FIREBASE ---
-try:
-    cred = credentials.Certificate(NOM_CLE_SERVICE)
-    if not firebase_admin._apps:
-        firebase_admin.initialize_app(cred)
-    db = firestore.client()
-    print("✅ Connexion à Firebase réussie.")
-except Exception as e:
-    print(f"❌ ERREUR : Impossible de se connecter à Firebase. Vérifiez le fichier '{NOM_CLE_SERVICE}'. Erreur : {e}")
-    exit()
-
-def migrer_tirages():
-    """Lit le fichier CSV et envoie chaque tirage vers Firestore par lots."""
-    print(f"\n--- Démarrage de la migration des tirages ---")
-    collection_ref = db.collection('tirages')
-    batch = db.batch()
-    compteur_total = 0
-    compteur_lot = 0
+# --- INITIALISATION DE FIREBASE (à l'appel, plus à l'import) ---
+def connecter_firestore():
+    """Retourne un client Firestore, ou None si la connexion est impossible."""
+    import firebase_admin
+    from firebase_admin import credentials, firestore
     try:
-        with open(NOM_FICHIER_DONNEES_CSV, mode='r', encoding='utf-8-sig') as f:
-            for row in csv.DictReader(f):
+        cred = credentials.Certificate(NOM_CLE_SERVICE)
+        if not firebase_admin._apps:
+            firebase_admin.initialize_app(cred)
+        db = firestore.client()
+        print("✅ Connexion à Firebase réussie.")
+        return db
+    except Exception as e:
+        print(f"❌ ERREUR : Impossible de se connecter à Firebase. Vérifiez le fichier '{NOM_CLE_SERVICE}'. Erreur : {e}")
+        return None
+
+def connecter_stockage():
+    """Client du backend configuré : Firestore, ou la base SQLite locale si BACKEND_STOCKAGE=sqlite."""
+    import firestore_sqlite
+    if firestore_sqlite.BACKEND_SQLITE: return firestore_sqlite.client_sqlite()
+    return connecter_firestore()
+
+# --- PRÉPARATION DES DOCUMENTS ---
+def preparer_tirages(chemin=NOM_FICHIER_DONNEES_CSV):
+    """Lit le CSV et retourne la liste des documents [(doc_id, doc_data)], dans l'ordre du fichier.
+    Les dates sont interprétées en une seule passe vectorisée ; les lignes invalides sont ignorées."""
+    df = pd.read_csv(chemin, encoding='utf-8-sig', dtype=str, keep_default_na=False)
+    dates = pd.to_datetime(df['date_complete'], format='mixed', dayfirst=True, errors='coerce')
+    valides = dates.notna() & (df['nom_du_tirage'] != '')
+    df, dates = df[valides], dates[valides]
+    doc_ids = dates.dt.strftime('%Y%m%d%H%M') + "_" + df['nom_du_tirage'].str.replace(' ', '', regex=False)
+    documents = []
+    for doc_id, date_obj, nom, gagnants, machine in zip(doc_ids, dates.dt.to_pydatetime(), df['nom_du_tirage'],
+                                                         df['numeros_gagnants'], df['numeros_machine']):
+        documents.append((doc_id, {
+            'date_obj': date_obj,
+            'nom_du_tirage': nom,
+            'gagnants': nettoyer_numeros_str(gagnants),
+            'machine': nettoyer_numeros_str(machine)
+        }))
+    return documents
+
+def preparer_base_connaissance(chemin=NOM_FICHIER_BASE_CONNAISSANCE):
+    """Lit le fichier de connaissance et retourne {numero: [accompagnateurs]}."""
+    connaissance = {}
+    with open(chemin, mode='r', encoding='utf-8') as f:
+        for ligne in f:
+            if "numero:" in ligne and "accompagnateur:" in ligne:
                 try:
-                    date_obj = pd.to_datetime(row['date_complete'], format='mixed', dayfirst=True).to_pydatetime()
-                    doc_id = date_obj.strftime('%Y%m%d%H%M') + "_" + row['nom_du_tirage'].replace(' ', '')
-                    doc_data = {
-                        'date_obj': date_obj,
-                        'nom_du_tirage': row['nom_du_tirage'],
-                        'gagnants': nettoyer_numeros_str(row.get('numeros_gagnants')),
-                        'machine': nettoyer_numeros_str(row.get('numeros_machine'))
-                    }
-                    doc_ref = collection_ref.document(doc_id)
-                    batch.set(doc_ref, doc_data)
-                    compteur_total += 1
-                    compteur_lot += 1
-                    if compteur_lot >= 499:
-                        print(f"   -> Envoi d'un lot de {compteur_lot} documents...")
-                        batch.commit()
-                        batch = db.batch()
-                        compteur_lot = 0
-                except (ValueError, TypeError): continue
-        if compteur_lot > 0:
-            print(f"   -> Envoi du dernier lot de {compteur_lot} documents...")
+                    partie_numero, partie_acc = ligne.split("accompagnateur:")
+                    connaissance[int(partie_numero.replace("numero:", "").strip())] = nettoyer_numeros_str(partie_acc)
+                except (ValueError, IndexError): continue
+    return connaissance
+
+# --- FICHIER DE REPRISE ---
+def _empreinte_fichier(chemin):
+    etat = os.stat(chemin)
+    return {"fichier": os.path.abspath(chemin), "taille": etat.st_size, "mtime": etat.st_mtime, "taille_lot": TAILLE_LOT}
+
+def lire_reprise(chemin_csv, chemin_reprise=NOM_FICHIER_REPRISE):
+    """Numéros des lots déjà écrits lors d'une migration interrompue du même fichier CSV."""
+    try:
+        with open(chemin_reprise, encoding='utf-8') as f:
+            reprise = json.load(f)
+    except (OSError, ValueError):
+        return set()
+    if reprise.get("empreinte") != _empreinte_fichier(chemin_csv):
+        print("-> Fichier de reprise ignoré : le CSV a changé depuis la migration interrompue.")
+        return set()
+    return set(reprise.get("lots_termines", []))
+
+def ecrire_reprise(chemin_csv, lots_termines, chemin_reprise=NOM_FICHIER_REPRISE):
+    temporaire = chemin_reprise + ".tmp"
+    with open(temporaire, "w", encoding='utf-8') as f:
+        json.dump({"empreinte": _empreinte_fichier(chemin_csv), "lots_termines": sorted(lots_termines)}, f)
+    os.replace(temporaire, chemin_reprise)
+
+# --- ÉCRITURE DES LOTS ---
+def _ecrire_lot(db, collection, lot, numero):
+    """Écrit un lot avec nouvelles tentatives et attente exponentielle. Retourne le numéro du lot."""
+    for essai in range(NOMBRE_ESSAIS_LOT):
+        try:
+            collection_ref = db.collection(collection)
+            batch = db.batch()
+            for doc_id, doc_data in lot:
+                batch.set(collection_ref.document(doc_id), doc_data)
             batch.commit()
-        print(f"\n✅ Migration des tirages terminée. {compteur_total} documents ajoutés à 'tirages'.")
+            return numero
+        except Exception as e:
+            if essai == NOMBRE_ESSAIS_LOT - 1: raise
+            attente = DELAI_NOUVEL_ESSAI_LOT * 2 ** essai * (1 + random.random())
+            print(f"   -> Lot {numero} : échec ({e}), nouvel essai dans {attente:.1f} s.")
+            time.sleep(attente)
+
+def ecrire_documents(db, collection, documents, ecrivains=NOMBRE_ECRIVAINS, deja_faits=(), apres_lot=None):
+    """Écrit les documents par lots de TAILLE_LOT avec `ecrivains` lots en parallèle.
+    Les lots de `deja_faits` sont sautés ; `apres_lot(numero)` est appelé après chaque lot écrit.
+    Retourne (documents écrits, lots en échec)."""
+    lots = [documents[i:i + TAILLE_LOT] for i in range(0, len(documents), TAILLE_LOT)]
+    a_ecrire = [n for n in range(len(lots)) if n not in deja_faits]
+    ecrits, echecs = 0, []
+    if not a_ecrire: return 0, []
+    with ThreadPoolExecutor(max_workers=max(1, min(ecrivains, len(a_ecrire))), thread_name_prefix="migration") as executeur:
+        futures = {executeur.submit(_ecrire_lot, db, collection, lots[n], n): n for n in a_ecrire}
+        for future in as_completed(futures):
+            numero = futures[future]
+            try:
+                future.result()
+                ecrits += len(lots[numero])
+                if apres_lot: apres_lot(numero)
+            except Exception as e:
+                print(f"❌ Lot {numero} abandonné : {e}")
+                echecs.append(numero)
+    return ecrits, echecs
+
+# --- MIGRATIONS ---
+def migrer_tirages(db, chemin=NOM_FICHIER_DONNEES_CSV, ecrivains=NOMBRE_ECRIVAINS, reprendre=True, chemin_reprise=NOM_FICHIER_REPRISE):
+    """Lit le fichier CSV et envoie les tirages vers Firestore par lots écrits en parallèle.
+    Retourne le nombre de documents écrits."""
+    print(f"\n--- Démarrage de la migration des tirages ---")
+    try:
+        documents = preparer_tirages(chemin)
     except FileNotFoundError:
-        print(f"❌ Erreur : Le fichier '{NOM_FICHIER_DONNEES_CSV}' n'a pas été trouvé.")
-    except Exception as e:
-        print(f"❌ Une erreur est survenue pendant la migration : {e}")
+        print(f"❌ Erreur : Le fichier '{chemin}' n'a pas été trouvé."); return 0
+    deja_faits = lire_reprise(chemin, chemin_reprise) if reprendre else set()
+    if deja_faits:
+        print(f"-> Reprise : {len(deja_faits)} lot(s) déjà écrit(s) seront sautés.")
+    print(f"-> {len(documents)} documents à migrer avec {ecrivains} écrivain(s) en parallèle.")
+
+    lots_termines = set(deja_faits)
+    def noter_lot(numero):  # appelé depuis le thread principal, au fil des lots terminés
+        lots_termines.add(numero)
+        if chemin_reprise: ecrire_reprise(chemin, lots_termines, chemin_reprise)
+
+    debut = time.perf_counter()
+    ecrits, echecs = ecrire_documents(db, 'tirages', documents, ecrivains, deja_faits, noter_lot)
+    duree = time.perf_counter() - debut
+    if ecrits: cache_donnees.invalider("tirages")
+    if echecs:
+        print(f"❌ Migration des tirages incomplète : {len(echecs)} lot(s) en échec. Relancez le script pour reprendre.")
+    else:
+        if chemin_reprise and os.path.exists(chemin_reprise): os.remove(chemin_reprise)
+        print(f"\n✅ Migration des tirages terminée. {ecrits} documents ajoutés à 'tirages' en {duree:.1f} s.")
+    return ecrits
 
-def migrer_base_connaissance():
-    """Lit le fichier de connaissance et l'envoie vers Firestore."""
+def migrer_base_connaissance(db, chemin=NOM_FICHIER_BASE_CONNAISSANCE):
+    """Lit le fichier de connaissance et l'envoie vers Firestore en un seul lot."""
     print(f"\n--- Démarrage de la migration de la base de connaissance ---")
-    collection_ref = db.collection('connaissance')
-    compteur = 0
     try:
-        with open(NOM_FICHIER_BASE_CONNAISSANCE, mode='r', encoding='utf-8') as f:
-            for ligne in f:
-                if "numero:" in ligne and "accompagnateur:" in ligne:
-                    try:
-                        partie_numero, partie_acc = ligne.split("accompagnateur:")
-                        numero_cle = int(partie_numero.replace("numero:", "").strip())
-                        accompagnateurs = nettoyer_numeros_str(partie_acc)
-                        doc_ref = collection_ref.document(str(numero_cle))
-                        doc_ref.set({"accompagnateurs": accompagnateurs})
-                        compteur += 1
-                    except (ValueError, IndexError): continue
-        print(f"\n✅ Migration de la base de connaissance terminée. {compteur} documents ajoutés à 'connaissance'.")
+        connaissance = preparer_base_connaissance(chemin)
+        collection_ref = db.collection('connaissance')
+        batch = db.batch()
+        for numero_cle, accompagnateurs in connaissance.items():
+            batch.set(collection_ref.document(str(numero_cle)), {"accompagnateurs": accompagnateurs})
+        batch.commit()
+        cache_donnees.invalider("connaissance")
+        print(f"\n✅ Migration de la base de connaissance terminée. {len(connaissance)} documents ajoutés à 'connaissance'.")
+        return len(connaissance)
     except FileNotFoundError:
-        print(f"❌ Erreur : Le fichier '{NOM_FICHIER_BASE_CONNAISSANCE}' n'a pas été trouvé.")
+        print(f"❌ Erreur : Le fichier '{chemin}' n'a pas été trouvé.")
     except Exception as e:
         print(f"❌ Une erreur est survenue : {e}")
+    return 0
+
+# --- ESSAI À BLANC : MESURE DU DÉBIT ---
+def benchmark_migration(ecrivains_testes=(1, 4, NOMBRE_ECRIVAINS), latence=LATENCE_BENCHMARK):
+    """Migration complète vers la doublure locale de Firestore (aucune écriture réelle),
+    pour chaque nombre d'écrivains. Retourne {ecrivains: documents par seconde}."""
+    from firestore_local import ClientLocal
+    debut = time.perf_counter()
+    documents = preparer_tirages()
+    print(f"-> Préparation de {len(documents)} documents : {time.perf_counter() - debut:.2f} s.")
+    resultats = {}
+    for ecrivains in ecrivains_testes:
+        db_local = ClientLocal(latence=latence)
+        debut = time.perf_counter()
+        ecrits, _ = ecrire_documents(db_local, 'tirages', documents, ecrivains)
+        duree = time.perf_counter() - debut
+        resultats[ecrivains] = ecrits / duree
+        print(f"-> {ecrivains} écrivain(s) : {ecrits} documents en {duree:.2f} s "
+              f"({resultats[ecrivains]:.0f} docs/s, {db_local.allers_retours} allers-retours).")
+    return resultats
 
 if __name__ == "__main__":
-    migrer_tirages()
-    migrer_base_connaissance()
\ No newline at end of file
+    if "--benchmark" in sys.argv:
+        benchmark_migration()
+        sys.exit(0)
+    db = connecter_stockage()
+    if db is None: sys.exit(1)
+    migrer_tirages(db, reprendre="--sans-reprise" not in sys.argv)
+    migrer_base_connaissance(db)
+    try:
+        import resume_firestore
+        resume_firestore.reconstruire(db)
+        cache_donnees.invalider("resume")
+    except ImportError:
+        print("-> NumPy absent : le résumé d'analyse sera construit par le collecteur.")
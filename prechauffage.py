@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+# Ce fichier prépare à l'avance l'analyse de la prochaine cible, dès qu'un nouveau tirage est collecté,
+# pour que le premier utilisateur après un tirage trouve déjà le résultat dans predictions_cache.
+# Le planificateur (thread de fond du serveur web) se réveille après l'heure de chaque créneau,
+# lance la collecte puis le préchauffage dès que le tirage du créneau est publié, qu'il ait été écrit
+# par cette collecte ou déjà par le cron ; un seul worker gunicorn l'exécute (verrou fichier).
+# Le préchauffage reste dans le serveur web : les heatmaps d'un résultat sont servies depuis son static/.
+
+import os
+import time
+import tempfile
+import threading
+from datetime import datetime, timedelta
+
+from analyse_loto import HEURES_TIRAGES
+from cron_update_firestore import MAPPINGS_HORAIRES, lire_dernier_tirage_memorise
+import taches_analyse
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# --- CONFIGURATIONS ---
+PRECHAUFFAGE_ACTIF = os.environ.get("PRECHAUFFAGE_ACTIF", "0") == "1"
+DELAI_PUBLICATION = timedelta(minutes=int(os.environ.get("DELAI_PUBLICATION_MINUTES", "10")))  # après l'heure du tirage
+INTERVALLE_NOUVEL_ESSAI = timedelta(minutes=5)
+NOMBRE_ESSAIS_MAX = 6
+FICHIER_VERROU = os.path.join(tempfile.gettempdir(), "loto_prechauffage.lock")
+
+_fichier_verrou = None
+
+def heures_creneaux():
+    """Heures de tous les créneaux connus : HEURES_TIRAGES et les heures de MAPPINGS_HORAIRES."""
+    heures = set(HEURES_TIRAGES) | {heure.replace('H', ':00') for heure in MAPPINGS_HORAIRES}
+    return sorted(heures)
+
+def prochain_reveil(maintenant=None):
+    """Prochaine date à laquelle les résultats d'un créneau devraient être publiés."""
+    maintenant = maintenant or datetime.now()
+    for decalage_jours in (0, 1):
+        jour = (maintenant + timedelta(days=decalage_jours)).date()
+        for heure in heures_creneaux():
+            reveil = datetime.combine(jour, datetime.strptime(heure, '%H:%M').time()) + DELAI_PUBLICATION
+            if reveil > maintenant: return reveil
+    return maintenant + timedelta(hours=1)
+
+def prechauffer_prochaine_cible(db):
+    """Lance (ou rejoint) l'analyse de la prochaine cible. Retourne l'ID de cache, ou None si
+    l'analyse était déjà en cache ou impossible."""
+    id_cache, resultat = taches_analyse.soumettre_analyse(db)
+    if id_cache is None:
+        if resultat and resultat.get("erreur"): print(f"-> Préchauffage impossible : {resultat['erreur']}")
+        else: print("-> Préchauffage : la prochaine cible est déjà en cache.")
+        return None
+    print(f"-> Préchauffage de la cible {id_cache} lancé.")
+    return id_cache
+
+def _boucle_planificateur(db):
+    from cron_update_firestore import collecter_vers_firestore
+    while True:
+        reveil = prochain_reveil()
+        print(f"-> Planificateur : prochaine collecte à {reveil.strftime('%d/%m %H:%M')}.")
+        time.sleep(max(0, (reveil - datetime.now()).total_seconds()))
+        creneau = reveil - DELAI_PUBLICATION
+        # Les résultats peuvent être publiés avec du retard : quelques nouveaux essais espacés
+        for _ in range(NOMBRE_ESSAIS_MAX):
+            try:
+                collecter_vers_firestore()
+                # Dernier tirage de l'API, mémorisé par la collecte même s'il était déjà dans Firestore (cron)
+                dernier = lire_dernier_tirage_memorise(INTERVALLE_NOUVEL_ESSAI.total_seconds())
+                if dernier and dernier["data"]["date_obj"] >= creneau:
+                    prechauffer_prochaine_cible(db)
+                    break
+            except Exception as e:
+                print(f"❌ Planificateur : erreur pendant la collecte ou le préchauffage : {e}")
+            time.sleep(INTERVALLE_NOUVEL_ESSAI.total_seconds())
+
+def demarrer_planificateur(db):
+    """Démarre le planificateur dans un thread de fond si PRECHAUFFAGE_ACTIF=1 et si aucun autre
+    processus de la machine ne l'exécute déjà. Retourne True si ce processus l'exécute."""
+    global _fichier_verrou
+    if not PRECHAUFFAGE_ACTIF or not db or _fichier_verrou is not None: return False
+    if fcntl:
+        fichier = open(FICHIER_VERROU, "w")
+        try:
+            fcntl.flock(fichier, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            fichier.close(); return False
+        _fichier_verrou = fichier  # gardé ouvert : le verrou dure autant que le processus
+    else:
+        _fichier_verrou = True
+    threading.Thread(target=_boucle_planificateur, args=(db,), name="prechauffage", daemon=True).start()
+    print("✅ Planificateur de préchauffage démarré.")
+    return True
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+# Ce fichier dessine les heatmaps dans un processus séparé (matplotlib / seaborn).
+# Les fichiers sont nommés d'après une empreinte de leurs données : des données inchangées
+# réutilisent l'image existante, et une image publiée ne change jamais (cache HTTP longue durée).
+# Une image est supprimée quand plus aucun résultat récent ne peut la référencer : sa date de
+# modification est rafraîchie à chaque réutilisation, et seules les images plus anciennes que
+# DUREE_CONSERVATION_IMAGES (plus longue que la durée de service d'une prédiction en cache) sont effacées.
+
+import os
+import time
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# --- CONFIGURATIONS ---
+DOSSIER_HEATMAPS = 'static'
+VERSION_RENDU = "1"  # à incrémenter si le style des images change
+# Une prédiction (prévision de la journée comprise) est servie au plus un jour et demi : marge de sécurité
+DUREE_CONSERVATION_IMAGES = int(os.environ.get("DUREE_CONSERVATION_HEATMAPS", str(7 * 86400)))  # secondes
+DELAI_RENDU = 120  # secondes
+
+_executeur = None
+
+def nom_fichier_heatmap(type_relation, matrice, etiquettes, titre):
+    """Nom de fichier déterminé par le contenu : heatmap_<type>_<empreinte>.png."""
+    empreinte = hashlib.sha256()
+    for partie in (VERSION_RENDU, type_relation, titre, ",".join(map(str, etiquettes)), str(matrice.shape), str(matrice.dtype)):
+        empreinte.update(partie.encode("utf-8")); empreinte.update(b"\0")
+    empreinte.update(matrice.tobytes())
+    return f"heatmap_{type_relation}_{empreinte.hexdigest()[:16]}.png"
+
+def dessiner_heatmap(matrice, etiquettes, titre, chemin_fichier):
+    """Exécutée dans le processus de rendu."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    import pandas as pd
+    temporaire = chemin_fichier + ".tmp.png"
+    plt.figure(figsize=(18, 15))
+    sns.heatmap(pd.DataFrame(matrice, index=etiquettes, columns=etiquettes), annot=True, cmap="viridis", fmt="d", linewidths=.5)
+    plt.title(titre, fontsize=16)
+    plt.savefig(temporaire)
+    plt.close()
+    os.replace(temporaire, chemin_fichier)
+    return chemin_fichier
+
+def _obtenir_executeur():
+    global _executeur
+    if _executeur is None:
+        # 'spawn' : le processus de rendu ne duplique pas l'état (threads, connexions) du serveur
+        _executeur = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+    return _executeur
+
+def _nettoyer_anciennes_images():
+    """Supprime les images ni dessinées ni réutilisées depuis DUREE_CONSERVATION_IMAGES."""
+    limite = time.time() - DUREE_CONSERVATION_IMAGES
+    for f in os.listdir(DOSSIER_HEATMAPS):
+        if not (f.startswith("heatmap_") and f.endswith(".png")): continue
+        chemin = os.path.join(DOSSIER_HEATMAPS, f)
+        try:
+            if os.path.getmtime(chemin) < limite: os.remove(chemin)
+        except OSError: pass
+
+def rendre_heatmaps(heatmaps):
+    """`heatmaps` : {type_relation: (matrice, etiquettes, titre)}. Dessine dans le processus de rendu
+    les images absentes du dossier et retourne {type_relation: nom_fichier}."""
+    global _executeur
+    os.makedirs(DOSSIER_HEATMAPS, exist_ok=True)
+    noms, a_dessiner = {}, {}
+    for type_relation, (matrice, etiquettes, titre) in heatmaps.items():
+        nom = nom_fichier_heatmap(type_relation, matrice, etiquettes, titre)
+        noms[type_relation] = nom
+        chemin = os.path.join(DOSSIER_HEATMAPS, nom)
+        if os.path.exists(chemin):
+            print(f"-> Heatmap {type_relation} inchangée, image réutilisée.")
+            try: os.utime(chemin)  # encore référencée : repousse sa suppression
+            except OSError: pass
+            continue
+        a_dessiner[type_relation] = _obtenir_executeur().submit(dessiner_heatmap, matrice, etiquettes, titre, chemin)
+    try:
+        for future in a_dessiner.values():
+            future.result(timeout=DELAI_RENDU)
+    except BrokenProcessPool:
+        # Processus de rendu mort (mémoire, crash) : un nouveau sera créé au prochain appel
+        _executeur = None
+        raise
+    if a_dessiner: _nettoyer_anciennes_images()
+    return noms
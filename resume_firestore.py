@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+# Ce fichier maintient le document de résumé Firestore (meta/resume_analyse) lu par l'analyse :
+# une seule lecture au lieu de ~1 000 documents 'tirages' et ~90 documents 'connaissance'.
+# Contenu : les RESUME_FENETRE derniers tirages encodés (horodatages, noms, masques 90 bits gagnants et
+# machine en octets),
+# l'état de tout l'historique pour la forme / l'écart (fréquences, dernière apparition, nombre de tirages)
+# et la base de connaissance. Les matrices RGNTC ne sont pas stockées : elles se recalculent depuis
+# les masques en quelques millisecondes et le document reste petit (~45 Ko pour 1 000 tirages).
+# Le collecteur le prolonge après chaque écriture ; `verifier` le reconstruit depuis la collection brute.
+# Usage :
+#   python resume_firestore.py --verifier            -> compare avec la collection 'tirages' et répare
+#   python resume_firestore.py --verifier --sans-reparer
+
+import os
+import sys
+from datetime import datetime, timezone
+import numpy as np
+
+import calcul_matriciel
+import metriques
+from tirage_compact import Tirage
+
+# --- CONFIGURATIONS ---
+COLLECTION_META = 'meta'
+DOCUMENT_RESUME = 'resume_analyse'
+FORMAT_RESUME = 2  # à incrémenter si la structure du document change (l'ancien est alors reconstruit)
+RESUME_FENETRE = int(os.environ.get("RESUME_FENETRE", "1000"))  # tirages récents conservés (LIMITE_TIRAGES)
+CHAMPS_COMPARES = ("nombre_total", "horodatages", "noms", "masques_gagnants", "masques_machine", "frequences", "derniere_apparition", "connaissance")
+
+def _ordre(tirages):
+    """Ordre canonique (date, nom) : le résumé ne dépend pas de l'ordre de lecture des documents."""
+    return sorted(tirages, key=lambda t: (calcul_matriciel.horodatage(t.date_obj), t.nom_du_tirage or ''))
+
+def _colonnes(tirages):
+    """(horodatages, masques gagnants, masques machine) ; les numéros sortis sont l'union des deux masques."""
+    masques_gagnants = np.array([calcul_matriciel.masque_depuis_entier(t.masque_gagnants) for t in tirages], dtype=np.uint64).reshape(-1, 2)
+    masques_machine = np.array([calcul_matriciel.masque_depuis_entier(t.masque_machine) for t in tirages], dtype=np.uint64).reshape(-1, 2)
+    horodatages = np.array([calcul_matriciel.horodatage(t.date_obj) for t in tirages], dtype=np.int64)
+    return horodatages, masques_gagnants, masques_machine
+
+def construire(tirages, connaissance, fenetre=RESUME_FENETRE):
+    """Résumé complet à partir de tous les tirages (Tirage) et de la base de connaissance {numero: set}."""
+    tirages = _ordre(tirages)
+    horodatages, masques_gagnants, masques_machine = _colonnes(tirages)
+    X = calcul_matriciel.matrice_depuis_masques(masques_gagnants | masques_machine)
+    recents = slice(max(0, len(tirages) - fenetre), len(tirages))
+    noms = sorted({t.nom_du_tirage or '' for t in tirages[recents]})
+    return {
+        "format": FORMAT_RESUME, "fenetre": fenetre, "nombre_total": len(tirages),
+        "horodatages": horodatages[recents].astype('<i8').tobytes(),
+        "noms": noms, "index_noms": np.array([noms.index(t.nom_du_tirage or '') for t in tirages[recents]], dtype='<i2').tobytes(),
+        "masques_gagnants": masques_gagnants[recents].astype('<u8').tobytes(), "masques_machine": masques_machine[recents].astype('<u8').tobytes(),
+        "frequences": [int(v) for v in X.sum(axis=0)],
+        "derniere_apparition": [int(v) for v in calcul_matriciel.derniere_apparition(X)],
+        "connaissance": {str(n): sorted(a) for n, a in sorted(connaissance.items())},
+    }
+
+def decoder(resume):
+    """Résumé Firestore -> {"tirages": [Tirage], "connaissance", "frequences", "derniere_apparition", "nombre_total"}."""
+    horodatages = np.frombuffer(resume["horodatages"], dtype='<i8')
+    index_noms = np.frombuffer(resume["index_noms"], dtype='<i2')
+    masques_gagnants = np.frombuffer(resume["masques_gagnants"], dtype='<u8').reshape(-1, 2)
+    masques_machine = np.frombuffer(resume["masques_machine"], dtype='<u8').reshape(-1, 2)
+    tirages = []
+    for h, i_nom, (g_bas, g_haut), (m_bas, m_haut) in zip(horodatages.tolist(), index_noms.tolist(), masques_gagnants.tolist(), masques_machine.tolist()):
+        tirages.append(Tirage(calcul_matriciel.date_depuis_horodatage(h), resume["noms"][i_nom],
+                              calcul_matriciel.entier_depuis_masque(g_bas, g_haut), calcul_matriciel.entier_depuis_masque(m_bas, m_haut)))
+    return {"tirages": tirages, "nombre_total": resume["nombre_total"],
+            "connaissance": {int(n): set(a) for n, a in resume["connaissance"].items()},
+            "frequences": np.array(resume["frequences"], dtype=np.int64),
+            "derniere_apparition": np.array(resume["derniere_apparition"], dtype=np.int64)}
+
+def prolonger(resume, nouveaux_tirages):
+    """Ajoute des tirages (postérieurs au dernier du résumé) ; retourne le nouveau résumé, ou None si un
+    tirage est hors ordre ou déjà présent (une reconstruction complète est alors nécessaire)."""
+    if not nouveaux_tirages: return resume
+    actuel = decoder(resume)
+    nouveaux = _ordre(nouveaux_tirages)
+    if actuel["tirages"] and calcul_matriciel.horodatage(nouveaux[0].date_obj) <= calcul_matriciel.horodatage(actuel["tirages"][-1].date_obj):
+        return None
+    _, masques_gagnants, masques_machine = _colonnes(nouveaux)
+    X = calcul_matriciel.matrice_depuis_masques(masques_gagnants | masques_machine)
+    nombre = resume["nombre_total"]
+    derniere = calcul_matriciel.derniere_apparition(X, nombre)
+    prolonge = construire(actuel["tirages"] + nouveaux, actuel["connaissance"], resume["fenetre"])
+    prolonge.update({"nombre_total": nombre + len(nouveaux),
+                     "frequences": [int(v) for v in actuel["frequences"] + X.sum(axis=0)],
+                     "derniere_apparition": [int(v) for v in np.where(derniere >= 0, derniere, actuel["derniere_apparition"])]})
+    return prolonge
+
+# --- FIRESTORE ---
+def _reference(db):
+    return db.collection(COLLECTION_META).document(DOCUMENT_RESUME)
+
+def lire(db):
+    """Résumé décodé, ou None s'il est absent ou d'un autre format (1 lecture)."""
+    doc = _reference(db).get()
+    metriques.compter_lectures(COLLECTION_META)
+    if not doc.exists: return None
+    resume = doc.to_dict()
+    if resume.get("format") != FORMAT_RESUME: return None
+    return decoder(resume)
+
+def _ecrire(db, resume, generation):
+    resume = dict(resume, generation=generation, mis_a_jour=datetime.now(timezone.utc))
+    _reference(db).set(resume)
+    metriques.compter_ecritures(COLLECTION_META)
+    return resume
+
+def lire_collection(db):
+    """Tous les tirages et la base de connaissance depuis les collections brutes (lecture complète)."""
+    documents = [doc.to_dict() for doc in db.collection('tirages').stream()]
+    metriques.compter_lectures('tirages', len(documents))
+    connaissance_docs = list(db.collection('connaissance').stream())
+    metriques.compter_lectures('connaissance', len(connaissance_docs))
+    connaissance = {int(d.id): set(d.to_dict().get('accompagnateurs', [])) for d in connaissance_docs}
+    return [Tirage.depuis_dict(d) for d in documents], connaissance
+
+def reconstruire(db, generation=None):
+    """Reconstruit le résumé depuis les collections brutes et l'écrit."""
+    print("-> Reconstruction du résumé d'analyse depuis les collections 'tirages' et 'connaissance'...")
+    tirages, connaissance = lire_collection(db)
+    if generation is None:
+        doc = _reference(db).get()
+        metriques.compter_lectures(COLLECTION_META)
+        generation = (doc.to_dict() or {}).get("generation", 0) + 1 if doc.exists else 1
+    resume = _ecrire(db, construire(tirages, connaissance), generation)
+    print(f"✅ Résumé d'analyse reconstruit ({len(tirages)} tirages, génération {generation}).")
+    return resume
+
+def mettre_a_jour(db, tirages_ajoutes):
+    """Appelée par le collecteur avec les tirages qu'il vient d'écrire (format {"doc_id", "data"}) :
+    une lecture et une écriture, sauf au premier passage ou pour un tirage hors ordre (reconstruction)."""
+    doc = _reference(db).get()
+    metriques.compter_lectures(COLLECTION_META)
+    resume = doc.to_dict() if doc.exists else None
+    if not resume or resume.get("format") != FORMAT_RESUME:
+        return reconstruire(db, generation=1 if not resume else resume.get("generation", 0) + 1)
+    prolonge = prolonger(resume, [Tirage.depuis_dict(t["data"]) for t in tirages_ajoutes])
+    if prolonge is None:
+        print("-> Tirage hors ordre : le résumé d'analyse est reconstruit.")
+        return reconstruire(db, generation=resume.get("generation", 0) + 1)
+    prolonge = _ecrire(db, prolonge, resume.get("generation", 0) + 1)
+    print(f"-> Résumé d'analyse prolongé de {len(tirages_ajoutes)} tirage(s) (génération {prolonge['generation']}).")
+    return prolonge
+
+def verifier(db, reparer=True):
+    """Contrôle de cohérence : compare le résumé stocké à un résumé reconstruit depuis la collection brute.
+    Retourne la liste des champs divergents (vide si cohérent) ; réécrit le résumé si `reparer`."""
+    doc = _reference(db).get()
+    metriques.compter_lectures(COLLECTION_META)
+    stocke = doc.to_dict() if doc.exists else {}
+    tirages, connaissance = lire_collection(db)
+    attendu = construire(tirages, connaissance, stocke.get("fenetre", RESUME_FENETRE))
+    divergences = [c for c in CHAMPS_COMPARES if stocke.get(c) != attendu[c]]
+    if stocke.get("format") != FORMAT_RESUME: divergences.insert(0, "format")
+    if not divergences:
+        print(f"✅ Résumé d'analyse cohérent ({len(tirages)} tirages).")
+    else:
+        print(f"❌ Résumé d'analyse incohérent : {', '.join(divergences)}.")
+        if reparer:
+            _ecrire(db, attendu, stocke.get("generation", 0) + 1)
+            print("✅ Résumé d'analyse réparé.")
+    return divergences
+
+if __name__ == "__main__":
+    from migrate_to_firestore import connecter_firestore
+    db = connecter_firestore()
+    if db is None: sys.exit(1)
+    if "--verifier" in sys.argv:
+        sys.exit(1 if verifier(db, reparer="--sans-reparer" not in sys.argv) and "--sans-reparer" in sys.argv else 0)
+    reconstruire(db)
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+# Ce fichier maintient les compteurs RGNTC de façon incrémentale (fenêtre glissante des derniers tirages).
+# Un nouveau tirage ajoute sa contribution, un tirage qui sort de la fenêtre retire la sienne :
+# le coût d'une mise à jour dépend du nombre de tirages ajoutés, pas de la taille de la fenêtre.
+# Les lignes d'incidence sont rangées dans un tampon circulaire de `taille_max` lignes alloué une fois.
+# Un état déjà partagé (snapshot en mémoire) n'est jamais modifié : la mise à jour travaille sur une copie.
+
+import os
+import re
+import sys
+import threading
+import numpy as np
+
+import calcul_matriciel
+from tirage_compact import Tirage
+
+# --- CONFIGURATIONS ---
+FENETRE_RGNTC = 3
+TAILLE_FENETRE_TIRAGES = 1000
+CHEMIN_SNAPSHOT = os.environ.get("RGNTC_SNAPSHOT", "rgntc_snapshot.npz")
+VERIFIER_SNAPSHOT = os.environ.get("RGNTC_VERIFIER", "0") == "1"  # contrôle chaque lecture du snapshot par un recalcul
+
+# Snapshot déjà chargé par ce processus : (chemin, mtime, etat)
+_snapshot_memoire = None
+_verrou_snapshot = threading.Lock()
+
+def cle_tirage(date_obj, nom_du_tirage):
+    """Même format que les IDs des documents 'tirages' de Firestore."""
+    return date_obj.strftime('%Y%m%d%H%M') + "_" + re.sub(r'[^a-zA-Z0-9]', '', nom_du_tirage or '')
+
+def ligne_incidence(numeros):
+    ligne = np.zeros(calcul_matriciel.NUMERO_MAX, dtype=np.int64)
+    for n in numeros:
+        if 1 <= n <= calcul_matriciel.NUMERO_MAX: ligne[n - 1] = 1
+    return ligne
+
+def construire_etat(tous_les_tirages, fenetre=FENETRE_RGNTC, taille_max=TAILLE_FENETRE_TIRAGES):
+    """Calcul complet de l'état à partir d'une liste de tirages triée par date croissante."""
+    tirages = tous_les_tirages[-taille_max:]
+    lignes = calcul_matriciel.matrice_incidence(tirages).astype(np.int64)
+    cles = [cle_tirage(t.date_obj, t.nom_du_tirage) for t in tirages]
+    return _etat_depuis_lignes(lignes, cles, [calcul_matriciel.horodatage(t.date_obj) for t in tirages], fenetre, taille_max)
+
+def _etat_depuis_lignes(lignes, cles, dates, fenetre, taille_max, matrices=None):
+    lignes = np.asarray(lignes, dtype=np.int64).reshape(-1, calcul_matriciel.NUMERO_MAX)[-taille_max:]
+    matrices = matrices or calcul_matriciel.matrices_rgntc(lignes.astype(np.float64), fenetre)
+    tampon = np.zeros((taille_max, calcul_matriciel.NUMERO_MAX), dtype=np.int64)
+    tampon[:len(lignes)] = lignes
+    return {
+        "tampon": tampon, "debut": 0, "cles": list(cles), "dates": list(dates), "fenetre": fenetre, "taille_max": taille_max,
+        "frequences": lignes.sum(axis=0), "precurseurs": matrices["precurseurs"], "compagnons": matrices["compagnons"],
+    }
+
+def lignes_etat(etat):
+    """Lignes d'incidence de la fenêtre dans l'ordre chronologique (copie)."""
+    return np.roll(etat["tampon"], -etat["debut"], axis=0)[:len(etat["cles"])]
+
+def _ligne(etat, i):
+    return etat["tampon"][(etat["debut"] + i) % etat["taille_max"]]
+
+def _somme_lignes(etat, debut, fin):
+    """Somme des lignes chronologiques [debut, fin) (au plus `fenetre` lignes)."""
+    somme = np.zeros(calcul_matriciel.NUMERO_MAX, dtype=np.int64)
+    for i in range(max(0, debut), min(fin, len(etat["cles"]))): somme += _ligne(etat, i)
+    return somme
+
+def _ajouter_ligne(etat, x, cle, date):
+    n = len(etat["cles"])
+    precedents = _somme_lignes(etat, n - etat["fenetre"], n)
+    etat["compagnons"] += np.outer(x, x); etat["compagnons"][np.diag_indices_from(etat["compagnons"])] -= x
+    etat["precurseurs"] += np.outer(x, precedents)
+    etat["tampon"][(etat["debut"] + n) % etat["taille_max"]] = x
+    etat["frequences"] += x
+    etat["cles"].append(cle); etat["dates"].append(date)
+
+def _retirer_plus_ancien(etat):
+    x0 = _ligne(etat, 0).copy()
+    etat["compagnons"] -= np.outer(x0, x0); etat["compagnons"][np.diag_indices_from(etat["compagnons"])] += x0
+    # x0 était précurseur des `fenetre` tirages suivants
+    etat["precurseurs"] -= np.outer(_somme_lignes(etat, 1, 1 + etat["fenetre"]), x0)
+    etat["frequences"] -= x0
+    etat["debut"] = (etat["debut"] + 1) % etat["taille_max"]
+    del etat["cles"][0]; del etat["dates"][0]
+
+def copier_etat(etat):
+    return {k: v.copy() if isinstance(v, (np.ndarray, list)) else v for k, v in etat.items()}
+
+def ajouter_tirages(etat, nouveaux_tirages):
+    """Ajoute des tirages (Tirage) à l'état.
+    Retourne le nombre de tirages intégrés ; les tirages déjà présents sont ignorés.
+    Un tirage plus ancien que le dernier de la fenêtre impose un recalcul (à partir de la fenêtre stockée)."""
+    deja_presents = set(etat["cles"])
+    a_ajouter = [(cle_tirage(t.date_obj, t.nom_du_tirage), calcul_matriciel.horodatage(t.date_obj), t) for t in nouveaux_tirages]
+    a_ajouter = sorted((c for c in a_ajouter if c[0] not in deja_presents), key=lambda c: c[1])
+    if not a_ajouter: return 0
+    if etat["dates"] and a_ajouter[0][1] < etat["dates"][-1]:
+        print("-> Tirage hors ordre détecté : recalcul complet de la fenêtre RGNTC.")
+        lignes = list(lignes_etat(etat)) + [ligne_incidence(t.numeros_sortis) for _, _, t in a_ajouter]
+        cles = etat["cles"] + [cle for cle, _, _ in a_ajouter]
+        dates = etat["dates"] + [date for _, date, _ in a_ajouter]
+        ordre = sorted(range(len(cles)), key=lambda i: dates[i])[-etat["taille_max"]:]
+        etat.update(_etat_depuis_lignes(np.array([lignes[i] for i in ordre], dtype=np.int64), [cles[i] for i in ordre],
+                                        [dates[i] for i in ordre], etat["fenetre"], etat["taille_max"]))
+        return len(a_ajouter)
+    for cle, date, t in a_ajouter:
+        # Fenêtre pleine : le plus ancien tirage libère sa ligne du tampon avant l'ajout
+        while len(etat["cles"]) >= etat["taille_max"]: _retirer_plus_ancien(etat)
+        _ajouter_ligne(etat, ligne_incidence(t.numeros_sortis), cle, date)
+    return len(a_ajouter)
+
+def matrices_depuis_etat(etat):
+    return {"precurseurs": etat["precurseurs"], "compagnons": etat["compagnons"], "suiveurs": etat["precurseurs"].T}
+
+def numeros_presents_etat(etat):
+    return [int(i) + 1 for i in np.flatnonzero(etat["frequences"])]
+
+def verifier_etat(etat, tous_les_tirages=None):
+    """Compare l'état incrémental avec un recalcul complet (sur `tous_les_tirages` si fournis,
+    sinon sur la fenêtre stockée). Retourne (ok, détails)."""
+    if tous_les_tirages is not None:
+        reference = construire_etat(tous_les_tirages, etat["fenetre"], etat["taille_max"])
+    else:
+        reference = calcul_matriciel.matrices_rgntc(lignes_etat(etat).astype(np.float64), etat["fenetre"])
+    ecarts = {k: int(np.abs(reference[k] - etat[k]).sum()) for k in ("precurseurs", "compagnons")}
+    return all(v == 0 for v in ecarts.values()), ecarts
+
+# --- PERSISTANCE ---
+def sauvegarder_etat(etat, chemin=CHEMIN_SNAPSHOT):
+    """Écriture atomique du snapshot (fichier temporaire puis remplacement)."""
+    global _snapshot_memoire
+    temporaire = chemin + ".tmp.npz"
+    np.savez_compressed(temporaire, lignes=lignes_etat(etat).astype(np.uint8), cles=np.array(etat["cles"], dtype=str),
+                        dates=np.array(etat["dates"], dtype=np.int64),
+                        precurseurs=etat["precurseurs"], compagnons=etat["compagnons"],
+                        parametres=np.array([etat["fenetre"], etat["taille_max"]], dtype=np.int64))
+    os.replace(temporaire, chemin)
+    _snapshot_memoire = (chemin, os.path.getmtime(chemin), etat)
+
+def charger_etat(chemin=CHEMIN_SNAPSHOT):
+    """Charge le snapshot (réutilise la copie en mémoire si le fichier n'a pas changé)."""
+    global _snapshot_memoire
+    if not os.path.exists(chemin): return None
+    mtime = os.path.getmtime(chemin)
+    if _snapshot_memoire and _snapshot_memoire[0] == chemin and _snapshot_memoire[1] == mtime:
+        return _snapshot_memoire[2]
+    try:
+        with np.load(chemin) as donnees:
+            fenetre, taille_max = (int(v) for v in donnees["parametres"])
+            lignes = donnees["lignes"].astype(np.int64)
+            matrices = {"precurseurs": donnees["precurseurs"].astype(np.int64), "compagnons": donnees["compagnons"].astype(np.int64)}
+            etat = _etat_depuis_lignes(lignes, [str(c) for c in donnees["cles"]], [int(d) for d in donnees["dates"]], fenetre, taille_max, matrices)
+    except Exception as e:
+        print(f"❌ Snapshot RGNTC illisible ({chemin}) : {e}"); return None
+    _snapshot_memoire = (chemin, mtime, etat)
+    return etat
+
+def etat_pour_tirages(tous_les_tirages, fenetre=FENETRE_RGNTC, taille_max=TAILLE_FENETRE_TIRAGES, chemin=CHEMIN_SNAPSHOT):
+    """Retourne un état cohérent avec `tous_les_tirages` : le snapshot s'il est à jour, sinon un recalcul (sauvegardé)."""
+    etat = charger_etat(chemin)
+    cles = [cle_tirage(t.date_obj, t.nom_du_tirage) for t in tous_les_tirages[-taille_max:]]
+    if etat and etat["fenetre"] == fenetre and etat["taille_max"] == taille_max and etat["cles"] == cles:
+        print("-> Relations RGNTC lues depuis le snapshot incrémental.")
+        if not VERIFIER_SNAPSHOT: return etat
+        ok, ecarts = verifier_etat(etat, tous_les_tirages)
+        if ok: return etat
+        print(f"❌ Snapshot RGNTC incohérent avec le recalcul complet {ecarts} : il est reconstruit.")
+    print("-> Snapshot RGNTC absent ou périmé : recalcul complet.")
+    etat = construire_etat(tous_les_tirages, fenetre, taille_max)
+    try: sauvegarder_etat(etat, chemin)
+    except OSError as e: print(f"❌ Impossible de sauvegarder le snapshot RGNTC : {e}")
+    return etat
+
+def integrer_nouveaux_tirages(nouveaux_tirages, chemin=CHEMIN_SNAPSHOT):
+    """Appelée par le collecteur avec les tirages qu'il vient d'écrire (format {"doc_id", "data"}).
+    L'état en mémoire peut être lu par des requêtes en cours : la mise à jour se fait sur une copie."""
+    with _verrou_snapshot:
+        etat = charger_etat(chemin)
+        if etat is None:
+            print("-> Pas de snapshot RGNTC : il sera créé à la prochaine analyse."); return 0
+        etat = copier_etat(etat)
+        tirages = [Tirage.depuis_dict(t["data"]) for t in nouveaux_tirages]
+        ajoutes = ajouter_tirages(etat, tirages)
+        if ajoutes:
+            sauvegarder_etat(etat, chemin)
+            print(f"-> Snapshot RGNTC mis à jour ({ajoutes} tirage(s) intégré(s)).")
+        return ajoutes
+
+if __name__ == '__main__':
+    # python rgntc_incremental.py --verifier : contrôle le snapshot contre un recalcul complet
+    if "--verifier" in sys.argv:
+        etat = charger_etat()
+        if etat is None:
+            print("Aucun snapshot à vérifier."); sys.exit(1)
+        ok, ecarts = verifier_etat(etat)
+        print(f"Snapshot RGNTC ({len(etat['cles'])} tirages) : {'✅ cohérent' if ok else '❌ incohérent'} {ecarts}")
+        sys.exit(0 if ok else 1)
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+# Ce fichier gère une copie locale des tirages, en colonnes NumPy mappées en mémoire.
+# Colonnes : horodatages (int64, secondes UTC), ids de nom de tirage (int16) et masques 90 bits
+# (2 x uint64) des numéros gagnants, des numéros machine et de leur union (numéros sortis) ; un numéro
+# à la fois gagnant et machine reste dans les deux masques. La copie est synchronisée depuis
+# Firestore en ne lisant que les documents postérieurs à son marqueur `date_obj`.
+# Les colonnes d'un sous-dossier ont une capacité supérieure au nombre de tirages : une synchronisation
+# écrit les nouveaux tirages à la suite, en place, puis remplace meta.json (qui fixe le nombre de lignes
+# visibles). Un nouveau sous-dossier (tout l'historique) n'est écrit que si la capacité est atteinte ou si
+# un tirage arrive hors ordre. Les workers gunicorn partagent les mêmes pages (mmap) et ne voient jamais
+# une version incomplète ; les écritures (tirages, meta.json) passent par le verrou `verrou`.
+
+import os
+import re
+import json
+import time
+import shutil
+from contextlib import contextmanager
+from datetime import timezone
+import numpy as np
+
+import calcul_matriciel
+import metriques
+from tirage_compact import Tirage
+
+try:
+    import fcntl
+except ImportError:  # Windows : pas de verrou inter-processus
+    fcntl = None
+
+# --- CONFIGURATIONS ---
+DOSSIER_STOCKAGE = os.environ.get("STOCKAGE_LOCAL", "donnees_locales")
+INTERVALLE_SYNCHRO = int(os.environ.get("STOCKAGE_LOCAL_INTERVALLE", "300"))  # secondes entre deux synchros Firestore
+VERSIONS_CONSERVEES = 2  # sous-dossiers gardés (le courant et le précédent)
+CAPACITE_MIN = 4096  # lignes réservées au minimum dans un sous-dossier
+COLONNES = ("horodatages", "noms", "masques", "masques_gagnants", "masques_machine")
+FORMAT_STOCKAGE = 2  # à incrémenter si les colonnes changent : l'ancienne copie est alors resynchronisée en entier
+
+# Version actuellement mappée par ce processus : (version, colonnes, noms)
+_version_memoire = None
+
+def _chemin(*parties):
+    return os.path.join(DOSSIER_STOCKAGE, *parties)
+
+def _lire_meta_fichier():
+    try:
+        with open(_chemin("meta.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def lire_meta():
+    """Meta de la version courante, ou None s'il n'y a pas de copie (ou une copie d'un autre format)."""
+    meta = _lire_meta_fichier()
+    return meta if meta and meta.get("format") == FORMAT_STOCKAGE else None
+
+def _dossier(meta):
+    # Les copies antérieures aux écritures en place n'ont qu'un sous-dossier par version
+    return _chemin(meta.get("dossier") or f"v{meta['version']:06d}")
+
+def charger_colonnes():
+    """Retourne (colonnes, noms) de la version courante ; les colonnes sont des np.memmap en lecture seule."""
+    global _version_memoire
+    meta = lire_meta()
+    if not meta: return None, []
+    if _version_memoire and _version_memoire[0] == meta["version"]:
+        return _version_memoire[1], _version_memoire[2]
+    # Seules les `nombre` premières lignes sont écrites : la suite est la réserve des prochains ajouts
+    colonnes = {nom: np.load(os.path.join(_dossier(meta), f"{nom}.npy"), mmap_mode="r")[:meta["nombre"]] for nom in COLONNES}
+    _version_memoire = (meta["version"], colonnes, meta["noms"])
+    return colonnes, meta["noms"]
+
+@contextmanager
+def _verrouiller():
+    """Verrou exclusif entre processus des écritures de la copie (tirages et meta.json)."""
+    os.makedirs(DOSSIER_STOCKAGE, exist_ok=True)
+    with open(_chemin("verrou"), "w") as verrou:
+        if fcntl: fcntl.flock(verrou, fcntl.LOCK_EX)
+        yield
+
+def _ecrire_meta(meta):
+    temporaire = _chemin(f"meta.json.{os.getpid()}.tmp")  # un fichier temporaire par worker
+    with open(temporaire, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(temporaire, _chemin("meta.json"))
+
+def _nouvelle_meta(noms, haut_niveau, nombre, dossier, capacite):
+    meta = _lire_meta_fichier() or {"version": 0}  # la numérotation continue après un changement de format
+    return {"version": meta["version"] + 1, "format": FORMAT_STOCKAGE, "noms": noms, "haut_niveau": haut_niveau,
+            "nombre": int(nombre), "dossier": dossier, "capacite": int(capacite), "derniere_synchro": time.time()}
+
+def _ecrire_version(colonnes, noms, haut_niveau):
+    """Écrit tout l'historique dans un nouveau sous-dossier (avec une réserve pour les prochains ajouts)
+    puis bascule meta.json (remplacement atomique)."""
+    nombre = len(colonnes["horodatages"])
+    capacite = max(CAPACITE_MIN, 2 * nombre)
+    meta = _nouvelle_meta(noms, haut_niveau, nombre, None, capacite)
+    meta["dossier"] = f"v{meta['version']:06d}"
+    dossier = _chemin(meta["dossier"])
+    os.makedirs(dossier, exist_ok=True)
+    for nom in COLONNES:
+        colonne = np.zeros((capacite,) + colonnes[nom].shape[1:], dtype=colonnes[nom].dtype)
+        colonne[:nombre] = colonnes[nom]
+        np.save(os.path.join(dossier, f"{nom}.npy"), colonne)
+    _ecrire_meta(meta)
+    # Les anciens sous-dossiers peuvent être supprimés : les mmap ouverts restent valides sous Linux
+    anciens = sorted(d for d in os.listdir(DOSSIER_STOCKAGE) if re.fullmatch(r"v\d{6}", d) and d != meta["dossier"])
+    for ancien in anciens[:max(0, len(anciens) - VERSIONS_CONSERVEES + 1)]:
+        shutil.rmtree(_chemin(ancien), ignore_errors=True)
+    return meta
+
+def _ecrire_a_la_suite(meta, nouvelles, noms, haut_niveau):
+    """Écrit les nouvelles lignes en place après les `nombre` lignes visibles, puis bascule meta.json :
+    les lecteurs ne voient les lignes qu'une fois meta.json remplacé."""
+    nombre = meta["nombre"]
+    for nom in COLONNES:
+        colonne = np.load(os.path.join(_dossier(meta), f"{nom}.npy"), mmap_mode="r+")
+        colonne[nombre:nombre + len(nouvelles[nom])] = nouvelles[nom]
+        colonne.flush()
+        del colonne
+    nouvelle_meta = _nouvelle_meta(noms, haut_niveau, nombre + len(nouvelles["horodatages"]),
+                                   os.path.basename(_dossier(meta)), meta.get("capacite", nombre))
+    _ecrire_meta(nouvelle_meta)
+    return nouvelle_meta
+
+def ajouter_tirages(tirages):
+    """Ajoute des tirages (Tirage) à la copie locale.
+    Les doublons (même horodatage et même nom) sont ignorés. Retourne le nombre d'ajouts."""
+    with _verrouiller():
+        return _ajouter(tirages)
+
+def _ajouter(tirages):
+    # Appelé sous le verrou
+    colonnes, noms = charger_colonnes()
+    noms = list(noms)
+    existants = {nom: np.asarray(colonnes[nom]) for nom in COLONNES} if colonnes else None
+    index_noms = {nom: i for i, nom in enumerate(noms)}
+    cles_existantes = set()
+    if existants is not None and tirages:
+        plus_ancien = min(calcul_matriciel.horodatage(t.date_obj) for t in tirages)
+        debut = int(np.searchsorted(existants["horodatages"], plus_ancien))
+        cles_existantes = set(zip(existants["horodatages"][debut:].tolist(), existants["noms"][debut:].tolist()))
+    lignes = []
+    for t in tirages:
+        nom = t.nom_du_tirage or ''
+        if nom not in index_noms:
+            index_noms[nom] = len(noms); noms.append(nom)
+        cle = (calcul_matriciel.horodatage(t.date_obj), index_noms[nom])
+        if cle in cles_existantes: continue
+        cles_existantes.add(cle)
+        lignes.append((cle[0], cle[1], calcul_matriciel.masque_depuis_entier(t.masque_gagnants), calcul_matriciel.masque_depuis_entier(t.masque_machine)))
+    if not lignes: return 0
+    nouvelles = {
+        "horodatages": np.array([l[0] for l in lignes], dtype=np.int64),
+        "noms": np.array([l[1] for l in lignes], dtype=np.int16),
+        "masques_gagnants": np.array([l[2] for l in lignes], dtype=np.uint64).reshape(-1, 2),
+        "masques_machine": np.array([l[3] for l in lignes], dtype=np.uint64).reshape(-1, 2),
+    }
+    nouvelles["masques"] = nouvelles["masques_gagnants"] | nouvelles["masques_machine"]
+    # Tri stable : les tirages de même horodatage gardent leur ordre d'arrivée
+    ordre = np.argsort(nouvelles["horodatages"], kind="stable")
+    nouvelles = {nom: col[ordre] for nom, col in nouvelles.items()}
+    meta = lire_meta()
+    if (existants is not None and len(existants["horodatages"]) and nouvelles["horodatages"][0] >= existants["horodatages"][-1]
+            and meta["nombre"] + len(lignes) <= meta.get("capacite", 0)):
+        # Cas courant : tirages plus récents que la copie, écrits à la suite sans réécrire l'historique
+        _ecrire_a_la_suite(meta, nouvelles, noms, int(nouvelles["horodatages"][-1]))
+        return len(lignes)
+    if existants is not None:
+        nouvelles = {nom: np.concatenate([existants[nom], nouvelles[nom]]) for nom in COLONNES}
+        ordre = np.argsort(nouvelles["horodatages"], kind="stable")
+        nouvelles = {nom: col[ordre] for nom, col in nouvelles.items()}
+    _ecrire_version(nouvelles, noms, int(nouvelles["horodatages"][-1]))
+    return len(lignes)
+
+def _synchro_recente(meta):
+    return meta and time.time() - meta.get("derniere_synchro", 0) < INTERVALLE_SYNCHRO
+
+def synchroniser(db, forcer=False):
+    """Récupère depuis Firestore uniquement les tirages postérieurs (ou égaux) au marqueur local."""
+    if not forcer and _synchro_recente(lire_meta()):
+        return 0
+    with _verrouiller():
+        # Un autre worker a pu synchroniser pendant l'attente du verrou : un seul interroge Firestore
+        meta = lire_meta()
+        if not forcer and _synchro_recente(meta):
+            return 0
+        print("-> Synchronisation de la copie locale des tirages depuis Firestore...")
+        requete = db.collection('tirages')
+        if meta:
+            haut_niveau = calcul_matriciel.date_depuis_horodatage(meta["haut_niveau"]).replace(tzinfo=timezone.utc)
+            requete = requete.where('date_obj', '>=', haut_niveau)
+        tirages = [Tirage.depuis_dict(doc.to_dict()) for doc in requete.order_by('date_obj').stream()]
+        metriques.compter_lectures('tirages', len(tirages))
+        ajoutes = _ajouter(tirages)
+        if not ajoutes and meta:
+            # On note quand même la synchronisation pour respecter l'intervalle
+            _ecrire_meta(dict(meta, derniere_synchro=time.time()))
+    print(f"-> Copie locale : {len(tirages)} document(s) lu(s), {ajoutes} tirage(s) ajouté(s).")
+    return ajoutes
+
+def lire_tirages(limite=None):
+    """Retourne les tirages (Tirage, triés par date croissante), sans lecture Firestore ni décodage des numéros."""
+    colonnes, noms = charger_colonnes()
+    if colonnes is None: return None
+    debut = 0 if limite is None else max(0, len(colonnes["horodatages"]) - limite)
+    tirages = []
+    for h, i_nom, (g_bas, g_haut), (m_bas, m_haut) in zip(colonnes["horodatages"][debut:].tolist(), colonnes["noms"][debut:].tolist(),
+                                                         colonnes["masques_gagnants"][debut:].tolist(), colonnes["masques_machine"][debut:].tolist()):
+        tirages.append(Tirage(calcul_matriciel.date_depuis_horodatage(h), noms[i_nom], calcul_matriciel.entier_depuis_masque(g_bas, g_haut),
+                              calcul_matriciel.entier_depuis_masque(m_bas, m_haut)))
+    return tirages
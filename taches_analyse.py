@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+# Ce fichier exécute les analyses en tâche de fond, une seule fois par cible.
+# La requête /analyser soumet (ou rejoint) la tâche identifiée par l'ID de cache de la cible et
+# rend la main immédiatement ; la page de statut interroge ensuite l'état de la tâche.
+# Dédoublonnage : dans le processus par un dictionnaire de tâches, entre processus (workers
+# gunicorn, machines) par un verrou Firestore créé avec `create()` et doté d'une date d'expiration ;
+# un verrou expiré est repris par une mise à jour conditionnée à sa date de modification (un seul gagnant).
+# Avancement en flux : les événements publiés par executer_analyse (statistiques, fragments de la
+# réponse de Gemini, prédiction provisoire) sont conservés avec la tâche et relus par `suivre_analyse`
+# (route SSE) ; une tâche d'un autre processus n'est suivie que par son état final dans Firestore.
+# La prévision de la journée (soumettre_analyses_journee) réserve chacune de ses cibles de la même
+# façon et les calcule en une seule tâche.
+
+import os
+import math
+import time
+import threading
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+from analyse_loto import (preparer_analyse, executer_analyse, preparer_analyses_journee, executer_analyses_journee,
+                          resultat_cache_valide, dernier_tirage_connu, MAX_APPELS_IA_PARALLELES)
+from firestore_local import DejaExistant, Introuvable, PreconditionEchouee
+import metriques
+
+# --- CONFIGURATIONS ---
+MAX_ANALYSES_PARALLELES = int(os.environ.get("MAX_ANALYSES_PARALLELES", "2"))
+DUREE_VERROU = timedelta(seconds=int(os.environ.get("DUREE_VERROU_ANALYSE", "300")))  # > timeout Gemini (100 s)
+DUREE_CONSERVATION_TACHES = timedelta(hours=1)
+COLLECTION_VERROUS = 'analyses_en_cours'
+INTERVALLE_SUIVI = 15  # secondes sans événement avant un signal de maintien (et entre deux lectures Firestore)
+
+_executeur = ThreadPoolExecutor(max_workers=MAX_ANALYSES_PARALLELES, thread_name_prefix="analyse")
+_verrou = threading.Lock()
+_nouvel_evenement = threading.Condition(_verrou)
+# id_cache -> {"etat": "en_cours" | "termine" | "erreur", "resultat": dict | None, "debut": datetime,
+#              "evenements": [(type, donnees)], "future": Future}
+_taches = {}
+_erreurs_verrou = None
+
+def _maintenant():
+    return datetime.now(timezone.utc)
+
+def _purger_taches():
+    limite = _maintenant() - DUREE_CONSERVATION_TACHES
+    for id_cache in [i for i, t in _taches.items() if t["etat"] != "en_cours" and t["debut"] < limite]:
+        del _taches[id_cache]
+
+def _erreurs_stockage():
+    """(document déjà existant, document modifié ou supprimé entre-temps) : exceptions de Firestore
+    (import différé) et des backends locaux."""
+    global _erreurs_verrou
+    if _erreurs_verrou is None:
+        deja_existant, modifie = (DejaExistant,), (PreconditionEchouee, Introuvable)
+        try:
+            from google.api_core.exceptions import AlreadyExists, FailedPrecondition, NotFound
+            deja_existant, modifie = deja_existant + (AlreadyExists,), modifie + (FailedPrecondition, NotFound)
+        except ImportError:
+            pass
+        _erreurs_verrou = (deja_existant, modifie)
+    return _erreurs_verrou
+
+def _prendre_verrou(db, id_cache, duree=DUREE_VERROU):
+    """Crée le verrou Firestore de la cible pour `duree`. Retourne False si un autre processus le détient
+    encore. Les autres erreurs (réseau, délai dépassé) sont propagées."""
+    deja_existant, modifie = _erreurs_stockage()
+    verrou_ref = db.collection(COLLECTION_VERROUS).document(id_cache)
+    donnees = {"debut": _maintenant(), "expire": _maintenant() + duree, "pid": os.getpid()}
+    for _ in range(2):
+        try:
+            verrou_ref.create(donnees)
+            metriques.compter_ecritures(COLLECTION_VERROUS)
+            return True
+        except deja_existant:
+            pass
+        doc = verrou_ref.get()
+        metriques.compter_lectures(COLLECTION_VERROUS)
+        if not doc.exists: continue  # libéré entre-temps : nouvelle tentative de création
+        expire = doc.to_dict().get("expire")
+        if expire and expire > _maintenant():
+            return False
+        # Verrou expiré (worker tué en cours d'analyse) : repris seulement s'il n'a pas changé depuis la lecture
+        try:
+            verrou_ref.update(donnees, option=db.write_option(last_update_time=doc.update_time))
+            metriques.compter_ecritures(COLLECTION_VERROUS)
+            return True
+        except modifie:
+            return False
+    return False
+
+def _verrou_actif(db, id_cache):
+    """Vrai si un processus détient encore le verrou Firestore de la cible (non expiré)."""
+    doc = db.collection(COLLECTION_VERROUS).document(id_cache).get()
+    metriques.compter_lectures(COLLECTION_VERROUS)
+    expire = doc.to_dict().get("expire") if doc.exists else None
+    return bool(expire and expire > _maintenant())
+
+def _liberer_verrou(db, id_cache):
+    try:
+        db.collection(COLLECTION_VERROUS).document(id_cache).delete()
+        metriques.compter_ecritures(COLLECTION_VERROUS)
+    except Exception as e:
+        print(f"❌ Impossible de libérer le verrou d'analyse {id_cache} : {e}")
+
+def _publier(id_cache, evenement, donnees):
+    with _nouvel_evenement:
+        _taches[id_cache]["evenements"].append((evenement, donnees))
+        _nouvel_evenement.notify_all()
+
+def _executer(db, contexte):
+    id_cache = contexte["id_cache"]
+    metriques.ouvrir_journal("analyse", id_cache=id_cache)
+    try:
+        with metriques.mesurer("analyse"):
+            resultat = executer_analyse(contexte, lambda evenement, donnees: _publier(id_cache, evenement, donnees))
+        etat = "erreur" if resultat.get("erreur") else "termine"
+    except Exception as e:
+        print(f"❌ Erreur pendant l'analyse {id_cache} : {e}")
+        resultat, etat = {"erreur": f"Erreur pendant l'analyse : {e}", "cible": contexte["cible"]}, "erreur"
+    finally:
+        _liberer_verrou(db, id_cache)
+    metriques.fermer_journal(etat=etat)
+    with _nouvel_evenement:
+        _taches[id_cache].update(etat=etat, resultat=resultat)
+        _nouvel_evenement.notify_all()
+
+def _reserver(db, id_cache, duree=DUREE_VERROU):
+    """Réserve la cible dans le processus puis par le verrou Firestore. Retourne (reservee, erreur) :
+    (False, None) si elle est déjà en cours ici ou ailleurs, (False, erreur) si le verrou est inaccessible."""
+    with _verrou:
+        _purger_taches()
+        tache = _taches.get(id_cache)
+        if tache and tache["etat"] == "en_cours":
+            return False, None
+        # Réservation dans le processus : le verrou Firestore est pris ensuite, hors de _verrou
+        _taches[id_cache] = {"etat": "en_cours", "resultat": None, "debut": _maintenant(), "evenements": []}
+    try:
+        verrou_pris, erreur = _prendre_verrou(db, id_cache, duree), None
+    except Exception as e:
+        verrou_pris, erreur = False, e
+    if not verrou_pris:
+        with _nouvel_evenement:
+            del _taches[id_cache]
+            _nouvel_evenement.notify_all()
+        if erreur:
+            print(f"❌ Verrou d'analyse {id_cache} indisponible : {erreur}")
+        else:
+            print(f"-> Analyse {id_cache} déjà en cours dans un autre processus.")
+    return verrou_pris, erreur
+
+def soumettre_analyse(db, mode=None):
+    """Soumet l'analyse de la prochaine cible ou rejoint celle déjà en cours (`mode` : voir MODE_ANALYSE).
+    Retourne (id_cache, resultat) : `resultat` est renseigné si l'analyse est déjà disponible
+    (cache Firestore) ou impossible (erreur de contexte), sinon il vaut None."""
+    contexte, resultat = preparer_analyse(db, mode)
+    if contexte is None:
+        return None, resultat
+    id_cache = contexte["id_cache"]
+    reservee, erreur = _reserver(db, id_cache)
+    if erreur:
+        return None, {"erreur": f"Impossible de réserver l'analyse : {erreur}", "cible": contexte["cible"]}
+    if not reservee:
+        return id_cache, None
+    print(f"-> Analyse {id_cache} soumise en tâche de fond.")
+    future = _executeur.submit(_executer, db, contexte)
+    with _verrou:
+        _taches[id_cache]["future"] = future
+    return id_cache, None
+
+def _executer_journee(db, contextes):
+    ids = [c["id_cache"] for c in contextes]
+    metriques.ouvrir_journal("analyse_journee", ids_cache=ids)
+    try:
+        with metriques.mesurer("analyse_journee"):
+            resultats = executer_analyses_journee(contextes, _publier)
+    except Exception as e:
+        print(f"❌ Erreur pendant la prévision de la journée : {e}")
+        resultats = {c["id_cache"]: {"erreur": f"Erreur pendant l'analyse : {e}", "cible": c["cible"]} for c in contextes}
+    finally:
+        for id_cache in ids: _liberer_verrou(db, id_cache)
+    etats = {id_cache: "erreur" if resultat.get("erreur") else "termine" for id_cache, resultat in resultats.items()}
+    metriques.fermer_journal(etats=etats)
+    with _nouvel_evenement:
+        for id_cache in ids:
+            _taches[id_cache].update(etat=etats[id_cache], resultat=resultats[id_cache])
+        _nouvel_evenement.notify_all()
+
+def soumettre_analyses_journee(db, mode=None):
+    """Soumet en une tâche de fond la prévision de la journée (prochaine cible et créneaux suivants du jour).
+    Chaque cible est réservée comme par soumettre_analyse : celle déjà en cours (ici, dans un autre processus,
+    via /analyser ou le préchauffage) n'est pas recalculée. Retourne ({cible: id_cache} en cours, {cible:
+    resultat} déjà en cache ou en erreur), ou (None, erreur)."""
+    contextes, resultats = preparer_analyses_journee(db, mode)
+    if contextes is None:
+        return None, resultats
+    # Les appels à Gemini partent par vagues de MAX_APPELS_IA_PARALLELES : le verrou doit couvrir toutes les vagues
+    duree = DUREE_VERROU * math.ceil(len(contextes) / MAX_APPELS_IA_PARALLELES)
+    en_cours, reservees = {}, []
+    for contexte in contextes:
+        reservee, erreur = _reserver(db, contexte["id_cache"], duree)
+        if erreur:
+            resultats[contexte["cible"]] = {"erreur": f"Impossible de réserver l'analyse : {erreur}", "cible": contexte["cible"]}
+            continue
+        en_cours[contexte["cible"]] = contexte["id_cache"]
+        if reservee: reservees.append(contexte)
+    if reservees:
+        print(f"-> Prévision de la journée soumise en tâche de fond : {', '.join(c['id_cache'] for c in reservees)}")
+        future = _executeur.submit(_executer_journee, db, reservees)
+        with _verrou:
+            for contexte in reservees: _taches[contexte["id_cache"]]["future"] = future
+    return en_cours, resultats
+
+def attendre_analyse(id_cache, timeout=None):
+    """Attend la fin d'une tâche soumise par ce processus (utile hors serveur web, ex. cron)."""
+    with _verrou:
+        future = (_taches.get(id_cache) or {}).get("future")
+    if future: future.result(timeout=timeout)
+
+def etat_analyse(db, id_cache):
+    """Retourne (etat, resultat) pour une cible : 'termine', 'erreur', 'en_cours' ou 'inconnue'.
+    Une analyse en cours (ici, ou d'après son verrou dans un autre processus) prime sur le document de
+    cache, qui peut être une prédiction périmée qu'elle est en train de remplacer ; ce document n'est un
+    résultat que s'il part du dernier tirage connu."""
+    with _verrou:
+        tache = _taches.get(id_cache)
+        if tache:
+            return tache["etat"], tache["resultat"]
+    # Tâche exécutée (ou en cours) dans un autre processus : l'état fait foi dans Firestore
+    doc_cache = db.collection('predictions_cache').document(id_cache).get()
+    metriques.compter_lectures('predictions_cache')
+    dernier_tirage = dernier_tirage_connu()
+    if doc_cache.exists and dernier_tirage and resultat_cache_valide(doc_cache.to_dict(), dernier_tirage):
+        return "termine", doc_cache.to_dict()
+    if _verrou_actif(db, id_cache):
+        return "en_cours", None
+    if doc_cache.exists and not dernier_tirage:
+        return "termine", doc_cache.to_dict()  # dernier tirage inconnu : le résultat enregistré fait foi
+    return "inconnue", None
+
+def suivre_analyse(db, id_cache, depuis=0):
+    """Générateur des événements d'une analyse à partir du n° `depuis` : (numero, type, donnees).
+    Produit None après INTERVALLE_SUIVI secondes sans événement (maintien de la connexion) et se
+    termine par (numero, "fin", etat) quand la tâche n'est plus en cours."""
+    while True:
+        with _nouvel_evenement:
+            tache = _taches.get(id_cache)
+            if tache and depuis >= len(tache["evenements"]) and tache["etat"] == "en_cours":
+                _nouvel_evenement.wait(INTERVALLE_SUIVI)
+            nouveaux = tache["evenements"][depuis:] if tache else []
+            etat = tache["etat"] if tache else None
+        for evenement, donnees in nouveaux:
+            yield depuis, evenement, donnees
+            depuis += 1
+        if tache is None:
+            # Tâche d'un autre processus : seul son état final (Firestore) est visible
+            etat, _ = etat_analyse(db, id_cache)
+            if etat == "en_cours":
+                yield None; time.sleep(INTERVALLE_SUIVI); continue
+        if etat != "en_cours":
+            yield depuis, "fin", etat
+            return
+        if not nouveaux: yield None
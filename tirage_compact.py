@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# Ce fichier définit la représentation compacte d'un tirage, utilisée par la lecture (copie locale,
+# Firestore), l'analyse et le collecteur : une date, un nom et deux masques 90 bits (entiers Python)
+# au lieu d'un dict de listes. Appartenance et intersection deviennent des opérations bit à bit.
+# Les documents Firestore et les réponses de l'API restent des dicts ({date_obj, nom_du_tirage, gagnants, machine}).
+
+import sys
+from datetime import datetime
+
+# --- CONFIGURATIONS ---
+NUMERO_MAX = 90
+
+def masque_numeros(numeros):
+    """Masque 90 bits (bit n-1 pour le numéro n) ; les numéros hors 1-90 sont ignorés."""
+    masque = 0
+    for n in numeros:
+        if 1 <= n <= NUMERO_MAX: masque |= 1 << (n - 1)
+    return masque
+
+def numeros_masque(masque):
+    """Numéros (croissants) d'un masque 90 bits."""
+    numeros = []
+    while masque:
+        bit = masque & -masque
+        numeros.append(bit.bit_length()); masque ^= bit
+    return numeros
+
+class Tirage:
+    __slots__ = ("date_obj", "nom_du_tirage", "masque_gagnants", "masque_machine")
+
+    def __init__(self, date_obj, nom_du_tirage, masque_gagnants, masque_machine):
+        self.date_obj = date_obj
+        self.nom_du_tirage = sys.intern(nom_du_tirage) if isinstance(nom_du_tirage, str) else nom_du_tirage
+        self.masque_gagnants = masque_gagnants
+        self.masque_machine = masque_machine
+
+    @classmethod
+    def depuis_numeros(cls, date_obj, nom_du_tirage, gagnants, machine):
+        return cls(date_obj, nom_du_tirage, masque_numeros(gagnants), masque_numeros(machine))
+
+    @classmethod
+    def depuis_dict(cls, donnees):
+        """Tirage à partir d'un document Firestore ou des données du collecteur."""
+        date_obj = donnees.get('date_obj')
+        if isinstance(date_obj, str): date_obj = datetime.fromisoformat(date_obj)
+        return cls.depuis_numeros(date_obj, donnees.get('nom_du_tirage'), donnees.get('gagnants', []), donnees.get('machine', []))
+
+    def vers_dict(self):
+        """Format des documents Firestore (numéros triés : l'ordre de sortie n'est pas conservé)."""
+        return {"date_obj": self.date_obj, "nom_du_tirage": self.nom_du_tirage, "gagnants": self.gagnants, "machine": self.machine}
+
+    @property
+    def masque(self):
+        return self.masque_gagnants | self.masque_machine
+
+    @property
+    def numeros_sortis(self):
+        return numeros_masque(self.masque)
+
+    @property
+    def gagnants(self):
+        return numeros_masque(self.masque_gagnants)
+
+    @property
+    def machine(self):
+        return numeros_masque(self.masque_machine)
+
+    def contient(self, numero):
+        return (self.masque >> (numero - 1)) & 1 == 1
+
+    def __repr__(self):
+        return f"Tirage({self.date_obj:%Y-%m-%d %H:%M}, {self.nom_du_tirage!r}, {self.gagnants}, {self.machine})"